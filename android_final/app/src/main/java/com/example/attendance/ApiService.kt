@@ -12,6 +12,20 @@ data class TokenRes(val access: String, val refresh: String?)
 data class ClockReq(val latitude: Double, val longitude: Double, val type: String?, val work_location_id: Int?)
 data class ClockRes(val ok: Boolean, val within_geofence: Boolean, val distance_m: Double, val type: String, val timestamp: String)
 
+data class ClockTicketRes(val ok: Boolean, val ticket: Int, val verification: String, val within_geofence: Boolean, val distance_m: Double, val type: String, val timestamp: String)
+data class ClockStatusRes(val ok: Boolean, val ticket: Int, val verification: String, val message: String?, val type: String, val timestamp: String, val within_geofence: Boolean)
+
+data class OfflinePunch(
+    val client_id: String, val timestamp: String,
+    val latitude: Double, val longitude: Double,
+    val work_location_id: Int?, val type: String?, val image: String
+)
+data class BatchItemRes(
+    val client_id: String, val status: String, val id: Int?, val type: String?,
+    val within_geofence: Boolean?, val distance_m: Double?, val message: String?
+)
+data class ClockBatchRes(val ok: Boolean, val results: List<BatchItemRes>)
+
 data class WorkLocation(val id: Int, val name: String, val latitude: Double, val longitude: Double, val radius_m: Int)
 data class Shift(val id: Int, val name: String, val start_time: String, val end_time: String)
 data class EmployeeMe(
@@ -55,6 +69,28 @@ interface ApiService {
     @POST("api/clock/")
     fun clock(@Body req: ClockReq): Call<ClockRes>
 
+    // Chấm công trì hoãn: server trả ticket ngay, xác thực khuôn mặt chạy nền
+    @Multipart
+    @POST("api/clock/async/")
+    fun clockAsync(
+        @Part("latitude") latitude: RequestBody,
+        @Part("longitude") longitude: RequestBody,
+        @Part("work_location_id") work_location_id: RequestBody?,
+        @Part face_image: MultipartBody.Part
+    ): Call<ClockTicketRes>
+
+    // Đồng bộ các lượt chấm công offline trong một request.
+    // `punches` là JSON list OfflinePunch; mỗi ảnh là một part có tên trùng OfflinePunch.image
+    @Multipart
+    @POST("api/clock/batch/")
+    fun clockBatch(
+        @Part("punches") punches: RequestBody,
+        @Part images: List<MultipartBody.Part>
+    ): Call<ClockBatchRes>
+
+    @GET("api/clock/status/{ticket}/")
+    fun clockStatus(@Path("ticket") ticket: Int): Call<ClockStatusRes>
+
     @GET("api/employee/me/")
     fun me(): Call<EmployeeMe>
 
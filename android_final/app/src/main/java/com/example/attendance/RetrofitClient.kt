@@ -2,11 +2,13 @@
 package com.example.attendance
 
 import android.content.Context
+import okhttp3.Cache
 import okhttp3.Interceptor
 import okhttp3.OkHttpClient
 import okhttp3.Response
 import retrofit2.Retrofit
 import retrofit2.converter.gson.GsonConverterFactory
+import java.io.File
 
 class AuthInterceptor(private val context: Context) : Interceptor {
     override fun intercept(chain: Interceptor.Chain): Response {
@@ -21,8 +23,10 @@ class AuthInterceptor(private val context: Context) : Interceptor {
 object RetrofitClient {
     fun retrofit(context: Context): Retrofit {
         val base = if (Config.BASE_URL.endsWith("/")) Config.BASE_URL else Config.BASE_URL + "/"
+        // Cache HTTP trên đĩa: OkHttp tự gửi If-None-Match và dùng lại bản đã lưu khi server trả 304
         val client = OkHttpClient.Builder()
             .addInterceptor(AuthInterceptor(context))
+            .cache(Cache(File(context.cacheDir, "http"), 5L * 1024 * 1024))
             .build()
         return Retrofit.Builder()
             .baseUrl(base)
@@ -1,6 +1,15 @@
 
-from django.contrib import admin
-from .models import Department, Position, Role, WorkLocation, Shift, Employee, Attendance, AttendanceChangeLog
+import os
+
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from . import enrollment
+from .timesheet import refresh_for_attendance
+from .models import Department, Position, Role, WorkLocation, Shift, Employee, ArchivedMonth, Attendance, AttendanceChangeLog, DailyTimesheet
 
 admin.site.register([Department, Position, Role, WorkLocation, Shift])
 
@@ -8,6 +17,40 @@ admin.site.register([Department, Position, Role, WorkLocation, Shift])
 class EmployeeAdmin(admin.ModelAdmin):
     list_display = ("id","user","phone","department","position","role","shift","is_active")
     search_fields = ("user__username","user__first_name","user__last_name","phone")
+    change_list_template = "admin/attendance/employee/change_list.html"
+
+    def get_urls(self):
+        return [
+            path("enroll-archive/", self.admin_site.admin_view(self.enroll_archive_view), name="attendance_employee_enroll_archive"),
+        ] + super().get_urls()
+
+    def enroll_archive_view(self, request):
+        """Tải lên file zip ảnh khuôn mặt và đăng ký hàng loạt trong luồng nền (xem enrollment.py)."""
+        if not self.has_change_permission(request):
+            return redirect("admin:index")
+        if request.method == "POST":
+            if request.POST.get("resume"):
+                # Chỉ nhận tên file trong thư mục upload, không nhận đường dẫn tuỳ ý
+                path = os.path.join(enrollment.upload_dir(), os.path.basename(request.POST["resume"]))
+                if os.path.exists(path) and enrollment.start_job(path):
+                    messages.success(request, f"Tiếp tục đăng ký khuôn mặt từ {os.path.basename(path)}.")
+            elif request.FILES.get("archive"):
+                f = request.FILES["archive"]
+                name = f"{timezone.now():%Y%m%d%H%M%S}_{os.path.basename(f.name)}"
+                if not name.lower().endswith(".zip"):
+                    messages.error(request, "Chỉ nhận file .zip.")
+                    return redirect("admin:attendance_employee_enroll_archive")
+                path = os.path.join(enrollment.upload_dir(), name)
+                with open(path, "wb") as out:
+                    for chunk in f.chunks():
+                        out.write(chunk)
+                enrollment.start_job(path, overwrite=bool(request.POST.get("overwrite")))
+                messages.success(request, f"Đã tải lên {name}, đang đăng ký khuôn mặt.")
+            return redirect("admin:attendance_employee_enroll_archive")
+
+        context = dict(self.admin_site.each_context(request), title="Đăng ký khuôn mặt hàng loạt",
+                       opts=self.model._meta, jobs=enrollment.list_jobs())
+        return TemplateResponse(request, "admin/attendance/employee/enroll_archive.html", context)
 
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
@@ -15,6 +58,29 @@ class AttendanceAdmin(admin.ModelAdmin):
     search_fields = ("employee__user__username",)
     list_filter = ("type","within_geofence","work_location")
 
+    def save_model(self, request, obj, form, change):
+        # Cập nhật DailyTimesheet như web_attendance_edit; xoá được xử lý qua signal (timesheet.py)
+        previous = Attendance.objects.filter(pk=obj.pk).values_list("employee_id", "timestamp").first() if change else None
+        if change:
+            # changed_at nằm trong ETag của lịch sử chấm công (views._history)
+            obj.changed_by, obj.changed_at = request.user, timezone.now()
+        super().save_model(request, obj, form, change)
+        refresh_for_attendance(obj, previous)
+
 @admin.register(AttendanceChangeLog)
 class AttendanceChangeLogAdmin(admin.ModelAdmin):
-    list_display = ("id","attendance","action","changed_by","changed_at")
+    # attendance_id thay cho attendance: bản chấm công có thể đã được lưu trữ khỏi bảng
+    list_display = ("id","attendance_id","action","changed_by","changed_at")
+    raw_id_fields = ("attendance",)
+
+@admin.register(DailyTimesheet)
+class DailyTimesheetAdmin(admin.ModelAdmin):
+    list_display = ("id","employee","date","total_hours","first_in","last_out","late","early_leave","pair_count")
+    search_fields = ("employee__user__username",)
+    list_filter = ("late","early_leave")
+    date_hierarchy = "date"
+
+@admin.register(ArchivedMonth)
+class ArchivedMonthAdmin(admin.ModelAdmin):
+    list_display = ("year","month","rows","filename","archived_at")
+    readonly_fields = ("year","month","filename","rows","sha256","archived_at")
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class AttendanceConfig(AppConfig):
     name = "attendance"
+
+    def ready(self):
+        from . import monitor, refdata, timesheet
+        refdata.connect_signals()
+        monitor.connect_signals()
+        timesheet.connect_signals()
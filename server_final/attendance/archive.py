@@ -0,0 +1,298 @@
+"""
+Lưu trữ các tháng chấm công đã đóng ra file NPZ nén theo cột, để bảng Attendance
+chỉ giữ ATTENDANCE_RETENTION_MONTHS tháng gần nhất.
+
+Mỗi tháng (theo giờ địa phương) là một file attendance-YYYY-MM.npz trong
+ATTENDANCE_ARCHIVE_DIR: mỗi cột của Attendance là một mảng NumPy (thời điểm là
+datetime64[us] UTC, chuỗi là mảng unicode), nén bằng np.savez_compressed và đọc
+lại không cần pickle. Chỉ những dòng đã nằm trong file mới bị xoá khỏi bảng, sau khi
+file đã được ghi, đọc lại và so đủ số dòng; bảng ArchivedMonth ghi lại tháng, số
+dòng và sha256 của file.
+
+Báo cáo tháng đọc DailyTimesheet (không bị lưu trữ). Khi cần đọc lại lượt chấm
+công thô của một tháng đã lưu trữ (rebuild_timesheets, sửa công một ngày cũ),
+timesheet.iter_punch_days và refresh_day ghép thêm dữ liệu từ các file này.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import dashboard_cache, partitions
+from .models import ArchivedMonth, Attendance
+from .refdata import refdata
+
+FIELDS = (
+    "id", "employee_id", "timestamp", "type", "latitude", "longitude", "distance_m", "within_geofence",
+    "work_location_id", "note", "verification", "verification_message", "client_id",
+    "created_by_id", "changed_by_id", "changed_at",
+)
+ID_FIELDS = ("id", "employee_id", "work_location_id", "created_by_id", "changed_by_id")
+TIME_FIELDS = ("timestamp", "changed_at")
+FLOAT_FIELDS = ("latitude", "longitude", "distance_m")
+DELETE_BATCH = 900  # dưới giới hạn 999 tham số của SQLite
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_dir():
+    path = getattr(settings, "ATTENDANCE_ARCHIVE_DIR", os.path.join(settings.BASE_DIR, "archive"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def filename_for(year, month):
+    return f"attendance-{year:04d}-{month:02d}.npz"
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _to_arrays(rows):
+    import numpy as np
+    cols = dict(zip(FIELDS, zip(*rows))) if rows else {f: () for f in FIELDS}
+    out = {}
+    for f in FIELDS:
+        values = cols[f]
+        if f in ID_FIELDS:
+            out[f] = np.array([-1 if v is None else v for v in values], dtype=np.int64)  # -1: NULL
+        elif f in TIME_FIELDS:
+            out[f] = np.array([None if v is None else v.astimezone(timezone.utc).replace(tzinfo=None) for v in values],
+                              dtype="datetime64[us]")  # None -> NaT
+        elif f in FLOAT_FIELDS:
+            out[f] = np.array(values, dtype=np.float64)
+        elif f == "within_geofence":
+            out[f] = np.array(values, dtype=bool)
+        else:
+            out[f] = np.array(["" if v is None else v for v in values], dtype=str)
+    return out
+
+
+def write_month(year, month, path, previous=None):
+    """
+    Ghi mọi lượt chấm công của tháng trong bảng ra `path`, nối sau các cột `previous`
+    (dữ liệu đã lưu trữ trước đó của cùng tháng) nếu có; dòng đã có trong `previous`
+    (cùng id) không bị ghi lặp. Trả về (số dòng của file, id các dòng đã đọc từ bảng).
+    """
+    import numpy as np
+    lo, hi = partitions.month_range(year, month)
+    rows = list(Attendance.objects.filter(timestamp__gte=lo, timestamp__lt=hi)
+                .order_by("employee_id", "timestamp", "id").values_list(*FIELDS))
+    ids = [r[0] for r in rows]
+    if previous is not None:
+        done = set(previous["id"].tolist())
+        rows = [r for r in rows if r[0] not in done]
+    arrays = _to_arrays(rows)
+    if previous is not None:
+        arrays = {f: np.concatenate([previous[f], arrays[f]]) for f in FIELDS}
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+    return len(arrays["id"]), ids
+
+
+def closed_months(keep_months=None, today=None):
+    """Các tháng (năm, tháng) còn trong bảng Attendance nhưng đã ra khỏi khoảng giữ lại."""
+    keep = getattr(settings, "ATTENDANCE_RETENTION_MONTHS", 24) if keep_months is None else keep_months
+    today = today or timezone.localdate()
+    cutoff = partitions.add_months(today.year, today.month, -max(keep, 1))
+    first = Attendance.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+    if first is None:
+        return []
+    first = timezone.localtime(first)
+    months, ym = [], (first.year, first.month)
+    while ym <= cutoff:
+        months.append(ym)
+        ym = partitions.add_months(*ym, 1)
+    return months
+
+
+def archive_month(year, month):
+    """
+    Chuyển một tháng từ bảng Attendance sang file lưu trữ. Nếu tháng đã được lưu trữ
+    trước đó (có bản chấm công bổ sung sau), các dòng mới được gộp vào file cũ.
+    Trả về số dòng đã chuyển khỏi bảng.
+
+    Chỉ các dòng đã ghi vào file bị xoá, trong cùng transaction với ArchivedMonth: dòng
+    chèn vào tháng trong lúc ghi file vẫn còn trong bảng cho lần chạy sau. Nếu
+    transaction lỗi sau khi file đã được thay, lần chạy sau đọc lại file đó và bỏ qua
+    các id đã có, nên không ghi trùng.
+    """
+    lo, hi = partitions.month_range(year, month)
+    if not Attendance.objects.filter(timestamp__gte=lo, timestamp__lt=hi).exists():
+        return 0
+    # Đọc file trên đĩa chứ không theo ArchivedMonth: file có thể đã được thay ở lần chạy lỗi trước
+    path = os.path.join(archive_dir(), filename_for(year, month))
+    previous = read_month_file(path) if os.path.exists(path) else None
+
+    with transaction.atomic():
+        # PostgreSQL: chặn ghi vào phân vùng của tháng tới khi commit, để bỏ cả phân vùng an toàn
+        whole = partitions.lock(year, month)
+        # Ghi ra file mới rồi mới thay file cũ: lỗi giữa chừng không làm mất dữ liệu đã lưu trữ
+        count, ids = write_month(year, month, f"{path}.new", previous)
+        written = read_month_file(f"{path}.new")["id"]
+        if len(written) != count:
+            os.remove(f"{path}.new")
+            raise ArchiveError(f"File lưu trữ {path} không khớp số dòng, đã huỷ.")
+        os.replace(f"{path}.new", path)
+
+        ArchivedMonth.objects.update_or_create(year=year, month=month, defaults={
+            "filename": os.path.basename(path), "rows": count, "sha256": _sha256(path),
+            "min_id": int(written.min()), "max_id": int(written.max()), "archived_at": timezone.now(),
+        })
+        if whole:
+            partitions.drop(year, month)
+        else:
+            # SQLite / tháng nằm trong phân vùng DEFAULT: xoá theo id, không qua Collector
+            # của ORM (log sửa công được giữ lại, xem AttendanceChangeLog)
+            for i in range(0, len(ids), DELETE_BATCH):
+                (Attendance.objects.filter(timestamp__gte=lo, timestamp__lt=hi, id__in=ids[i:i + DELETE_BATCH])
+                 ._raw_delete(connection.alias))
+    dashboard_cache.invalidate_all()
+    return len(ids)
+
+
+def restore_month(year, month):
+    """Đưa một tháng đã lưu trữ trở lại bảng Attendance (để sửa dữ liệu cũ). Trả về số dòng."""
+    am = ArchivedMonth.objects.filter(year=year, month=month).first()
+    if am is None:
+        raise ArchiveError(f"Tháng {year}-{month:02d} chưa được lưu trữ.")
+    data = load_month(year, month)
+    objs = [Attendance(**row) for row in _iter_records(data)]
+    with transaction.atomic():
+        if partitions.enabled():
+            partitions.create(year, month)
+        Attendance.objects.bulk_create(objs, batch_size=1000)
+        am.delete()
+    os.remove(os.path.join(archive_dir(), am.filename))
+    dashboard_cache.invalidate_all()
+    return len(objs)
+
+
+# ----------------- ĐỌC -----------------
+
+def read_month_file(path):
+    import numpy as np
+    with np.load(path, allow_pickle=False) as npz:
+        return {f: npz[f] for f in FIELDS}
+
+
+@lru_cache(maxsize=4)
+def _load_cached(path, sha256):
+    return read_month_file(path)
+
+
+def load_month(year, month):
+    """Các cột của một tháng đã lưu trữ (dict tên trường -> mảng), giữ tối đa 4 tháng trong bộ nhớ."""
+    am = archived_months().get((year, month))
+    if am is None:
+        raise ArchiveError(f"Tháng {year}-{month:02d} chưa được lưu trữ.")
+    return _load_cached(os.path.join(archive_dir(), am.filename), am.sha256)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _aware(dt64):
+    return _EPOCH + timedelta(microseconds=int(dt64.astype("datetime64[us]").astype("int64")))
+
+
+def _iter_records(data, mask=None):
+    import numpy as np
+    idx = np.flatnonzero(mask) if mask is not None else range(len(data["id"]))
+    for i in idx:
+        row = {}
+        for f in FIELDS:
+            v = data[f][i]
+            if f in ID_FIELDS:
+                row[f] = None if v < 0 else int(v)
+            elif f in TIME_FIELDS:
+                row[f] = None if np.isnat(v) else _aware(v)
+            elif f in FLOAT_FIELDS:
+                row[f] = float(v)
+            elif f == "within_geofence":
+                row[f] = bool(v)
+            else:
+                row[f] = str(v) or (None if f == "client_id" else "")
+        yield row
+
+
+def find_record(attendance_id):
+    """
+    Bản ghi (dict theo FIELDS) của lượt chấm công `attendance_id` trong các file lưu
+    trữ, hoặc None. Chỉ mở các file có khoảng id (ArchivedMonth.min_id/max_id) chứa nó.
+    """
+    for ym, am in sorted(archived_months().items(), reverse=True):
+        if am.min_id is not None and not am.min_id <= attendance_id <= am.max_id:
+            continue
+        data = load_month(*ym)
+        mask = data["id"] == attendance_id
+        if mask.any():
+            return next(_iter_records(data, mask))
+    return None
+
+
+def iter_employee_records(employee_id, lo, hi):
+    """Bản ghi (dict theo FIELDS) của nhân viên `employee_id` trong [lo, hi) ở các tháng đã lưu trữ."""
+    import numpy as np
+    lo64 = np.datetime64(lo.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    hi64 = np.datetime64(hi.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    for ym in archived_overlap(lo, hi):
+        data = load_month(*ym)
+        mask = (data["employee_id"] == employee_id) & (data["timestamp"] >= lo64) & (data["timestamp"] < hi64)
+        yield from _iter_records(data, mask)
+
+
+def archived_months():
+    """(năm, tháng) -> ArchivedMonth, lấy từ cache dữ liệu tham chiếu."""
+    return {(am.year, am.month): am for am in refdata.all("archived_months")}
+
+
+def archived_overlap(lo, hi):
+    """Các tháng đã lưu trữ giao với khoảng [lo, hi), theo thứ tự thời gian."""
+    months = archived_months()
+    if not months:
+        return []
+    lo, hi = timezone.localtime(lo), timezone.localtime(hi)
+    out, ym = [], (lo.year, lo.month)
+    while partitions.month_range(*ym)[0] < hi:
+        if ym in months:
+            out.append(ym)
+        ym = partitions.add_months(*ym, 1)
+    return out
+
+
+def iter_punches(lo, hi, employee_ids=None):
+    """
+    Sinh (employee_id, timestamp, type) từ các tháng đã lưu trữ trong [lo, hi), bỏ qua
+    lượt bị từ chối, theo thứ tự (employee_id, timestamp) như timesheet.iter_punch_days.
+    """
+    import numpy as np
+    chunks = []
+    lo64 = np.datetime64(lo.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    hi64 = np.datetime64(hi.astimezone(timezone.utc).replace(tzinfo=None), "us")
+    for ym in archived_overlap(lo, hi):
+        data = load_month(*ym)
+        mask = (data["timestamp"] >= lo64) & (data["timestamp"] < hi64) & (data["employee_id"] >= 0)
+        mask &= data["verification"] != "rejected"
+        if employee_ids is not None:
+            mask &= np.isin(data["employee_id"], np.fromiter(employee_ids, dtype=np.int64))
+        chunks.append((data["employee_id"][mask], data["timestamp"][mask], data["type"][mask]))
+    if not chunks:
+        return
+    emp, ts, typ = (np.concatenate(c) for c in zip(*chunks))
+    order = np.lexsort((ts, emp))
+    for i in order:
+        yield int(emp[i]), _aware(ts[i]), str(typ[i])
@@ -0,0 +1,180 @@
+"""
+Bản ASGI của các API di động: api_clock, api_history, api_employee_me.
+
+Django 3.0 chưa có view async lẫn ORM async, và ASGIHandler của nó chạy mọi view
+đồng bộ trên cùng một luồng (sync_to_async thread-sensitive), nên một lượt nhận
+diện chậm chặn cả request nhẹ như /api/employee/me/. AsyncAPIHandler (server/asgi.py)
+phục vụ thẳng các đường dẫn trên bằng coroutine: truy vấn DB chạy trong thread pool
+(_db), còn face engine được chờ trên event loop mà không giữ luồng nào. Logic nghiệp
+vụ dùng chung với view đồng bộ trong views.py; các request khác vẫn đi qua Django
+nhưng view chạy song song trong thread pool.
+
+Các đường dẫn này chỉ xác thực bằng JWT và không đi qua middleware (session, CSRF,
+CORS) — giống app di động đang dùng chúng.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, QueryDict
+from django.urls import reverse, set_script_prefix
+from rest_framework.exceptions import AuthenticationFailed, MethodNotAllowed, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import verification, views
+
+logger = logging.getLogger(__name__)
+
+_jwt = JWTAuthentication()
+_renderer = JSONRenderer()
+
+
+def _in_thread(fn, *args, **kwargs):
+    # Như một request đồng bộ: bỏ kết nối DB đã hết hạn (CONN_MAX_AGE) của luồng này
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def _db(fn, *args, **kwargs):
+    """Chạy hàm đồng bộ (ORM) trong thread pool, không chặn event loop."""
+    return await sync_to_async(_in_thread, thread_sensitive=False)(fn, *args, **kwargs)
+
+
+def _render(resp):
+    """DRF Response (chưa render) -> HttpResponse JSON, giữ các header như ETag, Retry-After."""
+    out = HttpResponse(b"" if resp.data is None else _renderer.render(resp.data),
+                       status=resp.status_code, content_type="application/json")
+    for key, value in resp.items():
+        if key.lower() != "content-type":
+            out[key] = value
+    return out
+
+
+def _error(exc):
+    """Response của DRF cho một APIException (cùng thông báo đã dịch)."""
+    return Response({"detail": exc.detail}, status=exc.status_code)
+
+
+def _request_data(request):
+    """Thân request như request.data của DRF (JSON hoặc form)."""
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    if request.method == "POST":
+        return request.POST
+    return QueryDict(request.body, encoding=request.encoding)
+
+
+def _authenticate(request):
+    """Gán request.user từ token JWT; trả về Response 401 nếu không xác thực được."""
+    try:
+        user_auth = _jwt.authenticate(request)
+    except AuthenticationFailed as e:
+        user_auth, error = None, e.detail
+    else:
+        error = NotAuthenticated.default_detail
+    if user_auth is None:
+        # Cùng dạng với DRF: simplejwt trả detail là dict kèm mã lỗi
+        return Response(error if isinstance(error, dict) else {"detail": error}, status=401,
+                        headers={"WWW-Authenticate": _jwt.authenticate_header(request)})
+    request.user = user_auth[0]
+    return None
+
+
+def _authenticated(view, request, *args):
+    # Xác thực và view chạy trong cùng một lượt sang thread pool
+    return _authenticate(request) or view(request, *args)
+
+
+async def api_clock(request):
+    result = await _db(_authenticated, views._clock_employee, request)
+    if isinstance(result, Response):  # chưa xác thực
+        return result
+    emp, live_image_bytes, error = result
+    if error is not None:
+        return error
+    try:
+        # Ảnh được giải mã và chạy model trong process pool; coroutine chỉ chờ kết quả
+        ok, message = await verification.verify_face_async(emp, live_image_bytes)
+    except Exception as e:
+        return views._face_error_response(e)
+    return await _db(views._clock_verified, request, emp, ok, message)
+
+
+async def api_history(request):
+    return await _db(_authenticated, views._history, request)
+
+
+async def api_employee_me(request):
+    try:
+        request.data = _request_data(request)
+    except ValueError:
+        return Response({"detail": "JSON parse error."}, status=400)
+    return await _db(_authenticated, views._employee_me, request)
+
+
+class AsyncAPIHandler(ASGIHandler):
+    """ASGIHandler phục vụ ROUTES bằng coroutine, các đường dẫn khác như Django."""
+
+    # tên URL -> (view async, các method được phép)
+    ROUTES = {
+        "api_clock": (api_clock, ("POST",)),
+        "api_history": (api_history, ("GET",)),
+        "api_employee_me": (api_employee_me, ("GET", "PATCH")),
+    }
+
+    def __init__(self):
+        super().__init__()
+        self._routes = None
+
+    def routes(self):
+        if self._routes is None:
+            self._routes = {reverse(name): route for name, route in self.ROUTES.items()}
+        return self._routes
+
+    async def __call__(self, scope, receive, send):
+        route = None
+        if scope["type"] == "http":
+            route = self.routes().get(scope["path"][len(scope.get("root_path", "")):])
+        if route is None:
+            return await super().__call__(scope, receive, send)
+
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+        set_script_prefix(self.get_script_prefix(scope))
+        request, error_response = self.create_request(scope, body_file)
+        if request is None:
+            await self.send_response(error_response, send)
+            return
+        await self.send_response(await self._dispatch(route, request), send)
+
+    async def _dispatch(self, route, request):
+        view, methods = route
+        if request.method not in methods:
+            # Như DRF: xác thực trước, nên request chưa xác thực nhận 401 chứ không phải 405
+            resp = await _db(_authenticate, request) or _error(MethodNotAllowed(request.method))
+        else:
+            try:
+                resp = await view(request)
+            except Http404:
+                resp = _error(NotFound())
+            except Exception:
+                logger.exception("Lỗi xử lý %s %s", request.method, request.path)
+                resp = Response({"detail": "Lỗi máy chủ."}, status=500)
+        # DRF gửi Allow trên mọi response của view
+        resp["Allow"] = ", ".join(methods + ("OPTIONS",))
+        return _render(resp)
+
+    async def get_response(self, request):
+        # ASGIHandler của Django 3.0 gọi get_response qua sync_to_async mặc định
+        # (thread-sensitive) nên mọi request xếp hàng trên một luồng; chạy trong thread pool
+        return await _db(super().get_response, request)
@@ -0,0 +1,132 @@
+"""
+Nhật ký sửa công (AttendanceChangeLog) dạng delta.
+
+Mỗi log chỉ lưu các trường thay đổi: {"trường": [giá trị cũ, giá trị mới]}, địa
+điểm lưu bằng work_location_id. Ảnh chụp các trường được đọc thẳng từ instance nên
+ghi log không tốn thêm truy vấn nào ngoài lệnh INSERT. Log "created" chứa mọi
+trường (giá trị cũ là None), nên phát lại các delta theo thứ tự sẽ dựng lại được
+bất kỳ phiên bản nào của bản chấm công, kể cả khi bản ghi đã được lưu trữ khỏi bảng.
+
+Chỉ bản chấm công tạo trên web có log "created"; lượt chấm công từ app, kiosk và lô
+offline không ghi log trên đường chấm công. Với các bản này versions() lấy bản ghi
+hiện tại (trong bảng hoặc file lưu trữ) rồi hoàn tác các delta từ mới về cũ để có
+phiên bản ban đầu.
+"""
+from datetime import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Attendance, AttendanceChangeLog
+
+TRACKED_FIELDS = (
+    "employee_id", "type", "timestamp", "latitude", "longitude", "distance_m", "within_geofence",
+    "work_location_id", "note", "verification",
+)
+
+
+def _json(v):
+    # Thời điểm luôn ở UTC để cùng một giá trị không bị coi là thay đổi vì khác múi giờ
+    return v.astimezone(timezone.utc).isoformat() if isinstance(v, datetime) else v
+
+
+def snapshot(att):
+    """Giá trị các trường được theo dõi của `att`, dạng JSON, không truy vấn DB."""
+    return {f: _json(getattr(att, f)) for f in TRACKED_FIELDS}
+
+
+def diff(before, after):
+    """{trường: [cũ, mới]} cho các trường khác nhau giữa hai ảnh chụp."""
+    return {f: [before.get(f), after.get(f)] for f in TRACKED_FIELDS if before.get(f) != after.get(f)}
+
+
+def log_change(att, action, before=None, user=None, reason=""):
+    """
+    Ghi log cho `att` sau khi lưu. `before` là snapshot() trước khi sửa (None khi tạo
+    mới). Không ghi gì nếu không có trường nào đổi. Gọi trong cùng transaction với lệnh lưu.
+    """
+    changes = diff(before or {}, snapshot(att))
+    if not changes and action != "created":
+        return None
+    return AttendanceChangeLog.objects.create(
+        attendance_id=att.pk, action=action, reason=reason[:255], changes=changes,
+        changed_by_id=user.pk if user else None,
+    )
+
+
+def _created(attendance_id, logs):
+    """
+    Phiên bản ban đầu dựng từ bản ghi hiện tại cho bản chấm công không có log
+    "created", dạng một log giả; None nếu bản ghi không còn ở đâu.
+    """
+    from . import archive
+    row = (Attendance.objects.filter(pk=attendance_id).values(*TRACKED_FIELDS, "created_by_id").first()
+           or archive.find_record(attendance_id))
+    if row is None:
+        return None
+    state = {f: _json(row[f]) for f in TRACKED_FIELDS}
+    for log in reversed(logs):
+        for field, (old, _) in log["changes"].items():
+            state[field] = old
+    created_at = parse_datetime(state["timestamp"]) if state["timestamp"] else None
+    if logs and (created_at is None or created_at > logs[0]["changed_at"]):
+        created_at = logs[0]["changed_at"]
+    return {
+        "id": None, "action": "created", "reason": "", "changed_by_id": row["created_by_id"],
+        "changed_at": created_at, "changes": {f: [None, v] for f, v in state.items() if v is not None},
+    }
+
+
+def employee_id(attendance_id):
+    """
+    Nhân viên của bản chấm công, để kiểm tra quyền trước khi dựng lịch sử: đọc bảng,
+    rồi log sửa (bản ghi đã xoá), cuối cùng mới tới file lưu trữ. None nếu không thấy.
+    """
+    from . import archive
+    row = Attendance.objects.filter(pk=attendance_id).values_list("employee_id", flat=True)
+    if row:
+        return row[0]
+    for changes in (AttendanceChangeLog.objects.filter(attendance_id=attendance_id)
+                    .order_by("-changed_at", "-id").values_list("changes", flat=True)):
+        if "employee_id" in changes:
+            return changes["employee_id"][1]
+    record = archive.find_record(attendance_id)
+    return record["employee_id"] if record else None
+
+
+def versions(attendance_id):
+    """
+    Các phiên bản của bản chấm công, cũ nhất trước: mỗi phần tử gồm số phiên bản (từ 1),
+    thông tin log và `data` là toàn bộ các trường sau thay đổi đó. Một truy vấn, thêm
+    một lần đọc bản ghi nếu bản chấm công không có log "created" (log_id là None).
+    """
+    state, out = {}, []
+    logs = list(AttendanceChangeLog.objects.filter(attendance_id=attendance_id)
+                .order_by("changed_at", "id")
+                .values("id", "action", "reason", "changes", "changed_by_id", "changed_at"))
+    if not logs or logs[0]["action"] != "created":
+        created = _created(attendance_id, logs)
+        if created is not None:
+            logs.insert(0, created)
+    for n, log in enumerate(logs, start=1):
+        for field, (_, new) in log["changes"].items():
+            state[field] = new
+        out.append({
+            "version": n, "log_id": log["id"], "action": log["action"], "reason": log["reason"],
+            "changed_by": log["changed_by_id"], "changed_at": log["changed_at"],
+            "changes": log["changes"], "data": dict(state),
+        })
+    return out
+
+
+def version_at(attendance_id, version=None, at=None, history=None):
+    """
+    Phiên bản số `version`, hoặc phiên bản có hiệu lực tại thời điểm `at`; None nếu
+    không có. `history` là kết quả versions() đã đọc sẵn, nếu có.
+    """
+    history = versions(attendance_id) if history is None else history
+    if version is not None:
+        return history[version - 1] if 1 <= version <= len(history) else None
+    if at is not None:
+        history = [v for v in history if v["changed_at"] <= at]
+    return history[-1] if history else None
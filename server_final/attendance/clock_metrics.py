@@ -0,0 +1,79 @@
+"""
+Số lần chấm công lại vì xác thực khuôn mặt thất bại, trên Django cache framework
+(dùng chung giữa các worker khi cache là Redis/Memcached).
+
+Mỗi lần bị từ chối tăng bộ đếm "đang chờ" của nhân viên (hết hạn sau
+CLOCK_RETRY_WINDOW giây). Lần xác thực thành công tiếp theo cộng bộ đếm đó vào tổng
+số lần thử lại và vào histogram 0/1/2/3+, rồi trừ bộ đếm về 0. Ghi nhận ở mọi
+đường xác thực: api_clock, kiosk, lô offline và xác thực trì hoãn.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIX = "attendance:clock_retry"
+BUCKETS = ("0", "1", "2", "3+")
+COUNTER_KEYS = ["successes", "failures", "retries"] + [f"hist:{b}" for b in BUCKETS]
+
+
+def _key(name):
+    return f"{PREFIX}:{name}"
+
+
+def _pending_key(emp_id):
+    return f"{PREFIX}:pending:{emp_id}"
+
+
+def _add(key, delta):
+    # Như dashboard_cache.bump nhưng cộng `delta`; bộ đếm không hết hạn
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def record_failure(emp_id):
+    """
+    Một lần xác thực khuôn mặt của `emp_id` bị từ chối. `emp_id` là None khi không
+    biết nhân viên (kiosk không khớp ai): chỉ tăng tổng số lần thất bại.
+    """
+    _add(_key("failures"), 1)
+    if emp_id is None:
+        return
+    key, ttl = _pending_key(emp_id), getattr(settings, "CLOCK_RETRY_WINDOW", 600)
+    if not cache.add(key, 1, ttl):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, ttl)  # vừa hết hạn giữa add và incr
+
+
+def record_success(emp_id):
+    """Xác thực thành công: ghi số lần thử lại trước đó của `emp_id`. Trả về số đó."""
+    key = _pending_key(emp_id)
+    retries = cache.get(key, 0)
+    if retries:
+        # Trừ đúng số đã đọc thay vì xoá khoá: lần thất bại ghi vào giữa get và decr
+        # vẫn còn lại cho lần thành công sau. Hai lần thành công đồng thời của cùng
+        # một nhân viên vẫn có thể cùng đếm các lần thử lại đó — hiếm, chấp nhận.
+        try:
+            cache.decr(key, retries)
+        except ValueError:
+            pass  # vừa hết hạn
+    _add(_key("successes"), 1)
+    _add(_key(f"hist:{BUCKETS[min(retries, 3)]}"), 1)
+    if retries:
+        _add(_key("retries"), retries)
+    return retries
+
+
+def snapshot():
+    """Các bộ đếm hiện tại và số lần thử lại trung bình cho mỗi lần chấm công thành công."""
+    values = cache.get_many([_key(k) for k in COUNTER_KEYS])
+    data = {k: values.get(_key(k), 0) for k in COUNTER_KEYS}
+    data["retries_per_success"] = round(data["retries"] / data["successes"], 3) if data["successes"] else None
+    return data
+
+
+def reset():
+    cache.delete_many([_key(k) for k in COUNTER_KEYS])
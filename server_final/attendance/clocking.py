@@ -0,0 +1,229 @@
+"""
+Đường ghi chấm công dùng chung cho api_clock và kiosk.
+
+Nhân viên được nạp một lần (1 truy vấn, trước khi xác thực khuôn mặt); ca làm
+việc và địa điểm được phép lấy từ cache dữ liệu tham chiếu (refdata.py). Sau khi
+xác thực, việc ghi tốn đúng 3 round-trip trong một transaction trên PostgreSQL
+(tests.ClockQueryTests):
+
+1. SELECT ... FOR UPDATE dòng DailyTimesheet của hôm nay: vừa khoá ngày, vừa có đủ
+   trạng thái ghép cặp (open_ins: các IN chưa ghép) để biết lượt kế tiếp là IN hay
+   OUT và tính lại ngày đúng như summarize_day (timesheet.append_punch);
+2. INSERT Attendance;
+3. UPDATE/INSERT DailyTimesheet.
+
+Cả request api_clock vì vậy là 5 truy vấn: user của JWT, nhân viên, rồi 3 lệnh trên.
+SQLite không có khoá dòng nên bước 1 tốn thêm một UPDATE (xem _lock_day). Nếu ngày
+đã có lượt muộn hơn hiện tại (lượt offline lệch giờ) thì đọc lại các lượt của ngày
+như refresh_day.
+
+Hai lần bấm đồng thời sẽ bị xếp hàng trên khoá ở bước 1; trên PostgreSQL, nếu dòng
+của ngày chưa tồn tại thì ràng buộc unique (employee, date) chặn lần ghi thứ hai.
+"""
+import bisect
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import clock_metrics, dashboard_cache, monitor
+from .models import Attendance, DailyTimesheet, Employee
+from .timesheet import append_punch, apply_punch, day_punches, latest_punch, next_type
+from .refdata import refdata
+from .utils import haversine_m
+
+
+class ClockError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def employee_queryset():
+    return Employee.objects.select_related("user")
+
+
+def resolve_location(emp, work_location_id=None, lat=None, lon=None, locations=None):
+    """
+    Địa điểm chấm công trong danh sách được phép (`locations`, mặc định đọc qua refdata).
+    Không chỉ định địa điểm thì chọn địa điểm gần nhất có bán kính chứa (lat, lon).
+    """
+    if locations is None:
+        locations = refdata.employee_locations(emp)
+    if work_location_id is None:
+        if not locations:
+            raise ClockError("Bạn chưa được cấu hình địa điểm chấm công.")
+        if lat is None or lon is None or len(locations) == 1:
+            return locations[0]
+        return refdata.location_index(locations).resolve(lat, lon)[0]
+    try:
+        work_location_id = int(work_location_id)
+    except (TypeError, ValueError):
+        raise ClockError("Địa điểm chấm công không hợp lệ.")
+    for loc in locations:
+        if loc.pk == work_location_id:
+            return loc
+    raise ClockError("Địa điểm này không thuộc phạm vi được phép.")
+
+
+SHEET_STATE = ("total_hours", "pair_count", "first_in", "last_out", "open_ins")
+
+
+def _lock_day(employee_id, day, fields=None):
+    """
+    Khoá dòng DailyTimesheet của (nhân viên, ngày) trong transaction hiện tại. Trả về
+    dict các trường `fields` của dòng (rỗng nếu không yêu cầu trường nào), hoặc None
+    nếu dòng chưa tồn tại. SQLite không có khoá dòng: một UPDATE không đổi gì mở
+    transaction ghi ngay từ đầu, nên lần bấm thứ hai chờ theo busy timeout rồi mới đọc
+    (kể cả khi dòng chưa tồn tại) thay vì lỗi "database is locked" khi nâng khoá.
+    """
+    sheets = DailyTimesheet.objects.filter(employee_id=employee_id, date=day)
+    if connection.features.has_select_for_update:
+        sheets = sheets.select_for_update()
+    elif not sheets.update(pair_count=F("pair_count")):
+        return None
+    elif not fields:
+        return {}
+    return sheets.values(*(fields or ("pk",))).first()
+
+
+def clock(emp, lat, lon, loc, t=None, user=None, verification="verified"):
+    """
+    Ghi một lượt chấm công cho `emp` tại `loc`. Trả về (Attendance, distance_m, within).
+    `verification="pending"` dùng cho chấm công trì hoãn (xem verification.py).
+    """
+    distance = haversine_m(lat, lon, loc.latitude, loc.longitude)
+    within = distance <= loc.radius_m
+    now = timezone.now()
+    day = timezone.localtime(now).date()
+    shift = refdata.get("shifts", emp.shift_id)
+
+    try:
+        with transaction.atomic():
+            sheet = _lock_day(emp.pk, day, SHEET_STATE)
+            latest = latest_punch(sheet) if sheet else None
+            if latest is None or latest <= now:
+                t, fields = append_punch(day, sheet, t, now, shift)
+            else:
+                ins, outs = day_punches(emp.pk, day)
+                if t not in ["IN", "OUT"]:
+                    t = next_type(ins, outs)
+                fields = apply_punch(day, ins, outs, t, now, shift)
+
+            att = Attendance.objects.create(
+                employee=emp, type=t, timestamp=now, latitude=lat, longitude=lon,
+                distance_m=round(distance, 2), within_geofence=within, work_location=loc, created_by=user,
+                verification=verification,
+            )
+            if sheet is not None:
+                DailyTimesheet.objects.filter(employee_id=emp.pk, date=day).update(**fields)
+            else:
+                DailyTimesheet.objects.create(employee_id=emp.pk, date=day, **fields)
+    except IntegrityError:
+        raise ClockError("Bạn vừa chấm công, vui lòng đợi giây lát rồi thử lại.", status=409)
+
+    dashboard_cache.invalidate_dates(day)
+    return att, distance, within
+
+
+def clock_batch(emp, items, user=None, max_age=timedelta(days=7), max_skew=timedelta(minutes=5)):
+    """
+    Ghi một lô chấm công offline của `emp`. Mỗi phần tử của `items` là dict gồm
+    client_id, timestamp (datetime có múi giờ), latitude, longitude, image (bytes) và
+    tuỳ chọn work_location_id, type. Trả về list kết quả theo đúng thứ tự đầu vào.
+
+    Các lượt đã đồng bộ trước đó (trùng client_id) được trả về "duplicate"; khuôn mặt
+    của các lượt mới được xác thực trong một lượt suy luận theo lô, rồi tất cả được
+    ghi bằng một bulk_create. Lượt chưa được xác thực vì face engine hết chỗ trả về
+    "retry": client gửi lại chúng ở lô sau.
+    """
+    from .verification import verify_faces
+
+    results = [{"client_id": it["client_id"]} for it in items]
+    existing = dict(
+        Attendance.objects.filter(employee_id=emp.pk, client_id__in=[it["client_id"] for it in items])
+        .values_list("client_id", "id")
+    )
+
+    now = timezone.now()
+    locations = refdata.employee_locations(emp)
+    pending = []  # (chỉ số, item, location)
+    seen = set()
+    for i, it in enumerate(items):
+        if it["client_id"] in existing or it["client_id"] in seen:
+            results[i].update(status="duplicate", id=existing.get(it["client_id"]))
+            continue
+        seen.add(it["client_id"])
+        if it["timestamp"] > now + max_skew or it["timestamp"] < now - max_age:
+            results[i].update(status="invalid", message="Thời gian chấm công không hợp lệ.")
+            continue
+        try:
+            loc = resolve_location(emp, it.get("work_location_id"), it["latitude"], it["longitude"], locations)
+        except ClockError as e:
+            results[i].update(status="invalid", message=e.message)
+            continue
+        pending.append((i, it, loc))
+
+    verdicts = verify_faces(emp, [it["image"] for _, it, _ in pending])
+    accepted = []
+    # Ghi số liệu theo thứ tự thời gian để lượt bị từ chối được tính là lần thử lại của lượt sau
+    for (i, it, loc), (ok, message) in sorted(zip(pending, verdicts), key=lambda x: x[0][1]["timestamp"]):
+        if ok:
+            clock_metrics.record_success(emp.pk)
+            accepted.append((i, it, loc))
+        elif ok is None:
+            results[i].update(status="retry", message=message)
+        else:
+            clock_metrics.record_failure(emp.pk)
+            results[i].update(status="rejected", message=message)
+    if not accepted:
+        return results
+
+    # Khoá từng ngày liên quan (như clock) rồi mới đọc các lượt đã có, để một lần chấm
+    # công đồng thời không chen vào giữa việc xác định IN/OUT và ghi. Lượt không gửi
+    # type được xác định như next_type trên các lượt đến thời điểm đó trong ngày;
+    # `accepted` đã theo thứ tự thời gian
+    days = sorted({timezone.localtime(it["timestamp"]).date() for _, it, _ in accepted})
+    shift = refdata.get("shifts", emp.shift_id)
+    try:
+        with transaction.atomic():
+            punches, fields = {}, {}
+            for day in days:
+                _lock_day(emp.pk, day)
+                punches[day] = day_punches(emp.pk, day)
+
+            rows = []
+            for i, it, loc in accepted:
+                day, ts = timezone.localtime(it["timestamp"]).date(), it["timestamp"]
+                ins, outs = punches[day]
+                t = it.get("type")
+                if t not in ["IN", "OUT"]:
+                    t = next_type(ins[:bisect.bisect_right(ins, ts)], outs[:bisect.bisect_right(outs, ts)])
+                fields[day] = apply_punch(day, ins, outs, t, ts, shift)
+
+                distance = haversine_m(it["latitude"], it["longitude"], loc.latitude, loc.longitude)
+                rows.append(Attendance(
+                    employee=emp, type=t, timestamp=ts, latitude=it["latitude"], longitude=it["longitude"],
+                    distance_m=round(distance, 2), within_geofence=distance <= loc.radius_m, work_location=loc,
+                    created_by=user, client_id=it["client_id"],
+                ))
+                results[i].update(status="created", type=t, within_geofence=distance <= loc.radius_m,
+                                  distance_m=round(distance, 2))
+
+            Attendance.objects.bulk_create(rows)
+            monitor.notify()
+            for day in days:
+                DailyTimesheet.objects.update_or_create(employee_id=emp.pk, date=day, defaults=fields[day])
+    except IntegrityError:
+        raise ClockError("Lô chấm công đang được đồng bộ ở một request khác, vui lòng thử lại.", status=409)
+    dashboard_cache.invalidate_dates(*days)
+
+    # bulk_create không trả id trên mọi backend: đọc lại theo client_id
+    ids = dict(Attendance.objects.filter(employee_id=emp.pk, client_id__in=[r.client_id for r in rows])
+               .values_list("client_id", "id"))
+    for r in results:
+        if r.get("status") == "created":
+            r["id"] = ids.get(r["client_id"])
+    return results
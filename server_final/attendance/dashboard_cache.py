@@ -0,0 +1,63 @@
+"""
+Cache kết quả dashboard theo (view, start, end) trên Django cache framework.
+
+Mỗi tháng có một số thế hệ (generation) riêng trong cache; khoá của một kết quả
+chứa thế hệ của mọi tháng nằm trong khoảng. Khi dữ liệu của một ngày thay đổi chỉ
+cần tăng thế hệ của tháng đó, các khoảng có chứa tháng ấy tự động bị bỏ qua.
+Kết quả của các tháng đã qua được lưu vô thời hạn.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+PREFIX = "attendance:dashboard"
+GLOBAL_GEN_KEY = f"{PREFIX}:gen:all"
+
+
+def _month_gen_key(d):
+    return f"{PREFIX}:gen:{d.year}-{d.month:02d}"
+
+
+def _months(start, end):
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        yield f"{PREFIX}:gen:{y}-{m:02d}"
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def bump(key):
+    """Tăng bộ đếm thế hệ/phiên bản `key` trong cache dùng chung (cũng dùng cho refdata, monitor)."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Chưa có khoá: bắt đầu từ 1 (mặc định khi đọc là 0), không hết hạn
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_kpis(view, start, end):
+    gen_keys = [GLOBAL_GEN_KEY] + list(_months(start, end))
+    gens = cache.get_many(gen_keys)
+    signature = ".".join(str(gens.get(k, 0)) for k in gen_keys)
+    key = f"{PREFIX}:{view}:{start:%Y%m%d}:{end:%Y%m%d}:{signature}"
+
+    data = cache.get(key)
+    if data is None:
+        from .timesheet import dashboard_kpis
+        data = dashboard_kpis(start, end)
+        # Tháng đã qua gần như bất biến; khoảng còn dính tới hiện tại thì để hết hạn
+        # phòng khi dữ liệu bị sửa ngoài các đường ghi có huỷ cache (admin, shell...)
+        this_month = timezone.localdate().replace(day=1)
+        timeout = None if end < this_month else getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 300)
+        cache.set(key, data, timeout)
+    return data
+
+
+def invalidate_dates(*dates):
+    """Huỷ cache của mọi khoảng có chứa một trong các ngày đã cho."""
+    for key in {_month_gen_key(d) for d in dates}:
+        bump(key)
+
+
+def invalidate_all():
+    bump(GLOBAL_GEN_KEY)
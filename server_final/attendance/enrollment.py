@@ -0,0 +1,241 @@
+"""
+Đăng ký khuôn mặt hàng loạt từ một file zip ảnh đặt tên theo username
+(ví dụ nv001.jpg). Dùng cho lệnh enroll_faces và trang tải lên trong admin.
+
+Ảnh được đọc lần lượt từ zip theo từng lô; mỗi lô được chia cho các worker của
+một face engine riêng (MTCNN + VGG-Face, xem bulk_engine) rồi ghi bằng một
+bulk_update. Engine phục vụ chấm công không bị dùng chung, nên một archive lớn
+không chiếm hết hàng đợi của các lượt chấm công đang diễn ra. Tiến độ (các username
+đã xử lý và lỗi của từng ảnh) được lưu vào một file JSON sau mỗi lô, nên chạy lại
+với cùng file trạng thái sẽ tiếp tục từ chỗ đã dừng.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from .face_engine import FaceEngine, FaceEngineBusy, pack_templates
+from .face_index import face_index
+from .models import Employee
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class EnrollmentState:
+    """Tiến độ của một lần đăng ký theo archive, lưu trong file JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {"archive": "", "total": 0, "enrolled": 0, "skipped": 0, "done": [], "failures": {},
+                     "started_at": None, "updated_at": None, "finished": False}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        self.done = set(self.data["done"])
+
+    def mark(self, username, failure=None):
+        self.done.add(username)
+        if failure:
+            self.data["failures"][username] = failure
+
+    def save(self):
+        self.data["done"] = sorted(self.done)
+        self.data["updated_at"] = timezone.now().isoformat()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)  # ghi nguyên tử: dừng giữa chừng không làm hỏng file trạng thái
+
+
+def state_path_for(archive_path):
+    return f"{archive_path}.progress.json"
+
+
+def archive_members(zf):
+    """(username, ZipInfo) cho các file ảnh trong zip; mỗi username lấy ảnh đầu tiên."""
+    members, seen = [], set()
+    for info in zf.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+            continue
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTS and stem not in seen:
+            seen.add(stem)
+            members.append((stem, info))
+    return members
+
+
+def _lookup(usernames):
+    """username -> (employee_id, is_active, đã có khuôn mặt), đọc theo từng khối."""
+    out = {}
+    for i in range(0, len(usernames), 500):
+        qs = Employee.objects.filter(user__username__in=usernames[i:i + 500])
+        enrolled = set(qs.filter(face_embedding__isnull=False).values_list("id", flat=True))
+        for pk, username, active in qs.values_list("id", "user__username", "is_active"):
+            out[username] = (pk, active, pk in enrolled)
+    return out
+
+
+def _represent(engine, images, retries=8):
+    """represent_many cho cả lô; các ảnh chưa có slot trong hàng đợi được gửi lại sau."""
+    results = [None] * len(images)
+    todo = list(range(len(images)))
+    attempt = 0
+    while todo:
+        try:
+            out = engine.represent_many([images[i] for i in todo], quality=True)
+        except FaceEngineBusy:
+            if attempt >= retries:
+                raise
+            time.sleep(min(2 ** attempt, 30))  # web đang dùng face engine, chờ hàng đợi vơi bớt
+            attempt += 1
+            continue
+        # Mỗi lượt xử lý được ít nhất một ảnh, phần còn lại chờ lượt sau
+        for i, result in zip(todo, out):
+            results[i] = result
+        todo = [i for i in todo if isinstance(results[i], FaceEngineBusy)]
+    return results
+
+
+def bulk_engine(workers=None, batch_size=None):
+    """FaceEngine riêng cho đăng ký hàng loạt, hàng đợi đủ chứa một lô."""
+    workers = workers or getattr(settings, "FACE_ENROLL_WORKERS", 1)
+    return FaceEngine(workers=workers, max_pending=batch_size or workers * 8, timeout=120)
+
+
+def enroll_archive(archive_path, state_path=None, batch_size=None, overwrite=False, engine=None, progress=None):
+    """
+    Đăng ký khuôn mặt cho mọi ảnh trong `archive_path`. Nhân viên đã có khuôn mặt
+    được bỏ qua trừ khi `overwrite`. `progress(state)` được gọi sau mỗi lô.
+    Không truyền `engine` thì dùng một bulk_engine() riêng, tắt khi xong.
+    Trả về EnrollmentState.
+    """
+    if engine is not None:
+        return _enroll_archive(engine, archive_path, state_path, batch_size, overwrite, progress)
+    engine = bulk_engine(batch_size=batch_size)
+    try:
+        return _enroll_archive(engine, archive_path, state_path, batch_size, overwrite, progress)
+    finally:
+        engine.shutdown()
+
+
+def _enroll_archive(engine, archive_path, state_path, batch_size, overwrite, progress):
+    min_quality = getattr(settings, "FACE_QUALITY_MIN", 0.5)
+    batch_size = batch_size or engine.max_pending
+    state = EnrollmentState(state_path or state_path_for(archive_path))
+    state.data["archive"] = os.path.basename(archive_path)
+    state.data["finished"] = False
+    state.data["started_at"] = state.data["started_at"] or timezone.now().isoformat()
+
+    with zipfile.ZipFile(archive_path) as zf:
+        members = archive_members(zf)
+        state.data["total"] = len(members)
+        employees = _lookup([u for u, _ in members if u not in state.done])
+
+        todo = []
+        for username, info in members:
+            if username in state.done:
+                continue
+            emp = employees.get(username)
+            if emp is None:
+                state.mark(username, "Không có nhân viên với username này.")
+            elif emp[2] and not overwrite:
+                state.data["skipped"] += 1
+                state.mark(username)
+            else:
+                todo.append((username, info, emp))
+        state.save()
+
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i:i + batch_size]
+            images = [zf.read(info) for _, info, _ in batch]
+            results = _represent(engine, images)
+
+            updates, index_items = [], []
+            for (username, _, (pk, active, _)), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    state.mark(username, f"Lỗi xử lý ảnh: {result}")
+                elif not result:
+                    state.mark(username, "Không nhận diện được khuôn mặt.")
+                elif len(result) > 1:
+                    state.mark(username, "Phát hiện nhiều khuôn mặt.")
+                elif (result[0].get("quality") or {}).get("score", 1.0) < min_quality:
+                    state.mark(username, f"Ảnh chất lượng thấp (điểm {result[0]['quality']['score']:.2f}).")
+                else:
+                    templates, blob = pack_templates([result[0]["embedding"]])
+                    updates.append(Employee(pk=pk, face_embedding=blob, face_templates=templates))
+                    if active:
+                        index_items.append((pk, blob))
+                    state.mark(username)
+            if updates:
+                Employee.objects.bulk_update(updates, ["face_embedding", "face_templates"])
+                state.data["enrolled"] += len(updates)
+            if index_items:
+                face_index.upsert_many(index_items)
+            state.save()
+            if progress:
+                progress(state)
+
+    state.data["finished"] = True
+    state.save()
+    return state
+
+
+# ----------------- CHẠY NỀN CHO TRANG ADMIN -----------------
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def upload_dir():
+    path = getattr(settings, "FACE_ENROLL_DIR", os.path.join(settings.BASE_DIR, "enrollment"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_running(archive_path):
+    with _jobs_lock:
+        t = _jobs.get(archive_path)
+        return t is not None and t.is_alive()
+
+
+def start_job(archive_path, overwrite=False):
+    """Chạy enroll_archive trong một luồng nền (một luồng cho mỗi archive). Trả về False nếu đang chạy."""
+    def _run():
+        from django.db import close_old_connections
+        try:
+            enroll_archive(archive_path, overwrite=overwrite)
+        except Exception:
+            logger.exception("Đăng ký khuôn mặt hàng loạt thất bại: %s", archive_path)
+        finally:
+            close_old_connections()
+
+    with _jobs_lock:
+        t = _jobs.get(archive_path)
+        if t is not None and t.is_alive():
+            return False
+        t = threading.Thread(target=_run, name="face-enroll", daemon=True)
+        _jobs[archive_path] = t
+        t.start()
+        return True
+
+
+def list_jobs():
+    """Các archive đã tải lên cùng trạng thái, mới nhất trước."""
+    jobs = []
+    base = upload_dir()
+    for name in sorted(os.listdir(base), reverse=True):
+        if not name.lower().endswith(".zip"):
+            continue
+        path = os.path.join(base, name)
+        state = EnrollmentState(state_path_for(path)).data
+        processed = len(state.pop("done"))
+        jobs.append({"name": name, "path": path, "running": is_running(path), "processed": processed, **state})
+    return jobs
@@ -0,0 +1,393 @@
+"""
+Bộ máy tạo embedding khuôn mặt chạy trong các tiến trình worker riêng.
+
+Mỗi worker nạp VGG-Face + MTCNN đúng một lần khi khởi động rồi nhận job qua hàng
+đợi của ProcessPoolExecutor. Luồng xử lý request chỉ submit job và chờ kết quả có
+timeout; khi hàng đợi đầy thì từ chối ngay (backpressure) thay vì treo WSGI worker.
+
+Tiến trình web không bao giờ import deepface/TensorFlow: pool worker chỉ được tạo ở
+request nhận diện đầu tiên, hoặc ngay khi khởi động nếu FACE_ENGINE_PRELOAD bật
+(xem preload() và server/wsgi.py). `manage.py warmup_face_models` nạp sẵn model.
+"""
+import asyncio
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình model deepface
+FACE_MODEL_NAME = "VGG-Face"
+FACE_DETECTOR_BACKEND = "mtcnn"
+
+# Ngưỡng chấm điểm chất lượng ảnh đăng ký (xem face_quality)
+FACE_MIN_SHARPNESS = 100.0  # phương sai Laplacian của vùng mặt
+FACE_MIN_SIZE = 80          # px, cạnh ngắn của khung mặt
+FACE_MAX_ROLL = 30.0        # độ, góc nghiêng của đường nối hai mắt
+FACE_MIN_EYE_RATIO = 0.3    # khoảng cách hai mắt / bề rộng khung mặt; nhỏ hơn là mặt quay ngang
+
+
+class FaceEngineError(Exception):
+    pass
+
+
+class FaceEngineBusy(FaceEngineError):
+    """Hàng đợi đã đầy, client nên thử lại sau."""
+
+
+class FaceEngineTimeout(FaceEngineError):
+    """Worker không trả kết quả trong thời gian cho phép."""
+
+
+# ----------------- PHẦN CHẠY TRONG TIẾN TRÌNH WORKER -----------------
+
+_DeepFace = None
+
+
+def _worker_init(model_name, detector_backend):
+    """Nạp model một lần cho mỗi tiến trình worker."""
+    global _DeepFace
+    from deepface import DeepFace
+    DeepFace.build_model(model_name)
+    _DeepFace = DeepFace
+
+
+def _worker_ping():
+    return os.getpid()
+
+
+def load_models(model_name=FACE_MODEL_NAME, detector_backend=FACE_DETECTOR_BACKEND):
+    """Nạp DeepFace và model ngay trong tiến trình hiện tại (tải trọng số nếu chưa có)."""
+    _worker_init(model_name, detector_backend)
+    return _DeepFace
+
+
+_available = None
+
+
+def available():
+    """deepface và numpy có được cài không, kiểm tra mà không import (không nạp TensorFlow)."""
+    global _available
+    if _available is None:
+        _available = all(importlib.util.find_spec(m) is not None for m in ("deepface", "numpy"))
+    return _available
+
+
+def decode_image(buf):
+    """Giải mã bytes ảnh (JPEG/PNG...) thành mảng BGR mà DeepFace dùng."""
+    import cv2
+    import numpy as np
+    img = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Không đọc được file ảnh (định dạng không hỗ trợ hoặc file hỏng).")
+    return img
+
+
+def face_quality(img, face):
+    """
+    Chấm chất lượng một khuôn mặt trong ảnh BGR `img` theo độ nét, kích thước và tư
+    thế (nghiêng/quay ngang, ước lượng từ vị trí hai mắt nếu detector trả về).
+    `score` trong [0, 1], là tích các điểm thành phần.
+    """
+    import cv2
+    area = face.get("facial_area") or {}
+    x, y, w, h = (int(area.get(k) or 0) for k in ("x", "y", "w", "h"))
+    crop = img[max(y, 0):y + h, max(x, 0):x + w] if w > 0 and h > 0 else img
+    if crop.size == 0:
+        crop = img
+    h, w = crop.shape[:2]
+    sharpness = float(cv2.Laplacian(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var())
+    score = min(1.0, sharpness / FACE_MIN_SHARPNESS) * min(1.0, min(w, h) / FACE_MIN_SIZE)
+
+    roll = eye_ratio = None
+    left, right = area.get("left_eye"), area.get("right_eye")
+    if left and right:
+        dx, dy = right[0] - left[0], right[1] - left[1]
+        roll = abs(math.degrees(math.atan2(dy, dx)))
+        roll = min(roll, 180.0 - roll)
+        eye_ratio = math.hypot(dx, dy) / w
+        score *= max(0.0, 1.0 - roll / FACE_MAX_ROLL) * min(1.0, eye_ratio / FACE_MIN_EYE_RATIO)
+    return {
+        "sharpness": round(sharpness, 1), "size": min(w, h),
+        "roll": None if roll is None else round(roll, 1),
+        "eye_ratio": None if eye_ratio is None else round(eye_ratio, 3),
+        "score": round(score, 3),
+    }
+
+
+def _worker_represent(img, model_name, detector_backend, quality=False):
+    # Gửi bytes nén qua pipe rẻ hơn nhiều so với gửi mảng ảnh đã giải mã
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        img = decode_image(img)
+    faces = _DeepFace.represent(
+        img_path=img,
+        model_name=model_name,
+        enforce_detection=False,  # Tắt báo lỗi, view tự kiểm tra số khuôn mặt
+        detector_backend=detector_backend,
+    )
+    if quality and not isinstance(img, str):
+        for face in faces:
+            face["quality"] = face_quality(img, face)
+    return faces
+
+
+def _worker_represent_batch(imgs, model_name, detector_backend, quality=False):
+    """Xử lý nhiều ảnh trong một job; lỗi của từng ảnh được trả về thay vì ném ra."""
+    out = []
+    for img in imgs:
+        try:
+            out.append(_worker_represent(img, model_name, detector_backend, quality))
+        except Exception as e:
+            # Đổi thành ValueError để chắc chắn pickle được khi gửi về tiến trình web
+            out.append(ValueError(str(e)))
+    return out
+
+
+# ----------------- PHẦN CHẠY TRONG TIẾN TRÌNH WEB -----------------
+
+EMBEDDING_DTYPE = "<f4"  # float32 little-endian, cố định để blob đọc được trên mọi máy
+
+
+def pack_embedding(embedding):
+    """Chuẩn hoá L2 rồi đóng gói embedding thành blob float32 để lưu vào DB."""
+    import numpy as np
+    vec = np.asarray(embedding, dtype=np.float32)
+    n = np.linalg.norm(vec)
+    if not np.isfinite(n) or n == 0:
+        raise ValueError("Embedding khuôn mặt không hợp lệ.")
+    return (vec / n).astype(EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(blob):
+    """View zero-copy trên blob đã lưu (vector đơn vị)."""
+    import numpy as np
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def pack_templates(embeddings):
+    """
+    Đóng gói nhiều embedding của cùng một người. Trả về (blob các mẫu, blob centroid):
+    các mẫu là ma trận vector đơn vị (mỗi dòng một ảnh), centroid là trung bình đã
+    chuẩn hoá, dùng cho Employee.face_embedding và chỉ mục 1:N.
+    """
+    import numpy as np
+    rows = np.stack([unpack_embedding(pack_embedding(e)) for e in embeddings])
+    return rows.astype(EMBEDDING_DTYPE).tobytes(), pack_embedding(rows.mean(axis=0))
+
+
+def unpack_templates(templates_blob, centroid_blob):
+    """Ma trận (số mẫu, dim) của một người; chưa có mẫu riêng thì dùng centroid (1 dòng)."""
+    import numpy as np
+    dim = len(centroid_blob) // np.dtype(EMBEDDING_DTYPE).itemsize
+    return np.frombuffer(templates_blob or centroid_blob, dtype=EMBEDDING_DTYPE).reshape(-1, dim)
+
+
+def min_cosine_distance(templates, embedding):
+    """Cosine distance nhỏ nhất từ embedding mới tới mọi mẫu, trong một phép nhân ma trận-vector."""
+    import numpy as np
+    live = np.asarray(embedding, dtype=np.float32)
+    return 1.0 - float(np.max(templates @ live) / np.linalg.norm(live))
+
+
+def cosine_distance(stored_unit, embedding):
+    """
+    Cosine distance giữa vector đơn vị đã lưu và embedding mới.
+    Chỉ cần chuẩn hoá phía embedding mới, phía đã lưu là một tích vô hướng.
+    """
+    import numpy as np
+    live = np.asarray(embedding, dtype=np.float32)
+    return 1.0 - float(np.dot(stored_unit, live) / np.linalg.norm(live))
+
+
+class FaceEngine:
+    def __init__(self, workers=2, max_pending=None, timeout=15.0,
+                 model_name=FACE_MODEL_NAME, detector_backend=FACE_DETECTOR_BACKEND):
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.timeout = timeout
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        with self._lock:
+            # Sau khi fork (gunicorn preload) pool của tiến trình cha không dùng được
+            if self._executor is None or self._pid != os.getpid():
+                # 'spawn' để không kế thừa trạng thái TensorFlow từ tiến trình cha
+                ctx = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=ctx,
+                    initializer=_worker_init,
+                    initargs=(self.model_name, self.detector_backend),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def start(self, timeout=None):
+        """Khởi động toàn bộ worker và chờ chúng nạp xong model."""
+        executor = self._get_executor()
+        futures = [executor.submit(_worker_ping) for _ in range(self.workers)]
+        return {f.result(timeout=timeout) for f in futures}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._pid = None
+
+    def submit(self, img, quality=False):
+        """
+        Gửi một job represent, trả về concurrent.futures.Future. Ném FaceEngineBusy
+        ngay nếu hàng đợi đã đầy; slot được trả lại khi job xong.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise FaceEngineBusy("Hệ thống nhận diện đang quá tải, vui lòng thử lại sau giây lát.")
+        try:
+            future = self._get_executor().submit(
+                _worker_represent, img, self.model_name, self.detector_backend, quality
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def represent(self, img, timeout=None, quality=False):
+        """
+        Trả về kết quả DeepFace.represent cho `img` (bytes ảnh, mảng ảnh hoặc đường dẫn file).
+        `quality=True` thêm điểm chất lượng (face_quality) vào từng khuôn mặt.
+        """
+        future = self.submit(img, quality)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise FaceEngineTimeout("Hết thời gian chờ nhận diện khuôn mặt.")
+        except BrokenProcessPool:
+            # Worker chết (OOM, crash TF...) -> tạo lại pool ở lần gọi sau
+            self.shutdown(wait=False)
+            raise FaceEngineError("Worker nhận diện khuôn mặt bị lỗi, vui lòng thử lại.")
+
+    async def represent_async(self, img, timeout=None, quality=False):
+        """Như represent() nhưng chờ kết quả trên event loop, không giữ luồng nào (ASGI)."""
+        future = self.submit(img, quality)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise FaceEngineTimeout("Hết thời gian chờ nhận diện khuôn mặt.")
+        except BrokenProcessPool:
+            self.shutdown(wait=False)
+            raise FaceEngineError("Worker nhận diện khuôn mặt bị lỗi, vui lòng thử lại.")
+
+    def represent_many(self, imgs, timeout=None, quality=False):
+        """
+        Embedding cho nhiều ảnh, chia thành tối đa `workers` job để các worker chạy song
+        song. Mỗi ảnh chiếm một slot của hàng đợi như một request đơn lẻ: khi không đủ
+        slot, chỉ các ảnh đầu tiên được xử lý, phần còn lại nhận FaceEngineBusy (ném ra
+        nếu không còn slot nào). Trả về list cùng thứ tự; phần tử lỗi là một Exception.
+        `timeout` là hạn chót cho cả lô (mặc định `self.timeout` cho mỗi ảnh của một job).
+        """
+        if not imgs:
+            return []
+        taken = 0
+        while taken < len(imgs) and self._slots.acquire(blocking=False):
+            taken += 1
+        if not taken:
+            raise FaceEngineBusy("Hệ thống nhận diện đang quá tải, vui lòng thử lại sau giây lát.")
+
+        n_chunks = min(self.workers, taken)
+        chunks = [imgs[i:taken:n_chunks] for i in range(n_chunks)]
+        executor = self._get_executor()
+        futures = []
+        try:
+            for chunk in chunks:
+                future = executor.submit(_worker_represent_batch, chunk, self.model_name, self.detector_backend, quality)
+                future.add_done_callback(lambda f, n=len(chunk): self._release(n))
+                futures.append(future)
+        except Exception:
+            self._release(sum(len(c) for c in chunks[len(futures):]))
+            raise
+
+        timeout = self.timeout * len(chunks[0]) if timeout is None else timeout
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            for f in not_done:
+                f.cancel()
+            raise FaceEngineTimeout("Hết thời gian chờ nhận diện khuôn mặt.")
+        try:
+            chunk_results = [f.result() for f in futures]
+        except BrokenProcessPool:
+            self.shutdown(wait=False)
+            raise FaceEngineError("Worker nhận diện khuôn mặt bị lỗi, vui lòng thử lại.")
+
+        busy = FaceEngineBusy("Hệ thống nhận diện đang quá tải, vui lòng thử lại sau giây lát.")
+        results = [busy] * len(imgs)
+        for c, chunk_result in enumerate(chunk_results):
+            results[c:taken:n_chunks] = chunk_result
+        return results
+
+    def _release(self, n):
+        for _ in range(n):
+            self._slots.release()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = FaceEngine(
+                    workers=getattr(settings, "FACE_ENGINE_WORKERS", 2),
+                    max_pending=getattr(settings, "FACE_ENGINE_MAX_PENDING", None),
+                    timeout=getattr(settings, "FACE_ENGINE_TIMEOUT", 15.0),
+                )
+    return _engine
+
+
+def preload():
+    """
+    Khởi động pool worker ở luồng nền để request nhận diện đầu tiên không phải chờ nạp
+    model. Chỉ gọi trong tiến trình phục vụ nhận diện (FACE_ENGINE_PRELOAD).
+    """
+    if not available():
+        return None
+
+    def run():
+        try:
+            get_engine().start()
+        except Exception:
+            logger.exception("Không nạp sẵn được model nhận diện khuôn mặt")
+            get_engine().shutdown(wait=False)
+
+    t = threading.Thread(target=run, name="face-engine-preload", daemon=True)
+    t.start()
+    return t
+
+
+def represent(img, timeout=None, quality=False):
+    return get_engine().represent(img, timeout=timeout, quality=quality)
+
+
+async def represent_async(img, timeout=None, quality=False):
+    return await get_engine().represent_async(img, timeout=timeout, quality=quality)
+
+
+def represent_many(imgs, timeout=None, quality=False):
+    return get_engine().represent_many(imgs, timeout=timeout, quality=quality)
@@ -0,0 +1,202 @@
+"""
+Chỉ mục embedding khuôn mặt trong bộ nhớ cho nhận diện 1:N (kiosk).
+
+Toàn bộ embedding của nhân viên đang hoạt động nằm trong một ma trận float32
+(mỗi dòng là vector đơn vị), nên nhận diện là phép nhân ma trận-vector. Với chỉ
+mục lớn (VGG-Face 4096 chiều, hàng chục nghìn nhân viên) phép nhân đó bị giới hạn
+bởi băng thông bộ nhớ (~75 ms ở 50k dòng), nên tìm kiếm đi hai bước: lọc
+SHORTLIST ứng viên trên bản chiếu ngẫu nhiên PROJECTION_DIM chiều của ma trận
+(trực giao, cố định theo số chiều), rồi so chính xác các ứng viên đó trên vector
+đầy đủ (bench_face_index đo độ trễ và tỉ lệ khớp đúng).
+
+Chỉ mục chỉ được nạp ở tiến trình tìm kiếm (kiosk). Khi đăng ký khuôn mặt hoặc khoá
+nhân viên, tiến trình đã nạp cập nhật từng dòng; tiến trình chưa nạp (worker web
+của nhân sự) chỉ tăng số phiên bản trong cache. Các tiến trình khác phát hiện thay
+đổi qua số phiên bản đó và nạp lại.
+"""
+import threading
+
+from django.core.cache import cache
+
+from .face_engine import EMBEDDING_DTYPE
+
+VERSION_KEY = "attendance:face_index:version"
+PROJECTION_DIM = 128
+SHORTLIST = 128
+EXACT_MAX_SIZE = 5000  # dưới ngưỡng này so chính xác toàn bộ
+
+
+def _projection(dim):
+    import numpy as np
+    rng = np.random.default_rng(dim)
+    return np.linalg.qr(rng.standard_normal((dim, PROJECTION_DIM)))[0].astype(EMBEDDING_DTYPE)
+
+
+def _bump_shared():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        if cache.add(VERSION_KEY, 1, None):
+            return 1
+        return cache.incr(VERSION_KEY)
+
+
+class FaceIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix = None   # (capacity, dim), chỉ dùng _matrix[:_size]
+        self._coarse = None   # _matrix @ _proj, None khi chỉ so chính xác
+        self._proj = None
+        self._ids = None      # employee_id theo từng dòng
+        self._rows = {}       # employee_id -> chỉ số dòng
+        self._size = 0
+        self._version = None  # None: tiến trình này chưa nạp chỉ mục
+
+    def _reset(self, dim, capacity):
+        import numpy as np
+        capacity = max(capacity, 16)
+        self._matrix = np.zeros((capacity, dim), dtype=EMBEDDING_DTYPE)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._proj = _projection(dim) if dim > 2 * PROJECTION_DIM else None
+        self._coarse = np.zeros((capacity, PROJECTION_DIM), dtype=EMBEDDING_DTYPE) if self._proj is not None else None
+        self._rows = {}
+        self._size = 0
+
+    def load(self):
+        """Nạp lại toàn bộ chỉ mục từ DB."""
+        import numpy as np
+        from .models import Employee
+        qs = (Employee.objects.filter(is_active=True, face_embedding__isnull=False)
+              .values_list("id", "face_embedding"))
+        with self._lock:
+            # Đọc phiên bản trước dữ liệu: thay đổi ghi trong lúc nạp sẽ gây nạp lại lần sau
+            version = cache.get(VERSION_KEY, 0)
+            rows = [(pk, np.frombuffer(blob, dtype=EMBEDDING_DTYPE)) for pk, blob in qs.iterator() if blob]
+            self.build([pk for pk, _ in rows], [vec for _, vec in rows])
+            self._version = version
+
+    def build(self, ids, vectors):
+        """Dựng chỉ mục từ danh sách id và vector đơn vị tương ứng."""
+        import numpy as np
+        with self._lock:
+            self._matrix = self._coarse = self._proj = None
+            self._rows = {}
+            self._size = 0
+            if len(ids):
+                matrix = np.asarray(vectors, dtype=EMBEDDING_DTYPE)
+                # Chỉ chừa chỗ cho vài lần đăng ký: ma trận đầy đủ có thể cỡ trăm MiB
+                self._reset(matrix.shape[1], len(ids) + self._growth(len(ids)))
+                n = len(ids)
+                self._matrix[:n] = matrix
+                if self._coarse is not None:
+                    self._coarse[:n] = matrix @ self._proj
+                self._ids[:n] = ids
+                self._rows = {int(pk): i for i, pk in enumerate(ids)}
+                self._size = n
+
+    @staticmethod
+    def _growth(size):
+        return max(16, size // 16)
+
+    def _ensure_fresh(self):
+        if self._version is None or cache.get(VERSION_KEY, 0) != self._version:
+            self.load()
+
+    def _put(self, pk, vec):
+        """Ghi vector của `pk`; trả về False nếu chỉ mục đã có đúng vector đó."""
+        import numpy as np
+        if self._matrix is None:
+            self._reset(len(vec), 16)
+        row = self._rows.get(pk)
+        if row is not None and np.array_equal(self._matrix[row], vec):
+            return False
+        if row is None:
+            if self._size == len(self._ids):
+                extra = self._growth(self._size)
+                self._matrix = np.concatenate([self._matrix, np.zeros((extra, self._matrix.shape[1]), self._matrix.dtype)])
+                self._ids = np.concatenate([self._ids, np.zeros(extra, self._ids.dtype)])
+                if self._coarse is not None:
+                    self._coarse = np.concatenate([self._coarse, np.zeros((extra, PROJECTION_DIM), self._coarse.dtype)])
+            row = self._size
+            self._size += 1
+            self._rows[pk] = row
+            self._ids[row] = pk
+        self._matrix[row] = vec
+        if self._coarse is not None:
+            self._coarse[row] = vec @ self._proj
+        return True
+
+    def _commit(self, changed):
+        """Báo cho các tiến trình khác khi chỉ mục của tiến trình này vừa đổi."""
+        if not changed:
+            return
+        previous = self._version
+        version = _bump_shared()
+        # Nếu tiến trình khác cũng vừa tăng phiên bản thì thay đổi của nó chưa có ở đây:
+        # giữ phiên bản cũ để lần tìm kiếm sau nạp lại
+        if previous is not None and version == previous + 1:
+            self._version = version
+
+    def upsert(self, employee_id, blob):
+        self.upsert_many([(employee_id, blob)])
+
+    def upsert_many(self, items):
+        """Như upsert cho nhiều (employee_id, blob), chỉ tăng phiên bản một lần."""
+        import numpy as np
+        with self._lock:
+            if self._version is None:
+                _bump_shared()  # chưa nạp: không dựng chỉ mục chỉ để ghi
+                return
+            self._ensure_fresh()
+            changed = False
+            for employee_id, blob in items:
+                changed |= self._put(employee_id, np.frombuffer(blob, dtype=EMBEDDING_DTYPE))
+            self._commit(changed)
+
+    def remove(self, employee_id):
+        with self._lock:
+            if self._version is None:
+                _bump_shared()
+                return
+            self._ensure_fresh()
+            row = self._rows.pop(employee_id, None)
+            if row is not None:
+                # Đưa dòng cuối vào chỗ trống để ma trận luôn liền mạch
+                last = self._size - 1
+                if row != last:
+                    moved = int(self._ids[last])
+                    self._matrix[row] = self._matrix[last]
+                    if self._coarse is not None:
+                        self._coarse[row] = self._coarse[last]
+                    self._ids[row] = moved
+                    self._rows[moved] = row
+                self._size = last
+            self._commit(row is not None)
+
+    def search(self, embedding):
+        """
+        Trả về (employee_id, cosine distance) gần nhất, hoặc (None, None) nếu chỉ mục rỗng.
+        """
+        import numpy as np
+        with self._lock:
+            self._ensure_fresh()
+            if not self._size:
+                return None, None
+            live = np.asarray(embedding, dtype=np.float32)
+            live = live / np.linalg.norm(live)
+            n = self._size
+            if self._coarse is not None and n > max(EXACT_MAX_SIZE, SHORTLIST):
+                rough = self._coarse[:n] @ (live @ self._proj)
+                rows = np.argpartition(rough, -SHORTLIST)[-SHORTLIST:]
+                scores = self._matrix[rows] @ live
+                best = int(np.argmax(scores))
+                return int(self._ids[rows[best]]), 1.0 - float(scores[best])
+            scores = self._matrix[:n] @ live
+            best = int(np.argmax(scores))
+            return int(self._ids[best]), 1.0 - float(scores[best])
+
+    def __len__(self):
+        return self._size
+
+
+face_index = FaceIndex()
@@ -0,0 +1,81 @@
+"""
+Xác định địa điểm chấm công gần nhất trong một tập WorkLocation.
+
+Khoảng cách tới mọi địa điểm được tính một lần bằng haversine vector hoá (NumPy).
+Với tập rất lớn, LocationIndex chia địa điểm vào lưới ô vuông theo độ, nên truy vấn
+nằm trong một geofence chỉ phải xét các ô lân cận thay vì toàn bộ bảng; điểm nằm
+ngoài mọi geofence (hiếm) mới quét toàn bộ để lấy địa điểm gần nhất.
+"""
+import math
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG_LAT = 111320.0
+GRID_THRESHOLD = 2000  # dưới ngưỡng này quét toàn bộ mảng đã đủ nhanh
+
+
+def haversine_m_vec(lat, lon, lats, lons):
+    """Khoảng cách (m) từ một điểm tới các mảng toạ độ `lats`, `lons`."""
+    import numpy as np
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lons) - math.radians(lon)
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class LocationIndex:
+    def __init__(self, locations, grid_threshold=GRID_THRESHOLD):
+        import numpy as np
+        self.locations = list(locations)
+        self.lats = np.array([l.latitude for l in self.locations], dtype=np.float64)
+        self.lons = np.array([l.longitude for l in self.locations], dtype=np.float64)
+        self.radii = np.array([l.radius_m for l in self.locations], dtype=np.float64)
+        self._grid = None
+        if len(self.locations) > grid_threshold:
+            self._build_grid()
+
+    def _build_grid(self):
+        import numpy as np
+        # Ô đủ lớn để mọi vòng geofence chỉ chạm tới các ô lân cận (3x3); theo chiều
+        # kinh độ một độ ngắn đi theo cos(vĩ độ) nên lấy vĩ độ lớn nhất cho chắc chắn
+        max_lat = min(float(np.abs(self.lats).max()), 89.0)
+        self._cell = float(self.radii.max()) / (METERS_PER_DEG_LAT * math.cos(math.radians(max_lat)))
+        self._cell = max(self._cell, 1e-4)
+        self._grid = {}
+        rows = np.floor(self.lats / self._cell).astype(np.int64)
+        cols = np.floor(self.lons / self._cell).astype(np.int64)
+        for i, key in enumerate(zip(rows.tolist(), cols.tolist())):
+            self._grid.setdefault(key, []).append(i)
+
+    def _candidates(self, lat, lon):
+        import numpy as np
+        r, c = math.floor(lat / self._cell), math.floor(lon / self._cell)
+        idx = [i for dr in (-1, 0, 1) for dc in (-1, 0, 1) for i in self._grid.get((r + dr, c + dc), ())]
+        return np.array(idx, dtype=np.int64)
+
+    def resolve(self, lat, lon):
+        """
+        (địa điểm, khoảng cách m, nằm trong bán kính) cho điểm (lat, lon): địa điểm gần
+        nhất có bán kính chứa điểm; nếu không có thì địa điểm gần nhất. None nếu tập rỗng.
+        """
+        if not self.locations:
+            return None
+        if self._grid is not None:
+            # Mọi vòng geofence chứa điểm đều nằm trong các ô lân cận; không có thì địa
+            # điểm gần nhất có thể ở xa hơn, nên quét toàn bộ
+            idx = self._candidates(lat, lon)
+            if len(idx):
+                found = self._nearest(lat, lon, idx)
+                if found[2]:
+                    return found
+        return self._nearest(lat, lon)
+
+    def _nearest(self, lat, lon, idx=None):
+        import numpy as np
+        lats, lons, radii = (self.lats, self.lons, self.radii) if idx is None else (self.lats[idx], self.lons[idx], self.radii[idx])
+        d = haversine_m_vec(lat, lon, lats, lons)
+        inside = d <= radii
+        best = int(np.argmin(np.where(inside, d, np.inf))) if inside.any() else int(np.argmin(d))
+        i = best if idx is None else int(idx[best])
+        return self.locations[i], float(d[best]), bool(inside[best])
@@ -0,0 +1,185 @@
+"""
+Nhập nhân viên hàng loạt từ XLSX/CSV (màn hình hr_import và lệnh import_employees).
+
+Cột: username, first_name, last_name, email, phone, work_location_id, role và
+password (hai cột cuối tuỳ chọn). work_location_id có thể chứa nhiều id, ngăn
+cách bằng dấu phẩy hoặc chấm phẩy; role là tên hoặc id vai trò; password trống
+thì dùng mật khẩu mặc định.
+
+Toàn bộ file được kiểm tra trước (username trùng đọc bằng một truy vấn, địa điểm
+và vai trò lấy từ refdata); có lỗi thì không tạo gì. PBKDF2 chiếm gần hết thời
+gian khi tạo user: mật khẩu của từng user được băm riêng (salt riêng, kể cả khi
+dùng mật khẩu mặc định), song song trên một process pool. Sau đó User, Employee và
+bảng trung gian allowed_locations được ghi bằng bulk_create theo từng khối, tất cả
+trong một transaction: lỗi giữa chừng (ví dụ username vừa được tạo ở nơi khác) thì
+không còn nhân viên nào được tạo và có thể nhập lại nguyên file.
+"""
+import codecs
+import csv
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from . import dashboard_cache
+from .models import Employee
+from .refdata import invalidate as invalidate_refdata, refdata
+
+COLUMNS = ("username", "first_name", "last_name", "email", "phone", "work_location_id", "role", "password")
+REQUIRED = ("username",)
+DEFAULT_PASSWORD = "12345678"  # giống web_employees/reset mật khẩu
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def _cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)  # Excel lưu số nguyên (id, số điện thoại) dưới dạng số thực
+    return str(v).strip()
+
+
+def read_rows(fileobj, filename):
+    """Sinh (số dòng, dict theo COLUMNS) từ file XLSX hoặc CSV, đọc dần từng dòng."""
+    if filename.lower().endswith(".csv"):
+        reader = csv.reader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    else:
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError("Thư viện 'openpyxl' chưa được cài đặt trên server.")
+        try:
+            wb = load_workbook(fileobj, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFileError(f"Không đọc được file Excel: {e}")
+        reader = wb.active.iter_rows(values_only=True)
+
+    header = None
+    for line, values in enumerate(reader, start=1):
+        values = [_cell(v) for v in values]
+        if header is None:
+            header = [h.lower().split("(")[0].strip() for h in values]
+            missing = [c for c in REQUIRED if c not in header]
+            if missing:
+                raise ImportFileError(f"Thiếu cột: {', '.join(missing)}")
+            continue
+        if not any(values):
+            continue
+        row = dict(zip(header, values))
+        yield line, {c: row.get(c, "") for c in COLUMNS}
+
+
+def validate(rows):
+    """
+    Kiểm tra toàn bộ `rows` [(số dòng, dict)] và chuẩn hoá. Trả về (danh sách hợp lệ, lỗi);
+    mỗi lỗi là (số dòng, thông báo).
+    """
+    names = [r["username"] for _, r in rows]
+    taken = set()
+    for i in range(0, len(names), 500):  # giữ số tham số của mỗi truy vấn dưới giới hạn của SQLite
+        taken.update(User.objects.filter(username__in=names[i:i + 500]).values_list("username", flat=True))
+    locations = {loc.pk for loc in refdata.all("locations")}
+    roles = {r.name.lower(): r.pk for r in refdata.all("roles")}
+    roles.update({str(r.pk): r.pk for r in refdata.all("roles")})
+
+    seen = set()
+    valid, errors = [], []
+    for line, r in rows:
+        problems = []
+        username = r["username"]
+        if not username:
+            problems.append("thiếu username")
+        elif len(username) > 150 or not re.fullmatch(r"[\w.@+-]+", username):
+            problems.append(f"username không hợp lệ: {username}")
+        elif username in taken:
+            problems.append(f"username đã tồn tại: {username}")
+        elif username in seen:
+            problems.append(f"username bị lặp trong file: {username}")
+        seen.add(username)
+
+        if r["email"]:
+            try:
+                validate_email(r["email"])
+            except ValidationError:
+                problems.append(f"email không hợp lệ: {r['email']}")
+
+        loc_ids = []
+        for part in re.split(r"[;,]", r["work_location_id"]):
+            part = part.strip()
+            if not part:
+                continue
+            if not part.isdigit() or int(part) not in locations:
+                problems.append(f"địa điểm không tồn tại: {part}")
+            elif int(part) not in loc_ids:
+                loc_ids.append(int(part))
+
+        role_id = None
+        if r["role"]:
+            role_id = roles.get(r["role"].lower())
+            if role_id is None:
+                problems.append(f"vai trò không tồn tại: {r['role']}")
+
+        if problems:
+            errors.append((line, "; ".join(problems)))
+        else:
+            valid.append(dict(r, location_ids=loc_ids, role_id=role_id))
+    return valid, errors
+
+
+def hash_passwords(raw, workers=None):
+    """make_password cho từng phần tử của `raw` (mỗi user một salt), chia đều trên các tiến trình."""
+    workers = workers or getattr(settings, "IMPORT_HASH_WORKERS", None) or os.cpu_count() or 1
+    if workers <= 1 or len(raw) < 2 * workers:
+        return [make_password(p) for p in raw]
+    # spawn như face engine: không fork tiến trình web đang giữ kết nối DB
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(make_password, raw, chunksize=max(1, len(raw) // (workers * 4))))
+
+
+def create_employees(valid, chunk_size=500, workers=None):
+    """Tạo User/Employee/allowed_locations cho các dòng đã kiểm tra. Trả về số nhân viên đã tạo."""
+    hashes = hash_passwords([r["password"] or DEFAULT_PASSWORD for r in valid], workers)
+    through = Employee.allowed_locations.through
+    created = 0
+    with transaction.atomic():
+        for i in range(0, len(valid), chunk_size):
+            chunk = valid[i:i + chunk_size]
+            User.objects.bulk_create([
+                User(username=r["username"], first_name=r["first_name"][:150], last_name=r["last_name"][:150],
+                     email=r["email"], password=h)
+                for r, h in zip(chunk, hashes[i:i + chunk_size])
+            ])
+            # bulk_create không trả id trên mọi backend: đọc lại theo username
+            user_ids = dict(User.objects.filter(username__in=[r["username"] for r in chunk])
+                            .values_list("username", "id"))
+            Employee.objects.bulk_create([
+                Employee(user_id=user_ids[r["username"]], phone=r["phone"][:32], role_id=r["role_id"], is_active=True)
+                for r in chunk
+            ])
+            emp_ids = dict(Employee.objects.filter(user_id__in=user_ids.values()).values_list("user_id", "id"))
+            through.objects.bulk_create([
+                through(employee_id=emp_ids[user_ids[r["username"]]], worklocation_id=loc_id)
+                for r in chunk for loc_id in r["location_ids"]
+            ])
+            created += len(chunk)
+        invalidate_refdata()  # bảng trung gian ghi thẳng, không có signal m2m_changed
+    dashboard_cache.invalidate_all()
+    return created
+
+
+def import_file(fileobj, filename, chunk_size=500, workers=None):
+    """Đọc, kiểm tra rồi tạo nhân viên. Trả về (số đã tạo, lỗi); có lỗi thì không tạo gì."""
+    valid, errors = validate(list(read_rows(fileobj, filename)))
+    if errors:
+        return 0, errors
+    return create_employees(valid, chunk_size, workers), []
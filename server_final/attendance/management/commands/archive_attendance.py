@@ -0,0 +1,68 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from attendance import archive, partitions
+from attendance.models import ArchivedMonth, Attendance
+
+
+def _parse_month(value):
+    try:
+        d = datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise CommandError(f"Tháng không hợp lệ: {value} (định dạng YYYY-MM)")
+    return d.year, d.month
+
+
+class Command(BaseCommand):
+    help = ("Chuyển các tháng chấm công đã ra khỏi khoảng giữ lại (ATTENDANCE_RETENTION_MONTHS) sang "
+            "file lưu trữ NPZ và tạo trước phân vùng tháng tới trên PostgreSQL. Nên chạy hằng tháng (cron).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-months", type=int, help="Số tháng giữ trong bảng (mặc định: ATTENDANCE_RETENTION_MONTHS)")
+        parser.add_argument("--month", action="append", type=_parse_month, dest="months",
+                            help="Chỉ lưu trữ tháng này YYYY-MM (có thể lặp lại)")
+        parser.add_argument("--restore", type=_parse_month, help="Đưa tháng YYYY-MM đã lưu trữ trở lại bảng")
+        parser.add_argument("--partitions-ahead", type=int, default=3,
+                            help="PostgreSQL: số tháng tới cần có sẵn phân vùng")
+        parser.add_argument("--dry-run", action="store_true", help="Chỉ liệt kê các tháng sẽ lưu trữ")
+
+    def handle(self, *args, **opts):
+        if opts["restore"]:
+            try:
+                n = archive.restore_month(*opts["restore"])
+            except archive.ArchiveError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Đã đưa {n} lượt chấm công của {opts['restore'][0]}-{opts['restore'][1]:02d} trở lại bảng."))
+            return
+
+        months = opts["months"] or archive.closed_months(opts["keep_months"])
+        if opts["dry_run"]:
+            for y, m in months:
+                lo, hi = partitions.month_range(y, m)
+                n = Attendance.objects.filter(timestamp__gte=lo, timestamp__lt=hi).count()
+                if n:
+                    self.stdout.write(f"  {y}-{m:02d}: {n} dòng")
+            return
+
+        for y, m in partitions.ensure(opts["partitions_ahead"]):
+            self.stdout.write(f"Tạo phân vùng {partitions.partition_name(y, m)}")
+
+        total = 0
+        for y, m in months:
+            t0 = time.perf_counter()
+            try:
+                n = archive.archive_month(y, m)
+            except archive.ArchiveError as e:
+                raise CommandError(str(e))
+            if n:
+                total += n
+                self.stdout.write(f"  {y}-{m:02d}: {n} dòng ({time.perf_counter() - t0:.1f}s)")
+
+        stats = ArchivedMonth.objects.aggregate(months=Count("id"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã chuyển {total} lượt chấm công; {stats['months']} tháng đang lưu trữ, "
+            f"{Attendance.objects.count()} dòng còn trong bảng."
+        ))
@@ -0,0 +1,39 @@
+import json
+import timeit
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from attendance.face_engine import pack_embedding, unpack_embedding, cosine_distance
+
+
+def _old_distance(stored_json, live):
+    # Cách cũ: json.loads + dựng lại mảng + tính cả hai norm mỗi lần chấm công
+    a = np.asarray(json.loads(stored_json))
+    b = np.asarray(live)
+    return 1.0 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+class Command(BaseCommand):
+    help = "So sánh chi phí giải mã + so khớp embedding: JSON cũ và blob float32 mới."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dim", type=int, default=4096, help="Số chiều embedding (VGG-Face: 4096)")
+        parser.add_argument("--number", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        rng = np.random.default_rng(0)
+        stored = rng.standard_normal(opts["dim"]).tolist()
+        live = rng.standard_normal(opts["dim"]).tolist()
+
+        stored_json = json.dumps(stored)
+        stored_blob = pack_embedding(stored)
+        n = opts["number"]
+
+        old = timeit.timeit(lambda: _old_distance(stored_json, live), number=n) / n
+        new = timeit.timeit(lambda: cosine_distance(unpack_embedding(stored_blob), live), number=n) / n
+
+        self.stdout.write(f"JSON text : {len(stored_json):>8} bytes  {old * 1e6:>9.1f} us/lần")
+        self.stdout.write(f"float32   : {len(stored_blob):>8} bytes  {new * 1e6:>9.1f} us/lần")
+        self.stdout.write(f"nhanh hơn : {old / new:.1f}x")
+        self.stdout.write(f"sai lệch  : {abs(_old_distance(stored_json, live) - cosine_distance(unpack_embedding(stored_blob), live)):.2e}")
@@ -0,0 +1,54 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from attendance.face_engine import FaceEngine, FaceEngineBusy
+
+
+class Command(BaseCommand):
+    help = "Đo số lượt chấm công/giây của face engine theo số worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("image", help="Ảnh khuôn mặt mẫu dùng cho mọi request")
+        parser.add_argument("--workers", default="1,2,4", help="Danh sách số worker, ví dụ 1,2,4")
+        parser.add_argument("--requests", type=int, default=40, help="Số request cho mỗi cấu hình")
+        parser.add_argument("--concurrency", type=int, default=8, help="Số request gửi đồng thời")
+
+    def handle(self, *args, **opts):
+        with open(opts["image"], "rb") as f:
+            image = f.read()  # giống api_clock: gửi bytes ảnh, không qua file tạm
+        total = opts["requests"]
+        concurrency = opts["concurrency"]
+
+        self.stdout.write(f"{'workers':>8} {'req/s':>8} {'p50(ms)':>9} {'p99(ms)':>9} {'busy':>6}")
+        for n in [int(x) for x in opts["workers"].split(",") if x]:
+            engine = FaceEngine(workers=n, max_pending=concurrency, timeout=120)
+            engine.start(timeout=300)  # nạp model trước khi đo
+
+            latencies = []
+            busy = 0
+
+            def one(_):
+                t0 = time.perf_counter()
+                try:
+                    engine.represent(image)
+                except FaceEngineBusy:
+                    return None
+                return time.perf_counter() - t0
+
+            t_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for lat in pool.map(one, range(total)):
+                    if lat is None:
+                        busy += 1
+                    else:
+                        latencies.append(lat)
+            elapsed = time.perf_counter() - t_start
+            engine.shutdown()
+
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000 if latencies else 0.0
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0.0
+            self.stdout.write(f"{n:>8} {len(latencies) / elapsed:>8.2f} {p50:>9.1f} {p99:>9.1f} {busy:>6}")
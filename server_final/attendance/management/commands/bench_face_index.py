@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from attendance.face_index import FaceIndex
+
+
+class Command(BaseCommand):
+    help = "Đo thời gian so khớp 1:N của chỉ mục khuôn mặt."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=50000, help="Số nhân viên đã đăng ký")
+        parser.add_argument("--dim", type=int, default=4096, help="Số chiều embedding (VGG-Face: 4096)")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--noise", type=float, default=0.01,
+                            help="Độ lệch chuẩn của nhiễu cộng vào mỗi chiều của ảnh truy vấn")
+
+    def handle(self, *args, **opts):
+        rng = np.random.default_rng(0)
+        size, dim = opts["size"], opts["dim"]
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        index = FaceIndex()
+        index._version = 0  # bỏ qua kiểm tra phiên bản trong cache khi đo
+        index.build(np.arange(1, size + 1), vectors)
+        self.stdout.write(f"chỉ mục: {size} x {dim} float32 = {vectors.nbytes / 2**20:.0f} MiB")
+
+        probes = rng.integers(0, size, opts["queries"])
+        timings = []
+        hits = same = 0
+        for i in probes:
+            query = vectors[i] + rng.standard_normal(dim, dtype=np.float32) * opts["noise"]
+            t0 = time.perf_counter()
+            emp_id, _ = index.search(query)
+            timings.append(time.perf_counter() - t0)
+            hits += emp_id == i + 1
+            same += emp_id == int(np.argmax(vectors @ query)) + 1  # so chính xác toàn bộ
+
+        timings.sort()
+        self.stdout.write(f"p50 {timings[len(timings) // 2] * 1000:.2f} ms  "
+                          f"p99 {timings[int(len(timings) * 0.99)] * 1000:.2f} ms  "
+                          f"đúng {hits}/{len(probes)}  trùng so chính xác {same}/{len(probes)}")
@@ -0,0 +1,73 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from attendance.geofence import LocationIndex
+from attendance.utils import haversine_m
+
+
+class Command(BaseCommand):
+    help = ("Đo thời gian chọn địa điểm chấm công gần nhất: vòng lặp Python, NumPy và lưới, "
+            "với index dựng sẵn (refdata.location_index) và dựng lại ở mỗi lượt.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=10000, help="Số địa điểm được phép")
+        parser.add_argument("--queries", type=int, default=200)
+
+    def _loop(self, locations, lat, lon):
+        best, best_d = None, None
+        for loc in locations:
+            d = haversine_m(lat, lon, loc.latitude, loc.longitude)
+            if d <= loc.radius_m and (best_d is None or d < best_d):
+                best, best_d = loc, d
+        return best
+
+    def _time(self, fn, points):
+        timings = []
+        results = []
+        for lat, lon in points:
+            t0 = time.perf_counter()
+            results.append(fn(lat, lon))
+            timings.append(time.perf_counter() - t0)
+        timings.sort()
+        return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000, results
+
+    def handle(self, *args, **opts):
+        rng = np.random.default_rng(0)
+        size = opts["size"]
+        # Địa điểm rải trong khoảng Việt Nam, bán kính 50-300 m
+        locations = [
+            SimpleNamespace(pk=i, latitude=float(la), longitude=float(lo), radius_m=float(r))
+            for i, (la, lo, r) in enumerate(zip(rng.uniform(8.5, 23.4, size), rng.uniform(102.1, 109.5, size),
+                                                 rng.uniform(50, 300, size)))
+        ]
+        # Một nửa điểm truy vấn nằm sát một địa điểm, nửa còn lại ngẫu nhiên
+        points = []
+        for k in range(opts["queries"]):
+            if k % 2 == 0:
+                loc = locations[int(rng.integers(size))]
+                points.append((loc.latitude + rng.normal(0, 0.0003), loc.longitude + rng.normal(0, 0.0003)))
+            else:
+                points.append((float(rng.uniform(8.5, 23.4)), float(rng.uniform(102.1, 109.5))))
+
+        flat = LocationIndex(locations, grid_threshold=size + 1)
+        grid = LocationIndex(locations, grid_threshold=0)
+        self.stdout.write(f"{size} địa điểm, {len(points)} truy vấn")
+        ref = None
+        for label, fn in [
+            ("vòng lặp haversine_m", lambda la, lo: self._loop(locations, la, lo)),
+            ("NumPy (quét toàn bộ)", lambda la, lo: flat.resolve(la, lo)),
+            ("NumPy + lưới", lambda la, lo: grid.resolve(la, lo)),
+            # Chi phí thật nếu không giữ index giữa các request: dựng mảng/lưới + truy vấn
+            ("NumPy, dựng mỗi lượt", lambda la, lo: LocationIndex(locations, grid_threshold=size + 1).resolve(la, lo)),
+            ("lưới, dựng mỗi lượt", lambda la, lo: LocationIndex(locations, grid_threshold=0).resolve(la, lo)),
+        ]:
+            p50, p99, results = self._time(fn, points)
+            # Chỉ so sánh các điểm nằm trong một geofence (ngoài vùng thì vòng lặp không chọn gì)
+            inside = [r if not isinstance(r, tuple) else (r[0] if r[2] else None) for r in results]
+            picked = [getattr(r, "pk", None) for r in inside]
+            ref = picked if ref is None else ref
+            same = sum(a == b for a, b in zip(ref, picked))
+            self.stdout.write(f"{label:<24} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms  khớp {same}/{len(points)}")
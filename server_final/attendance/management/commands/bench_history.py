@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from attendance.models import Attendance, Employee, Shift, WorkLocation
+from attendance.serializers import AttendanceSerializer
+from attendance.timesheet import rebuild_range
+from attendance.utils import month_bounds
+from attendance.views import api_history
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Sinh dữ liệu giả và gọi api_history?period=month; lỗi nếu số truy vấn tăng theo "
+            "số lượt chấm công, nếu dữ liệu khác AttendanceSerializer hoặc If-None-Match không trả 304.")
+
+    MAX_QUERIES = 4
+
+    def add_arguments(self, parser):
+        parser.add_argument("--punches", default="1,4,8", help="Số lượt chấm công mỗi ngày, ví dụ 1,4,8")
+
+    def _fixture(self, per_day, month_start, month_end):
+        user = User.objects.create(username=f"bench_history_{per_day}")
+        shift = Shift.objects.create(name=f"bench_history_{per_day}", start_time="08:00", end_time="17:00")
+        emp = Employee.objects.create(user=user, shift=shift, is_active=True)
+        locs = [WorkLocation.objects.create(name=f"bench{i}", latitude=10 + i, longitude=106) for i in range(2)]
+        rows = []
+        day = month_start
+        while day <= month_end:
+            t0 = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=8))
+            for k in range(per_day):
+                rows.append(Attendance(
+                    employee=emp, type="IN" if k % 2 == 0 else "OUT", timestamp=t0 + timedelta(hours=k),
+                    latitude=10, longitude=106, work_location=locs[k % 2], verification="verified",
+                ))
+            day += timedelta(days=1)
+        Attendance.objects.bulk_create(rows)
+        rebuild_range(month_start, month_end, employee_ids=[emp.pk])
+        return user
+
+    def _get(self, user, base, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        request = APIRequestFactory().get("/api/attendance/history/", {"period": "month", "date": base}, **headers)
+        force_authenticate(request, user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            t0 = time.perf_counter()
+            resp = api_history(request)
+            resp.render()
+            elapsed = time.perf_counter() - t0
+        return resp, len(ctx.captured_queries), elapsed
+
+    def handle(self, *args, **opts):
+        start, end = month_bounds(timezone.localdate())
+        counts = {}
+        for per_day in [int(x) for x in opts["punches"].split(",") if x]:
+            try:
+                with transaction.atomic():
+                    user = self._fixture(per_day, start, end)
+                    resp, counts[per_day], elapsed = self._get(user, f"{start:%Y-%m-%d}")
+                    items = sum(len(d["items"]) for d in resp.data["days"])
+                    self.stdout.write(f"{per_day:>3} lượt/ngày: {items} lượt, {counts[per_day]} truy vấn, {elapsed * 1000:.1f} ms")
+
+                    expected = AttendanceSerializer(
+                        Attendance.objects.filter(employee__user=user).order_by("timestamp", "id"), many=True
+                    ).data
+                    got = [item for d in resp.data["days"] for item in d["items"]]
+                    if [dict(x) for x in expected] != [dict(x, work_location=dict(x["work_location"])) for x in got]:
+                        raise CommandError("Dữ liệu lịch sử khác AttendanceSerializer")
+
+                    cached, n, elapsed = self._get(user, f"{start:%Y-%m-%d}", resp["ETag"])
+                    if cached.status_code != 304:
+                        raise CommandError(f"If-None-Match trả về {cached.status_code}, cần 304")
+                    self.stdout.write(f"{'':>3} If-None-Match: 304, {n} truy vấn, {elapsed * 1000:.1f} ms")
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        if len(set(counts.values())) > 1 or max(counts.values(), default=0) > self.MAX_QUERIES:
+            raise CommandError(f"Số truy vấn của api_history không cố định (tối đa {self.MAX_QUERIES}): {counts}")
@@ -0,0 +1,61 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import face_engine
+
+# Chạy trong tiến trình con mới: nạp Django và toàn bộ URLconf (kéo theo attendance.views)
+# như một worker web khi nhận request đầu tiên
+CHILD = """
+import json, os, resource, sys, time
+t0 = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+t1 = time.perf_counter()
+if {face!r}:
+    from attendance import face_engine
+    face_engine.load_models()
+t2 = time.perf_counter()
+print(json.dumps({{
+    "startup": t1 - t0, "face": t2 - t1,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": [m for m in ("numpy", "cv2", "deepface", "tensorflow") if m in sys.modules],
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Đo thời gian khởi động và bộ nhớ (RSS đỉnh) của một tiến trình Django không chạy "
+            "nhận diện (migrate, admin, worker web); --face đo thêm chi phí nạp DeepFace + model.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--face", action="store_true", help="Nạp thêm DeepFace và model trong tiến trình con")
+
+    def _run_once(self, face):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "server.settings"))
+        proc = subprocess.run([sys.executable, "-c", CHILD.format(face=face)], cwd=settings.BASE_DIR, env=env,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise CommandError(proc.stderr[-2000:])
+        # Dòng cuối là kết quả, các dòng trước có thể là log của thư viện
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **opts):
+        if opts["face"] and not face_engine.available():
+            raise CommandError("Chưa cài deepface/numpy, không đo được --face.")
+        runs = [self._run_once(opts["face"]) for _ in range(opts["runs"])]
+        startup = statistics.median(r["startup"] for r in runs)
+        rss = statistics.median(r["rss_mb"] for r in runs)
+        self.stdout.write(f"khởi động (median {len(runs)} lần): {startup * 1000:.0f} ms, RSS đỉnh {rss:.1f} MB")
+        self.stdout.write(f"thư viện nặng đã import: {', '.join(runs[-1]['modules']) or 'không có'}")
+        if opts["face"]:
+            face = statistics.median(r["face"] for r in runs)
+            self.stdout.write(f"nạp DeepFace + model: {face * 1000:.0f} ms")
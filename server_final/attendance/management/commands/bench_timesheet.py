@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from attendance.models import Attendance, Employee, WorkLocation
+from attendance.timesheet import dashboard_kpis, iter_month_rows, rebuild_range
+from attendance.utils import month_bounds
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Sinh dữ liệu giả và đo bảng công tháng cùng KPI dashboard; "
+            "lỗi nếu số truy vấn thay đổi theo số nhân viên.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000", help="Số nhân viên, ví dụ 1000,10000")
+        parser.add_argument("--days", type=int, default=10, help="Số ngày có chấm công trong tháng")
+
+    def _fixture(self, size, days, month_start):
+        prefix = f"bench{size}_"
+        users = User.objects.bulk_create([User(username=f"{prefix}{i}") for i in range(size)])
+        if not users or users[0].pk is None:  # backend không trả pk sau bulk_create
+            users = list(User.objects.filter(username__startswith=prefix).order_by("id"))
+        Employee.objects.bulk_create([Employee(user=u, is_active=True) for u in users])
+        emp_ids = list(Employee.objects.filter(user__username__startswith=prefix).values_list("id", flat=True))
+        loc = WorkLocation.objects.create(name="bench", latitude=0, longitude=0)
+
+        batch = []
+        for d in range(days):
+            day = month_start + timedelta(days=d)
+            t_in = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=8))
+            for emp_id in emp_ids:
+                batch.append(Attendance(employee_id=emp_id, type="IN", timestamp=t_in, latitude=0, longitude=0, work_location=loc))
+                batch.append(Attendance(employee_id=emp_id, type="OUT", timestamp=t_in + timedelta(hours=9), latitude=0, longitude=0, work_location=loc))
+            if len(batch) >= 20000:
+                Attendance.objects.bulk_create(batch)
+                batch = []
+        Attendance.objects.bulk_create(batch)
+        rebuild_range(month_start, month_start + timedelta(days=days), employee_ids=emp_ids)
+
+    def handle(self, *args, **opts):
+        start, end = month_bounds(timezone.localdate())
+        counts = {}
+        kpi_counts = {}
+        for size in [int(x) for x in opts["sizes"].split(",") if x]:
+            try:
+                with transaction.atomic():
+                    self._fixture(size, opts["days"], start)
+                    employees = Employee.objects.filter(is_active=True).select_related("user").order_by("id")
+                    with CaptureQueriesContext(connection) as ctx:
+                        t0 = time.perf_counter()
+                        rows = sum(1 for _ in iter_month_rows(employees, start, end))
+                        elapsed = time.perf_counter() - t0
+                    counts[size] = len(ctx.captured_queries)
+                    self.stdout.write(f"{size:>7} nhân viên: {rows} dòng, {counts[size]} truy vấn, {elapsed:.2f}s")
+
+                    year_start, year_end = start.replace(month=1, day=1), start.replace(month=12, day=31)
+                    with CaptureQueriesContext(connection) as ctx:
+                        t0 = time.perf_counter()
+                        dashboard_kpis(year_start, year_end)
+                        elapsed = time.perf_counter() - t0
+                    kpi_counts[size] = len(ctx.captured_queries)
+                    self.stdout.write(f"{'':>7} dashboard view=year: {kpi_counts[size]} truy vấn, {elapsed:.2f}s")
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        if len(set(counts.values())) > 1:
+            raise CommandError(f"Số truy vấn thay đổi theo số nhân viên: {counts}")
+        if len(set(kpi_counts.values())) > 1:
+            raise CommandError(f"Số truy vấn dashboard thay đổi theo số nhân viên: {kpi_counts}")
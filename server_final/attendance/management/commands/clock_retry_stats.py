@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from attendance import clock_metrics
+
+
+class Command(BaseCommand):
+    help = ("Thống kê số lần chấm công lại vì xác thực khuôn mặt thất bại "
+            "(số lần thử lại trên mỗi lần chấm công thành công).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Đặt lại các bộ đếm sau khi in")
+
+    def handle(self, *args, **opts):
+        data = clock_metrics.snapshot()
+        self.stdout.write(f"Thành công: {data['successes']}  thất bại: {data['failures']}  "
+                          f"thử lại: {data['retries']}")
+        rps = data["retries_per_success"]
+        self.stdout.write(f"Thử lại / lần thành công: {'-' if rps is None else rps}")
+        for b in clock_metrics.BUCKETS:
+            self.stdout.write(f"  {b:>2} lần thử lại: {data[f'hist:{b}']}")
+        if opts["reset"]:
+            clock_metrics.reset()
+            self.stdout.write(self.style.SUCCESS("Đã đặt lại bộ đếm."))
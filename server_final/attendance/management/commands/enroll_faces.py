@@ -0,0 +1,53 @@
+import csv
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.enrollment import bulk_engine, enroll_archive, state_path_for
+
+
+class Command(BaseCommand):
+    help = ("Đăng ký khuôn mặt hàng loạt từ file zip ảnh đặt tên theo username (nv001.jpg...). "
+            "Chạy lại với cùng file trạng thái sẽ tiếp tục từ chỗ đã dừng.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="File .zip chứa ảnh")
+        parser.add_argument("--workers", type=int, default=getattr(settings, "FACE_ENGINE_WORKERS", 2),
+                            help="Số tiến trình chạy model")
+        parser.add_argument("--batch-size", type=int, help="Số ảnh mỗi lô (mặc định: workers x 8)")
+        parser.add_argument("--state", help="File trạng thái JSON (mặc định: <archive>.progress.json)")
+        parser.add_argument("--report", help="Ghi danh sách ảnh lỗi ra file CSV")
+        parser.add_argument("--overwrite", action="store_true", help="Đăng ký lại cả nhân viên đã có khuôn mặt")
+
+    def handle(self, *args, **opts):
+        engine = bulk_engine(opts["workers"], opts["batch_size"])
+        self.stdout.write(f"Nạp model trên {opts['workers']} worker...")
+        engine.start(timeout=600)
+
+        t0 = time.perf_counter()
+
+        def progress(state):
+            d = state.data
+            self.stdout.write(f"  {len(state.done)}/{d['total']}  đăng ký {d['enrolled']}  "
+                              f"lỗi {len(d['failures'])}  bỏ qua {d['skipped']}  ({time.perf_counter() - t0:.0f}s)")
+
+        try:
+            state = enroll_archive(opts["archive"], state_path=opts["state"], batch_size=opts["batch_size"],
+                                   overwrite=opts["overwrite"], engine=engine, progress=progress)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            raise CommandError(str(e))
+        finally:
+            engine.shutdown()
+
+        d = state.data
+        if opts["report"]:
+            with open(opts["report"], "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.writer(f)
+                writer.writerow(["username", "lỗi"])
+                writer.writerows(sorted(d["failures"].items()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong: {d['enrolled']} đăng ký, {len(d['failures'])} lỗi, {d['skipped']} bỏ qua "
+            f"(trạng thái: {opts['state'] or state_path_for(opts['archive'])})."
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import importer
+
+
+class Command(BaseCommand):
+    help = "Nhập nhân viên hàng loạt từ file XLSX/CSV (cùng định dạng với màn hình nhập Excel)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Đường dẫn file .xlsx hoặc .csv")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Số nhân viên mỗi lần bulk_create")
+        parser.add_argument("--workers", type=int, help="Số tiến trình băm mật khẩu (mặc định: số CPU)")
+        parser.add_argument("--dry-run", action="store_true", help="Chỉ kiểm tra file, không tạo gì")
+
+    def handle(self, *args, **opts):
+        t0 = time.perf_counter()
+        try:
+            with open(opts["file"], "rb") as f:
+                valid, errors = importer.validate(list(importer.read_rows(f, opts["file"])))
+        except (OSError, importer.ImportFileError) as e:
+            raise CommandError(str(e))
+        t_validate = time.perf_counter() - t0
+
+        for line, message in errors:
+            self.stderr.write(f"dòng {line}: {message}")
+        if errors:
+            raise CommandError(f"{len(errors)} dòng lỗi, chưa nhập nhân viên nào.")
+        self.stdout.write(f"Kiểm tra {len(valid)} dòng: {t_validate:.2f}s")
+        if opts["dry_run"]:
+            return
+
+        t0 = time.perf_counter()
+        created = importer.create_employees(valid, chunk_size=opts["chunk_size"], workers=opts["workers"])
+        self.stdout.write(self.style.SUCCESS(f"Đã tạo {created} nhân viên trong {time.perf_counter() - t0:.2f}s."))
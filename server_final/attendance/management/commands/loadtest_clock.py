@@ -0,0 +1,120 @@
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+HEADER = f"{'endpoint':<24} {'ok/s':>8} {'ok':>6} {'lỗi':>6} {'p50(ms)':>9} {'p99(ms)':>9}"
+
+
+class Command(BaseCommand):
+    help = ("Bắn tải HTTP vào một server đang chạy và đo số request được chấp nhận/giây "
+            "cho từng endpoint chấm công (ví dụ: clock,clock_async).")
+
+    ENDPOINTS = {
+        "clock": ("POST", "/api/clock/"),
+        "clock_async": ("POST", "/api/clock/async/"),
+        "history": ("GET", "/api/attendance/history/?period=month"),
+        "me": ("GET", "/api/employee/me/"),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Địa chỉ server")
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--image", help="Ảnh khuôn mặt (bắt buộc cho clock/clock_async)")
+        parser.add_argument("--latitude", type=float, default=0.0)
+        parser.add_argument("--longitude", type=float, default=0.0)
+        parser.add_argument("--endpoints", default="clock,clock_async",
+                            help=f"Danh sách endpoint, chọn trong: {', '.join(ENDPOINTS)}. "
+                                 "Dùng a+b để trộn nhiều endpoint trong cùng một lượt đo.")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=32)
+
+    def _token(self, base, username, password):
+        req = Request(f"{base}/api/token/", data=json.dumps({"username": username, "password": password}).encode(),
+                      headers={"Content-Type": "application/json"})
+        with urlopen(req) as resp:
+            return json.loads(resp.read())["access"]
+
+    def _request(self, base, token, name, opts, image):
+        method, path = self.ENDPOINTS[name]
+        headers = {"Authorization": f"Bearer {token}"}
+        body = None
+        if method == "POST":
+            body, headers["Content-Type"] = _multipart(
+                {"latitude": opts["latitude"], "longitude": opts["longitude"]},
+                {"face_image": ("face.jpg", image)},
+            )
+        t0 = time.perf_counter()
+        try:
+            with urlopen(Request(f"{base}{path}", data=body, headers=headers, method=method)) as resp:
+                resp.read()
+                code = resp.status
+        except HTTPError as e:
+            code = e.code
+        except OSError:
+            code = 0
+        return name, code, time.perf_counter() - t0
+
+    def handle(self, *args, **opts):
+        base = opts["url"].rstrip("/")
+        image = None
+        if opts["image"]:
+            with open(opts["image"], "rb") as f:
+                image = f.read()
+        token = self._token(base, opts["username"], opts["password"])
+
+        self.stdout.write(HEADER)
+        for group in [g for g in opts["endpoints"].split(",") if g]:
+            for label, rate, ok, errors, p50, p99 in self.measure(base, token, group, opts, image):
+                self.stdout.write(f"{label:<24} {rate:>8.1f} {ok:>6} {errors:>6} {p50:>9.1f} {p99:>9.1f}")
+
+    def measure(self, base, token, group, opts, image):
+        """
+        Chạy một lượt đo cho `group` (các endpoint nối bằng "+"). Trả về
+        [(nhãn, ok/s, số ok, số lỗi, p50 ms, p99 ms)] cho từng endpoint trong nhóm.
+        """
+        names = group.split("+")
+        for name in names:
+            if name not in self.ENDPOINTS:
+                raise CommandError(f"Endpoint không hợp lệ: {name}")
+            if self.ENDPOINTS[name][0] == "POST" and image is None:
+                raise CommandError(f"--image là bắt buộc cho {name}")
+
+        t_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["concurrency"]) as pool:
+            results = list(pool.map(
+                lambda i: self._request(base, token, names[i % len(names)], opts, image),
+                range(opts["requests"]),
+            ))
+        elapsed = time.perf_counter() - t_start
+
+        rows = []
+        for name in names:
+            mine = [(code, lat) for n, code, lat in results if n == name]
+            ok = sorted(lat for code, lat in mine if 200 <= code < 300)
+            p50 = statistics.median(ok) * 1000 if ok else 0.0
+            p99 = ok[min(len(ok) - 1, int(len(ok) * 0.99))] * 1000 if ok else 0.0
+            label = f"{name} ({group})" if len(names) > 1 else name
+            rows.append((label, len(ok) / elapsed, len(ok), len(mine) - len(ok), p50, p99))
+        return rows
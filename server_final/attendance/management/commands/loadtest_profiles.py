@@ -0,0 +1,140 @@
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .loadtest_clock import HEADER, Command as LoadTest
+
+DEFAULT_PROFILES = [
+    "dev=server.settings",
+    "prod-sqlite=server.settings_production:DB_ENGINE=sqlite",
+]
+
+
+def _parse_profile(value):
+    """"tên=module[:KEY=VAL,KEY=VAL]" -> (tên, module, {KEY: VAL})."""
+    try:
+        name, rest = value.split("=", 1)
+        module, _, env = rest.partition(":")
+        extra = dict(item.split("=", 1) for item in env.split(",") if item)
+    except ValueError:
+        raise CommandError(f"Profile không hợp lệ: {value} (định dạng tên=module[:KEY=VAL,...])")
+    return name, module, extra
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ("So sánh số lượt chấm công/giây giữa các cấu hình settings: với mỗi profile, khởi động "
+            "một server riêng rồi đo bằng loadtest_clock. Ví dụ profile: "
+            "prod-pg=server.settings_production:DB_ENGINE=postgresql,DB_CONN_MAX_AGE=60. "
+            "So sánh WSGI/ASGI: --profile wsgi=server.settings --profile asgi=server.settings "
+            "--server-cmd-for 'wsgi=gunicorn server.wsgi -w 1 --threads 8 -b {addr}' "
+            "--server-cmd-for 'asgi=uvicorn server.asgi:application --host {host} --port {port}' "
+            "--endpoints clock+history")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", action="append", dest="profiles",
+                            help="tên=module[:KEY=VAL,...], có thể lặp lại (mặc định: dev và prod-sqlite; "
+                                 "thêm prod-postgres nếu có POSTGRES_HOST)")
+        parser.add_argument("--server-cmd", default="{python} manage.py runserver --noreload {addr}",
+                            help="Lệnh chạy server, {python}, {addr}, {host} và {port} được thay thế "
+                                 "(ví dụ: gunicorn server.wsgi -w 4 -b {addr}). runserver mở một luồng "
+                                 "mới cho mỗi request nên không giữ được kết nối DB (CONN_MAX_AGE); "
+                                 "dùng gunicorn để so sánh kết nối bền.")
+        parser.add_argument("--server-cmd-for", action="append", default=[], metavar="TÊN=LỆNH",
+                            help="Lệnh chạy server riêng cho một profile, có thể lặp lại")
+        parser.add_argument("--username", required=True)
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--image", help="Ảnh khuôn mặt (bắt buộc cho clock/clock_async)")
+        parser.add_argument("--latitude", type=float, default=0.0)
+        parser.add_argument("--longitude", type=float, default=0.0)
+        parser.add_argument("--endpoints", default="clock", help="Như loadtest_clock --endpoints")
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--warmup", type=int, default=20, help="Số request chạy trước khi đo (không tính)")
+        parser.add_argument("--startup-timeout", type=float, default=60)
+
+    def _start(self, module, extra, server_cmd, opts):
+        port = _free_port()
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=module, **extra)
+        env.setdefault("DJANGO_SECRET_KEY", "loadtest-only")  # settings_production bắt buộc có
+        env.setdefault("DJANGO_HTTPS", "0")  # server đo tải chạy HTTP thường
+        cmd = server_cmd.format(python=shlex.quote(sys.executable), addr=f"127.0.0.1:{port}",
+                                host="127.0.0.1", port=port)
+        # Log của server ra file tạm: runserver ghi một dòng cho mỗi request, pipe sẽ đầy
+        log = tempfile.TemporaryFile()
+        proc = subprocess.Popen(shlex.split(cmd), cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=log)
+        base = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + opts["startup_timeout"]
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"Server thoát sớm:\n{log.read().decode(errors='replace')[-2000:]}")
+            try:
+                urlopen(f"{base}/web/login/", timeout=2).read()
+                return proc, base
+            except HTTPError:
+                return proc, base  # server đã trả lời
+            except (URLError, OSError):
+                time.sleep(0.3)
+        proc.terminate()
+        raise CommandError(f"Server không khởi động sau {opts['startup_timeout']}s")
+
+    def handle(self, *args, **opts):
+        profiles = opts["profiles"] or DEFAULT_PROFILES + (
+            ["prod-postgres=server.settings_production:DB_ENGINE=postgresql"] if os.environ.get("POSTGRES_HOST") else []
+        )
+        profiles = [_parse_profile(p) for p in profiles]
+        groups = [g for g in opts["endpoints"].split(",") if g]
+        image = None
+        if opts["image"]:
+            with open(opts["image"], "rb") as f:
+                image = f.read()
+
+        server_cmds = {}
+        for item in opts["server_cmd_for"]:
+            name, sep, cmd = item.partition("=")
+            if not sep:
+                raise CommandError(f"--server-cmd-for không hợp lệ: {item} (định dạng TÊN=LỆNH)")
+            server_cmds[name] = cmd
+
+        lt = LoadTest(stdout=self.stdout, stderr=self.stderr)
+        summary = {}
+        for name, module, extra in profiles:
+            server_cmd = server_cmds.get(name, opts["server_cmd"])
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{name}: {module} {extra or ''}"))
+            self.stdout.write(server_cmd)
+            proc, base = self._start(module, extra, server_cmd, opts)
+            try:
+                token = lt._token(base, opts["username"], opts["password"])
+                if opts["warmup"]:
+                    for group in groups:
+                        lt.measure(base, token, group, dict(opts, requests=opts["warmup"]), image)
+                self.stdout.write(HEADER)
+                for group in groups:
+                    for label, rate, ok, errors, p50, p99 in lt.measure(base, token, group, opts, image):
+                        summary.setdefault(label, {})[name] = rate
+                        self.stdout.write(f"{label:<24} {rate:>8.1f} {ok:>6} {errors:>6} {p50:>9.1f} {p99:>9.1f}")
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+        names = [name for name, _, _ in profiles]
+        self.stdout.write(self.style.MIGRATE_HEADING("\nok/s theo profile"))
+        self.stdout.write(f"{'endpoint':<24} " + " ".join(f"{n:>14}" for n in names))
+        for label, rates in summary.items():
+            self.stdout.write(f"{label:<24} " + " ".join(f"{rates.get(n, 0.0):>14.1f}" for n in names))
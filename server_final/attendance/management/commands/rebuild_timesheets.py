@@ -0,0 +1,66 @@
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from attendance import archive
+from attendance.models import Attendance, DailyTimesheet, Employee, Shift
+from attendance.timesheet import rebuild_range, refresh_flags
+from attendance.utils import month_bounds
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"Ngày không hợp lệ: {value} (định dạng YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Dựng lại bảng tổng hợp DailyTimesheet từ dữ liệu chấm công thô."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Ngày bắt đầu YYYY-MM-DD (mặc định: bản chấm công cũ nhất)")
+        parser.add_argument("--end", help="Ngày kết thúc YYYY-MM-DD (mặc định: bản chấm công mới nhất)")
+        parser.add_argument("--employee", type=int, action="append", dest="employees",
+                            help="Chỉ dựng lại cho nhân viên này (có thể lặp lại)")
+        parser.add_argument("--flags-only", action="store_true",
+                            help="Chỉ tính lại cờ đi trễ/về sớm theo ca hiện tại, không đọc chấm công thô "
+                                 "(sau khi đổi ca: các tháng đã đóng không được tính lại tự động)")
+
+    def handle(self, *args, **opts):
+        bounds = Attendance.objects.aggregate(first=Min("timestamp"), last=Max("timestamp"))
+        archived = sorted(archive.archived_months())
+        if not opts["start"] and bounds["first"] is None and not archived:
+            self.stdout.write("Chưa có dữ liệu chấm công.")
+            return
+        if opts["start"]:
+            start = _parse_date(opts["start"])
+        else:
+            # Tính cả các tháng đã lưu trữ (archive_attendance)
+            starts = [date(*archived[0], 1)] if archived else []
+            if bounds["first"] is not None:
+                starts.append(timezone.localtime(bounds["first"]).date())
+            start = min(starts)
+        if opts["end"]:
+            end = _parse_date(opts["end"])
+        elif bounds["last"] is not None:
+            end = timezone.localtime(bounds["last"]).date()
+        else:
+            end = month_bounds(date(*archived[-1], 1))[1]
+        if start > end:
+            raise CommandError("--start phải trước hoặc bằng --end")
+
+        if opts["flags_only"]:
+            sheets = DailyTimesheet.objects.filter(date__gte=start, date__lte=end)
+            if opts["employees"]:
+                sheets = sheets.filter(employee_id__in=opts["employees"])
+            shifts = {s.pk: s for s in Shift.objects.all()}
+            emp_shift = dict(Employee.objects.values_list("pk", "shift_id"))
+            changed = refresh_flags(sheets, lambda emp_id: shifts.get(emp_shift.get(emp_id)))
+            self.stdout.write(self.style.SUCCESS(f"Đã cập nhật cờ của {changed} dòng tổng hợp từ {start} đến {end}."))
+            return
+
+        created = rebuild_range(start, end, employee_ids=opts["employees"])
+        self.stdout.write(self.style.SUCCESS(f"Đã dựng lại {created} dòng tổng hợp từ {start} đến {end}."))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import face_engine
+
+
+class Command(BaseCommand):
+    help = ("Nạp sẵn DeepFace và model nhận diện (tải trọng số về ~/.deepface nếu chưa có) để "
+            "kiểm tra cài đặt trước khi mở dịch vụ. Mặc định khởi động pool worker như server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=getattr(settings, "FACE_ENGINE_WORKERS", 2))
+        parser.add_argument("--in-process", action="store_true",
+                            help="Nạp ngay trong tiến trình này thay vì trong pool worker")
+        parser.add_argument("--timeout", type=float, default=600, help="Giây chờ nạp model")
+
+    def handle(self, *args, **opts):
+        if not face_engine.available():
+            raise CommandError("Chưa cài deepface/numpy trên server.")
+        t0 = time.perf_counter()
+        if opts["in_process"]:
+            face_engine.load_models()
+            self.stdout.write(self.style.SUCCESS(f"Đã nạp model sau {time.perf_counter() - t0:.1f}s"))
+            return
+        engine = face_engine.FaceEngine(workers=opts["workers"])
+        try:
+            pids = engine.start(timeout=opts["timeout"])
+        except Exception as e:
+            raise CommandError(f"Worker không nạp được model: {e}")
+        finally:
+            engine.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(pids)} worker đã nạp model sau {time.perf_counter() - t0:.1f}s"
+        ))
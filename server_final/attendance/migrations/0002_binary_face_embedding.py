@@ -0,0 +1,52 @@
+import json
+
+from django.db import migrations, models
+
+
+def json_to_blob(apps, schema_editor):
+    import numpy as np
+    Employee = apps.get_model('attendance', 'Employee')
+    for emp in Employee.objects.exclude(face_embedding__isnull=True).exclude(face_embedding='').only('id', 'face_embedding').iterator():
+        vec = np.asarray(json.loads(emp.face_embedding), dtype=np.float32)
+        n = np.linalg.norm(vec)
+        if not np.isfinite(n) or n == 0:
+            continue
+        Employee.objects.filter(pk=emp.pk).update(face_vector=(vec / n).astype('<f4').tobytes())
+
+
+def blob_to_json(apps, schema_editor):
+    import numpy as np
+    Employee = apps.get_model('attendance', 'Employee')
+    for emp in Employee.objects.exclude(face_vector__isnull=True).only('id', 'face_vector').iterator():
+        vec = np.frombuffer(emp.face_vector, dtype='<f4')
+        Employee.objects.filter(pk=emp.pk).update(face_embedding=json.dumps(vec.tolist()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='face_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_blob, blob_to_json),
+        migrations.RemoveField(
+            model_name='employee',
+            name='face_embedding',
+        ),
+        migrations.RenameField(
+            model_name='employee',
+            old_name='face_vector',
+            new_name='face_embedding',
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='face_embedding',
+            field=models.BinaryField(blank=True, help_text='float32 little-endian, L2-normalized face embedding', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_binary_face_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTimesheet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total_hours', models.FloatField(default=0)),
+                ('first_in', models.DateTimeField(blank=True, null=True)),
+                ('last_out', models.DateTimeField(blank=True, null=True)),
+                ('late', models.BooleanField(default=False)),
+                ('early_leave', models.BooleanField(default=False)),
+                ('pair_count', models.PositiveIntegerField(default=0)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timesheets', to='attendance.Employee')),
+            ],
+            options={
+                'unique_together': {('employee', 'date')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailytimesheet',
+            index=models.Index(fields=['date'], name='timesheet_date_idx'),
+        ),
+    ]
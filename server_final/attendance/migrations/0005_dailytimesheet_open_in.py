@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailytimesheet',
+            name='open_in',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_dailytimesheet_open_in'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='verification',
+            field=models.CharField(choices=[('verified', 'verified'), ('pending', 'pending'), ('rejected', 'rejected')], default='verified', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='attendance',
+            name='verification_message',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
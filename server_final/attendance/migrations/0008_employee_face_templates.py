@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_attendance_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='face_templates',
+            field=models.BinaryField(blank=True, help_text='float32 little-endian, one L2-normalized embedding per enrolled image', null=True),
+        ),
+    ]
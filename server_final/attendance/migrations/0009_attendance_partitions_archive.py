@@ -0,0 +1,101 @@
+from datetime import date, datetime, time
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+TABLE = "attendance_attendance"
+
+
+def _month_start(year, month):
+    from django.utils import timezone
+    return timezone.make_aware(datetime.combine(date(year, month, 1), time.min))
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def partition_attendance(apps, schema_editor):
+    """
+    PostgreSQL: chuyển attendance_attendance thành bảng phân vùng theo tháng (xem
+    attendance/partitions.py). Các backend khác giữ nguyên bảng.
+    """
+    conn = schema_editor.connection
+    if conn.vendor != "postgresql":
+        return
+    from django.utils import timezone
+
+    Attendance = apps.get_model("attendance", "Attendance")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        seq = cursor.fetchone()[0]
+        # Tách sequence khỏi bảng cũ để DROP TABLE không xoá nó theo
+        schema_editor.execute(f"ALTER SEQUENCE {seq} OWNED BY NONE")
+        schema_editor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{TABLE}_old"')
+        schema_editor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{TABLE}_old" INCLUDING DEFAULTS) '
+                              f'PARTITION BY RANGE ("timestamp")')
+        schema_editor.execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("id", "timestamp")')
+        schema_editor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "att_emp_client_ts_uniq" '
+                              f'UNIQUE ("employee_id", "client_id", "timestamp")')
+        schema_editor.execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+        # Một phân vùng cho mỗi tháng từ lượt chấm công cũ nhất tới 3 tháng sau hiện tại
+        cursor.execute(f'SELECT min("timestamp") FROM "{TABLE}_old"')
+        first = cursor.fetchone()[0]
+        today = timezone.localdate()
+        y, m = (timezone.localtime(first).year, timezone.localtime(first).month) if first else (today.year, today.month)
+        last = today.year * 12 + today.month - 1 + 3
+        while y * 12 + m - 1 <= last:
+            ny, nm = _next_month(y, m)
+            schema_editor.execute(
+                f'CREATE TABLE "{TABLE}_p{y:04d}{m:02d}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                [_month_start(y, m), _month_start(ny, nm)],
+            )
+            y, m = ny, nm
+
+        schema_editor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{TABLE}_old"')
+        schema_editor.execute(f'DROP TABLE "{TABLE}_old"')
+        schema_editor.execute(f'ALTER SEQUENCE {seq} OWNED BY "{TABLE}"."id"')
+
+    # Index và khoá ngoại với đúng tên Django sinh ra, để các migration sau vẫn tìm thấy
+    for index in Attendance._meta.indexes:
+        schema_editor.add_index(Attendance, index)
+    for name in ("work_location", "created_by", "changed_by"):
+        field = Attendance._meta.get_field(name)
+        schema_editor.execute(schema_editor._create_index_sql(Attendance, [field]))
+    for name in ("employee", "work_location", "created_by", "changed_by"):
+        field = Attendance._meta.get_field(name)
+        schema_editor.execute(schema_editor._create_fk_sql(Attendance, field, "_fk_%(to_table)s_%(to_column)s"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_employee_face_templates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancechangelog',
+            name='attendance',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='logs', to='attendance.Attendance'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('filename', models.CharField(max_length=255)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('sha256', models.CharField(max_length=64)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('year', 'month')},
+            },
+        ),
+        # Không đảo ngược: bảng phân vùng vẫn dùng được với model hiện tại
+        migrations.RunPython(partition_attendance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+import json
+
+from django.db import migrations
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Khớp với audit.TRACKED_FIELDS; tên trường trong ảnh chụp AttendanceSerializer cũ
+FIELDS = (
+    ("employee_id", "employee"), ("type", "type"), ("timestamp", "timestamp"), ("latitude", "latitude"),
+    ("longitude", "longitude"), ("distance_m", "distance_m"), ("within_geofence", "within_geofence"),
+    ("work_location_id", "work_location"), ("note", "note"), ("verification", "verification"),
+)
+
+
+def _flatten(data):
+    if isinstance(data, str):  # backend không giải mã JSON sẵn
+        data = json.loads(data)
+    out = {}
+    for field, key in FIELDS:
+        v = (data or {}).get(key)
+        if field == "work_location_id" and isinstance(v, dict):
+            v = v.get("id")
+        elif field == "timestamp" and isinstance(v, str):
+            dt = parse_datetime(v)
+            v = dt.astimezone(timezone.utc).isoformat() if dt else v
+        out[field] = v
+    return out
+
+
+def snapshots_to_deltas(apps, schema_editor):
+    AttendanceChangeLog = apps.get_model("attendance", "AttendanceChangeLog")
+    batch = []
+    for log in AttendanceChangeLog.objects.only("id", "before_data", "changes").iterator(chunk_size=2000):
+        before, after = _flatten(log.before_data), _flatten(log.changes)
+        log.changes = {f: [before[f], after[f]] for f, _ in FIELDS if before[f] != after[f]}
+        batch.append(log)
+        if len(batch) >= 2000:
+            AttendanceChangeLog.objects.bulk_update(batch, ["changes"])
+            batch = []
+    AttendanceChangeLog.objects.bulk_update(batch, ["changes"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_attendance_partitions_archive'),
+    ]
+
+    # after_data được đổi tên thành changes (không cần giá trị mặc định khi thêm cột, nên
+    # chạy được cả trên SQLite) rồi ghi đè bằng delta
+    operations = [
+        migrations.RenameField(
+            model_name='attendancechangelog',
+            old_name='after_data',
+            new_name='changes',
+        ),
+        migrations.RunPython(snapshots_to_deltas, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='attendancechangelog',
+            name='before_data',
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+from django.utils import timezone
+
+from attendance.timesheet import summarize_day
+
+BATCH = 2000
+
+
+def backfill(apps, schema_editor):
+    """
+    0003 tạo DailyTimesheet rỗng: tính các ngày đã có chấm công trước đó để báo cáo
+    không hiện 0 giờ. Chỉ tạo các ngày chưa có dòng tổng hợp (ngày có dòng đã được
+    cập nhật khi chấm công), nên chạy lại hay chạy sau khi server đã ghi vẫn an toàn.
+    Các tháng đã nằm trong file lưu trữ được dựng lại bằng `rebuild_timesheets`.
+    """
+    Attendance = apps.get_model("attendance", "Attendance")
+    DailyTimesheet = apps.get_model("attendance", "DailyTimesheet")
+    Employee = apps.get_model("attendance", "Employee")
+    Shift = apps.get_model("attendance", "Shift")
+
+    shifts = {s.pk: s for s in Shift.objects.all()}
+    emp_shift = dict(Employee.objects.values_list("pk", "shift_id"))
+    existing = set(DailyTimesheet.objects.values_list("employee_id", "date"))
+    # summarize_day có thể trả thêm trường của các migration sau
+    fields = {f.name for f in DailyTimesheet._meta.get_fields()}
+
+    batch = []
+
+    def flush(key, ins, outs):
+        if key is None or key in existing:
+            return
+        emp_id, day = key
+        summary = summarize_day(day, ins, outs, shifts.get(emp_shift.get(emp_id)))
+        batch.append(DailyTimesheet(employee_id=emp_id, date=day,
+                                    **{k: v for k, v in summary.items() if k in fields}))
+        if len(batch) >= BATCH:
+            DailyTimesheet.objects.bulk_create(batch)
+            batch.clear()
+
+    rows = (Attendance.objects.filter(employee__isnull=False)
+            .exclude(verification="rejected")
+            .order_by("employee_id", "timestamp")
+            .values_list("employee_id", "timestamp", "type")
+            .iterator(chunk_size=BATCH))
+    key, ins, outs = None, [], []
+    for emp_id, ts, t in rows:
+        k = (emp_id, timezone.localtime(ts).date())
+        if k != key:
+            flush(key, ins, outs)
+            key, ins, outs = k, [], []
+        (ins if t == "IN" else outs).append(ts)
+    flush(key, ins, outs)
+    DailyTimesheet.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_changelog_delta'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
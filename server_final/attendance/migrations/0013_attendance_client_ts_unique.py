@@ -0,0 +1,44 @@
+from django.db import migrations
+
+OLD = {('employee', 'client_id')}
+NEW = {('employee', 'client_id', 'timestamp')}
+
+
+def _alter(apps, schema_editor, old, new):
+    # PostgreSQL: bảng phân vùng của 0009 đã có att_emp_client_ts_uniq
+    # (employee_id, client_id, timestamp), chỉ cần cập nhật trạng thái model
+    if schema_editor.connection.vendor == "postgresql":
+        return
+    Attendance = apps.get_model("attendance", "Attendance")
+    schema_editor.alter_unique_together(Attendance, old, new)
+
+
+def forwards(apps, schema_editor):
+    _alter(apps, schema_editor, OLD, NEW)
+
+
+def backwards(apps, schema_editor):
+    _alter(apps, schema_editor, NEW, OLD)
+
+
+class Migration(migrations.Migration):
+    """
+    Ràng buộc chống gửi trùng của Attendance giống nhau trên mọi backend:
+    (employee, client_id, timestamp) như bảng phân vùng trên PostgreSQL.
+    """
+
+    dependencies = [
+        ('attendance', '0012_attendance_emp_type_ts_idx'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(forwards, backwards)],
+            state_operations=[
+                migrations.AlterUniqueTogether(
+                    name='attendance',
+                    unique_together=NEW,
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:56
+
+import attendance.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0013_attendance_client_ts_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancechangelog',
+            name='changes',
+            field=attendance.models.JSONField(blank=True, default=dict),
+        ),
+    ]
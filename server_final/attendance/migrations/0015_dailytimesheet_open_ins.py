@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.utils import timezone
+
+import attendance.models
+
+BATCH = 2000
+
+
+def backfill(apps, schema_editor):
+    """Điền open_ins cho các ngày còn IN chưa ghép (open_in khác NULL) từ chấm công thô."""
+    Attendance = apps.get_model("attendance", "Attendance")
+    DailyTimesheet = apps.get_model("attendance", "DailyTimesheet")
+    from attendance.timesheet import pair_punches
+    from attendance.utils import local_day_range
+
+    batch = []
+    for sheet in DailyTimesheet.objects.filter(open_in__isnull=False).only("id", "employee_id", "date", "open_in").iterator():
+        lo, hi = local_day_range(sheet.date, sheet.date)
+        ins, outs = [], []
+        for ts, t in (Attendance.objects.filter(employee_id=sheet.employee_id, timestamp__gte=lo, timestamp__lt=hi)
+                      .exclude(verification="rejected").order_by("timestamp").values_list("timestamp", "type")):
+            (ins if t == "IN" else outs).append(ts)
+        _, pairs = pair_punches(ins, outs)
+        # Ngày đã lưu trữ khỏi bảng: giữ IN chưa ghép đã biết
+        open_ins = ins[pairs:] or [sheet.open_in]
+        sheet.open_ins = [ts.astimezone(timezone.utc).isoformat() for ts in open_ins]
+        batch.append(sheet)
+        if len(batch) >= BATCH:
+            DailyTimesheet.objects.bulk_update(batch, ["open_ins"])
+            batch = []
+    DailyTimesheet.objects.bulk_update(batch, ["open_ins"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0014_changelog_portable_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailytimesheet',
+            name='open_ins',
+            field=attendance.models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
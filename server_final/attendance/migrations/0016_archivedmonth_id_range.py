@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Điền khoảng id cho các tháng đã lưu trữ từ cột id của file; thiếu file thì để trống."""
+    import os
+    ArchivedMonth = apps.get_model("attendance", "ArchivedMonth")
+    months = list(ArchivedMonth.objects.all())
+    if not months:
+        return
+    import numpy as np
+    from attendance.archive import archive_dir
+    for am in months:
+        path = os.path.join(archive_dir(), am.filename)
+        if not os.path.exists(path):
+            continue
+        with np.load(path, allow_pickle=False) as npz:
+            ids = npz["id"]
+        if len(ids):
+            am.min_id, am.max_id = int(ids.min()), int(ids.max())
+            am.save(update_fields=["min_id", "max_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_dailytimesheet_open_ins'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmonth',
+            name='min_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedmonth',
+            name='max_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,26 @@
 
+import json
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import JSONField as PostgresJSONField
+
+
+class JSONField(PostgresJSONField):
+    """jsonb trên PostgreSQL; các backend khác (SQLite khi phát triển, test) lưu chuỗi JSON."""
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor == "postgresql":
+            return super().get_db_prep_value(value, connection, prepared)
+        return None if value is None else json.dumps(value, cls=self.encoder)
+
+    def from_db_value(self, value, expression, connection):
+        # psycopg2 đã giải mã jsonb; chuỗi trên PostgreSQL là giá trị JSON dạng chuỗi
+        if isinstance(value, str) and connection.vendor != "postgresql":
+            return json.loads(value)
+        return value
+
 
 class Department(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -50,7 +68,9 @@ class Employee(models.Model):
     allowed_locations = models.ManyToManyField(WorkLocation, blank=True)
     is_active = models.BooleanField(default=True)
 
-    face_embedding = models.TextField(blank=True, null=True, help_text="JSON representation of 128-d face embedding")
+    face_embedding = models.BinaryField(blank=True, null=True, help_text="float32 little-endian, L2-normalized face embedding")
+    # Các mẫu khuôn mặt (mỗi ảnh đăng ký một vector đơn vị); face_embedding là centroid của chúng
+    face_templates = models.BinaryField(blank=True, null=True, help_text="float32 little-endian, one L2-normalized embedding per enrolled image")
 
     def __str__(self):
         return self.user.get_username()
@@ -61,6 +81,7 @@ class Employee(models.Model):
 
 class Attendance(models.Model):
     TYPE_CHOICES = (('IN','IN'), ('OUT','OUT'))
+    VERIFICATION_CHOICES = (('verified','verified'), ('pending','pending'), ('rejected','rejected'))
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='attendances', null=True, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     type = models.CharField(max_length=3, choices=TYPE_CHOICES)
@@ -70,22 +91,81 @@ class Attendance(models.Model):
     within_geofence = models.BooleanField(default=False)
     work_location = models.ForeignKey(WorkLocation, on_delete=models.PROTECT, related_name='attendances')
     note = models.CharField(max_length=255, blank=True, default="")
+    # Chấm công trì hoãn: ghi ngay ở trạng thái pending, xác thực khuôn mặt chạy nền
+    verification = models.CharField(max_length=8, choices=VERIFICATION_CHOICES, default='verified')
+    verification_message = models.CharField(max_length=255, blank=True, default="")
+    # Khoá idempotency do app sinh cho lượt chấm công offline, chống gửi trùng khi đồng bộ lại
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='attendance_created')
     changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='attendance_changed')
     changed_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        # PostgreSQL yêu cầu ràng buộc unique chứa khoá phân vùng (timestamp, xem partitions.py).
+        # App gửi lại một lượt offline với cùng client_id và timestamp nên vẫn chặn được
+        # gửi trùng; clock_batch còn lọc trước các client_id đã có của nhân viên
+        unique_together = ('employee', 'client_id', 'timestamp')
+        # Các truy vấn nóng lọc theo nhân viên (+ loại) + khoảng thời gian (half-open);
+        # tests.AttendanceIndexTests kiểm tra planner chọn đúng các index này
+        indexes = [
+            models.Index(fields=['employee', 'timestamp'], name='att_emp_ts_idx'),
+            models.Index(fields=['employee', 'type', 'timestamp'], name='att_emp_type_ts_idx'),
+            models.Index(fields=['timestamp'], name='att_ts_idx'),
+        ]
+
     def __str__(self):
         return f"{self.employee.username} {self.type} @ {self.timestamp:%Y-%m-%d %H:%M}"
 
+class DailyTimesheet(models.Model):
+    """Tổng hợp công theo (nhân viên, ngày địa phương), cập nhật mỗi khi bản chấm công thay đổi."""
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='timesheets')
+    date = models.DateField()
+    total_hours = models.FloatField(default=0)
+    first_in = models.DateTimeField(null=True, blank=True)
+    last_out = models.DateTimeField(null=True, blank=True)
+    late = models.BooleanField(default=False)
+    early_leave = models.BooleanField(default=False)
+    pair_count = models.PositiveIntegerField(default=0)
+    open_in = models.DateTimeField(null=True, blank=True)  # IN đầu tiên chưa được ghép với OUT
+    # Mọi IN chưa được ghép (ISO 8601, UTC), để chấm công tính ngày từ riêng dòng này (clocking.py)
+    open_ins = JSONField(default=list, blank=True)
+
+    class Meta:
+        unique_together = ('employee', 'date')
+        indexes = [models.Index(fields=['date'], name='timesheet_date_idx')]
+
+    def __str__(self):
+        return f"{self.employee_id} {self.date} {self.total_hours:.2f}h"
+
 class AttendanceChangeLog(models.Model):
-    attendance = models.ForeignKey(Attendance, on_delete=models.CASCADE, related_name='logs')
+    # Không ràng buộc khoá ngoại ở DB: log được giữ lại khi tháng của bản chấm công
+    # được lưu trữ (archive_attendance) và trên bảng phân vùng của PostgreSQL
+    attendance = models.ForeignKey(Attendance, on_delete=models.DO_NOTHING, db_constraint=False, related_name='logs')
     action = models.CharField(max_length=32)  # created, edited, deleted
     reason = models.CharField(max_length=255, blank=True, default="")
-    before_data = JSONField(default=dict, blank=True)
-    after_data = JSONField(default=dict, blank=True)
+    # Chỉ các trường thay đổi: {"trường": [cũ, mới]}, địa điểm lưu bằng id (xem audit.py)
+    changes = JSONField(default=dict, blank=True)
     changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     changed_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"log {self.action} #{self.attendance_id}"
+
+class ArchivedMonth(models.Model):
+    """Một tháng chấm công đã chuyển khỏi bảng Attendance sang file lưu trữ (archive.py)."""
+    year = models.PositiveIntegerField()
+    month = models.PositiveSmallIntegerField()
+    filename = models.CharField(max_length=255)
+    rows = models.PositiveIntegerField(default=0)
+    # Khoảng id trong file, để tìm một bản chấm công chỉ mở đúng file (archive.find_record)
+    min_id = models.BigIntegerField(null=True, blank=True)
+    max_id = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('year', 'month')
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d} ({self.rows} dòng)"
@@ -0,0 +1,185 @@
+"""
+Luồng dữ liệu cho màn hình giám sát chấm công.
+
+- Trang cũ hơn: phân trang keyset trên (timestamp, id) với con trỏ `next`, mỗi trang
+  là một truy vấn dùng index att_ts_idx, không OFFSET, không đếm tổng.
+- Lượt mới: long-poll theo id, nên cả lượt offline đồng bộ muộn cũng hiện ra. Id được
+  cấp lúc INSERT chứ không lúc commit: một transaction dài (clock_batch) có thể commit
+  id nhỏ hơn id đã hiện trên màn hình. Vì vậy con trỏ `after` gồm id lớn nhất đã xét
+  và các id còn trống bên dưới nó (trong GAP_WINDOW id gần nhất); mỗi lần hỏi đọc cả
+  các id trống đó, lượt commit muộn được trả về đúng một lần.
+- Khi chưa có gì mới, request chỉ đọc một số thế hệ trong cache dùng chung; số này
+  tăng sau khi transaction ghi Attendance commit, lúc đó mới truy vấn DB. Mỗi request
+  long-poll giữ một luồng worker tối đa MONITOR_LONGPOLL_TIMEOUT giây.
+"""
+import base64
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, Case, Q, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .dashboard_cache import bump
+from .models import Attendance
+
+GEN_KEY = "attendance:monitor:gen"
+MAX_LIMIT = 200
+GAP_WINDOW = 1000  # id trống cách id lớn nhất quá số này coi như đã rollback
+MAX_GAPS = 200
+
+FEED_FIELDS = (
+    "id", "timestamp", "type", "latitude", "longitude", "distance_m", "within_geofence", "verification",
+    "employee_id", "employee__user__username", "work_location_id", "work_location__name",
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ts, pk):
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{pk}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        ts, pk = raw.rsplit("|", 1)
+        ts = parse_datetime(ts)
+        if ts is None:
+            raise ValueError(raw)
+        return ts, int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def conditions(params):
+    """Q theo các bộ lọc department_id, work_location_id, within_geofence (1/0), type; ValueError nếu id sai."""
+    q = Q()
+    if params.get("department_id"):
+        q &= Q(employee__department_id=int(params["department_id"]))
+    if params.get("work_location_id"):
+        q &= Q(work_location_id=int(params["work_location_id"]))
+    if params.get("within_geofence") in ("1", "0"):
+        q &= Q(within_geofence=params["within_geofence"] == "1")
+    if params.get("type") in ("IN", "OUT"):
+        q &= Q(type=params["type"])
+    return q
+
+
+def filtered(params):
+    """Attendance theo các bộ lọc của conditions()."""
+    return Attendance.objects.filter(conditions(params))
+
+
+def _item(row):
+    ts = row["timestamp"]
+    return {
+        "id": row["id"],
+        "timestamp": ts.isoformat(),
+        "time_display": timezone.localtime(ts).strftime("%d/%m/%Y %H:%M"),
+        "type": row["type"],
+        "employee_id": row["employee_id"],
+        "username": row["employee__user__username"],
+        "work_location": {"id": row["work_location_id"], "name": row["work_location__name"]},
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "distance_m": row["distance_m"],
+        "within_geofence": row["within_geofence"],
+        "verification": row["verification"],
+    }
+
+
+def page(qs, before=None, limit=50):
+    """
+    Một trang các lượt chấm công mới nhất trước con trỏ `before` (None: từ đầu).
+    Trả về (items, con trỏ trang kế tiếp hoặc None).
+    """
+    if before is not None:
+        ts, pk = decode_cursor(before)
+        qs = qs.filter(Q(timestamp__lt=ts) | Q(timestamp=ts, id__lt=pk))
+    rows = list(qs.order_by("-timestamp", "-id").values(*FEED_FIELDS)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+    return [_item(r) for r in rows], next_cursor
+
+
+def encode_after(last_id, gaps=()):
+    return ".".join(str(i) for i in [last_id, *sorted(gaps)])
+
+
+def decode_after(value):
+    """Con trỏ `after` -> (id lớn nhất đã xét, tập id trống bên dưới)."""
+    try:
+        ids = [int(part) for part in str(value).split(".")]
+    except ValueError as e:
+        raise InvalidCursor(str(e))
+    if len(ids) > MAX_GAPS + 1 or min(ids) < 0 or any(i >= ids[0] for i in ids[1:]):
+        raise InvalidCursor(value)
+    return ids[0], set(ids[1:])
+
+
+def _advance(last_id, gaps, ids):
+    """(id lớn nhất, id trống) sau khi đã xét các id `ids` lớn hơn `last_id` hoặc thuộc `gaps`."""
+    seen = set(ids)
+    top = max([last_id, *seen])
+    gaps = (gaps | set(range(max(last_id + 1, top - GAP_WINDOW), top))) - seen
+    return top, sorted(i for i in gaps if i > top - GAP_WINDOW)[-MAX_GAPS:]
+
+
+def start_cursor():
+    """Con trỏ `after` cho lần long-poll đầu: id lớn nhất hiện có và các id trống ngay dưới nó."""
+    ids = list(Attendance.objects.order_by("-id").values_list("id", flat=True)[:GAP_WINDOW])
+    if not ids:
+        return encode_after(0)
+    return encode_after(*_advance(ids[0], set(), ids))
+
+
+def newer(params, after, limit=MAX_LIMIT, wait=0):
+    """
+    Các lượt khớp bộ lọc `params` commit sau con trỏ `after` (encode_after), theo id.
+    Nếu chưa có và `wait` > 0 thì chờ tối đa `wait` giây cho tới khi có lượt mới.
+    Trả về (items, con trỏ kế tiếp, còn nữa hay không). Có thể trả items rỗng kèm con
+    trỏ mới khi các lượt vừa xét không khớp bộ lọc.
+    """
+    last_id, gaps = decode_after(after)
+    condition = conditions(params)
+    match = (Case(When(condition, then=Value(True)), default=Value(False), output_field=BooleanField())
+             if condition else Value(True, output_field=BooleanField()))
+    deadline = time.monotonic() + min(wait, getattr(settings, "MONITOR_LONGPOLL_TIMEOUT", 25))
+    interval = getattr(settings, "MONITOR_POLL_INTERVAL", 0.5)
+    while True:
+        # Đọc thế hệ trước khi truy vấn để không bỏ lỡ lượt ghi xen giữa hai bước. Xét mọi
+        # lượt (không lọc) để biết id nào còn trống, chỉ trả về các lượt khớp bộ lọc
+        gen = cache.get(GEN_KEY, 0)
+        rows = list(Attendance.objects.filter(Q(id__gt=last_id) | Q(id__in=gaps)).annotate(matches=match)
+                    .order_by("id").values(*FEED_FIELDS, "matches")[:limit + 1])
+        if rows or time.monotonic() >= deadline:
+            break
+        while cache.get(GEN_KEY, 0) == gen and time.monotonic() < deadline:
+            time.sleep(interval)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = encode_after(*_advance(last_id, gaps, [r["id"] for r in rows]))
+    return [_item(r) for r in rows if r["matches"]], cursor, more
+
+
+def notify():
+    """Báo có lượt chấm công mới, sau khi transaction hiện tại commit."""
+    transaction.on_commit(lambda: bump(GEN_KEY))
+
+
+def _on_attendance_saved(sender, instance, created, **kwargs):
+    if created:
+        notify()
+
+
+def connect_signals():
+    # bulk_create không phát signal: clock_batch gọi notify() trực tiếp
+    post_save.connect(_on_attendance_saved, sender=Attendance, dispatch_uid="monitor:attendance")
@@ -0,0 +1,124 @@
+"""
+Phân vùng theo tháng cho bảng Attendance trên PostgreSQL.
+
+Migration 0009 chuyển attendance_attendance thành bảng PARTITION BY RANGE
+("timestamp"), mỗi tháng (theo giờ địa phương) một phân vùng
+attendance_attendance_pYYYYMM, cộng một phân vùng DEFAULT hứng các dòng chưa có
+tháng. Khoá chính là (id, timestamp) và ràng buộc chống gửi trùng là
+(employee_id, client_id, timestamp), vì PostgreSQL yêu cầu mọi ràng buộc
+unique chứa khoá phân vùng.
+
+Truy vấn theo khoảng thời gian chỉ quét các phân vùng liên quan; lưu trữ một tháng
+(archive_attendance) là DETACH + DROP phân vùng thay vì DELETE từng dòng. Trên
+SQLite các hàm ở đây không làm gì: bảng giữ nguyên, lưu trữ xoá theo khoảng
+thời gian trên index att_ts_idx.
+"""
+from datetime import date
+
+from django.db import connection, transaction
+
+from .models import Attendance
+from .utils import local_day_range
+
+TABLE = Attendance._meta.db_table
+
+
+def enabled(conn=None):
+    """True nếu bảng Attendance là bảng phân vùng (PostgreSQL sau migration 0009)."""
+    conn = conn or connection
+    if conn.vendor != "postgresql":
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def partition_name(year, month):
+    return f"{TABLE}_p{year:04d}{month:02d}"
+
+
+def month_range(year, month):
+    """[ngày 1 00:00, ngày 1 tháng sau 00:00) theo giờ địa phương, dạng datetime có múi giờ."""
+    lo, _ = local_day_range(date(year, month, 1), date(year, month, 1))
+    ny, nm = (year + 1, 1) if month == 12 else (year, month + 1)
+    hi, _ = local_day_range(date(ny, nm, 1), date(ny, nm, 1))
+    return lo, hi
+
+
+def add_months(year, month, n):
+    i = year * 12 + month - 1 + n
+    return i // 12, i % 12 + 1
+
+
+def existing(conn=None):
+    """Tập (năm, tháng) đã có phân vùng riêng."""
+    conn = conn or connection
+    prefix = f"{TABLE}_p"
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", [TABLE],
+        )
+        names = [r[0] for r in cursor.fetchall()]
+    return {(int(n[len(prefix):len(prefix) + 4]), int(n[len(prefix) + 4:]))
+            for n in names if n.startswith(prefix) and n[len(prefix):].isdigit()}
+
+
+def create(year, month, conn=None):
+    """
+    Tạo phân vùng cho tháng. Các dòng của tháng đó đang nằm trong phân vùng DEFAULT
+    được chuyển sang trong cùng transaction (PostgreSQL không cho tạo phân vùng
+    khi DEFAULT còn dòng thuộc khoảng của nó).
+    """
+    conn = conn or connection
+    lo, hi = month_range(year, month)
+    name = partition_name(year, month)
+    default = f"{TABLE}_default"
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE _att_move ON COMMIT DROP AS SELECT * FROM "{default}" '
+                       f'WHERE "timestamp" >= %s AND "timestamp" < %s', [lo, hi])
+        cursor.execute(f'DELETE FROM "{default}" WHERE "timestamp" >= %s AND "timestamp" < %s', [lo, hi])
+        cursor.execute(f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)', [lo, hi])
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM _att_move')
+
+
+def ensure(months_ahead=3, conn=None):
+    """Tạo phân vùng cho tháng hiện tại và `months_ahead` tháng tới nếu chưa có. Trả về các tháng đã tạo."""
+    from django.utils import timezone
+    conn = conn or connection
+    if not enabled(conn):
+        return []
+    today = timezone.localdate()
+    have = existing(conn)
+    created = []
+    for n in range(months_ahead + 1):
+        ym = add_months(today.year, today.month, n)
+        if ym not in have:
+            create(*ym, conn=conn)
+            created.append(ym)
+    return created
+
+
+def lock(year, month, conn=None):
+    """
+    Chặn ghi vào phân vùng của tháng (vẫn cho đọc) tới hết transaction hiện tại.
+    Trả về False nếu tháng không có phân vùng riêng.
+    """
+    conn = conn or connection
+    if not enabled(conn) or (year, month) not in existing(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{partition_name(year, month)}" IN SHARE ROW EXCLUSIVE MODE')
+    return True
+
+
+def drop(year, month, conn=None):
+    """Bỏ phân vùng của tháng (đã lưu trữ). Trả về False nếu tháng không có phân vùng riêng."""
+    conn = conn or connection
+    if not enabled(conn) or (year, month) not in existing(conn):
+        return False
+    name = partition_name(year, month)
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+        cursor.execute(f'DROP TABLE "{name}"')
+    return True
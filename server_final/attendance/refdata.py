@@ -0,0 +1,142 @@
+"""
+Cache trong tiến trình cho dữ liệu tham chiếu: địa điểm, ca làm việc, vai trò,
+phòng ban, chức vụ và danh sách tháng chấm công đã lưu trữ.
+
+Các bảng này gần như không đổi nên mỗi worker giữ một bản sao trong bộ nhớ, nạp
+lại toàn bộ khi số phiên bản trong cache dùng chung (Django cache) thay đổi. Mọi
+lần lưu/xoá một dòng của các bảng này (web_shifts, web_locations, admin...) đều
+tăng phiên bản qua signal post_save/post_delete ngay sau khi transaction commit
+(trước đó worker khác có thể nạp lại đúng dữ liệu cũ rồi giữ mãi), nên request kế
+tiếp trên mọi worker sẽ thấy dữ liệu mới. Với nhiều tiến trình cần cache dùng chung thật sự
+(DJANGO_CACHE=redis hoặc memcached); locmem chỉ đồng bộ trong một tiến trình.
+
+Địa điểm được phép của từng nhân viên (bảng trung gian allowed_locations) cũng nằm
+trong bản sao này, để chấm công không phải đọc bảng đó; thay đổi qua
+`allowed_locations.add/set/remove` tăng phiên bản bằng signal m2m_changed, còn các
+đường ghi thẳng bảng trung gian (importer) gọi invalidate().
+
+Các đối tượng trả về được dùng chung giữa các request: chỉ đọc, không sửa.
+"""
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .dashboard_cache import bump
+from .geofence import LocationIndex
+from .models import ArchivedMonth, Department, Employee, Position, Role, Shift, WorkLocation
+
+VERSION_KEY = "attendance:refdata:version"
+LOCATION_INDEXES = "location_indexes"
+EMPLOYEE_LOCATIONS = "employee_locations"
+MAX_LOCATION_INDEXES = 256  # số tập địa điểm được phép khác nhau giữ index trong bộ nhớ
+
+# tên -> (model, thứ tự, select_related)
+TABLES = {
+    "locations": (WorkLocation, ("name", "id"), ()),
+    "shifts": (Shift, ("name",), ()),
+    "roles": (Role, ("name",), ()),
+    "departments": (Department, ("name",), ()),
+    "positions": (Position, ("department__name", "name"), ("department",)),
+    "archived_months": (ArchivedMonth, ("year", "month"), ()),
+}
+
+
+class RefDataCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        data = {}
+        for name, (model, ordering, related) in TABLES.items():
+            rows = list(model.objects.select_related(*related).order_by(*ordering))
+            data[name] = (rows, {r.pk: r for r in rows})
+        data[LOCATION_INDEXES] = {}
+        allowed = data[EMPLOYEE_LOCATIONS] = {}
+        for emp_id, loc_id in (Employee.allowed_locations.through.objects.order_by("id")
+                               .values_list("employee_id", "worklocation_id").iterator()):
+            allowed.setdefault(emp_id, []).append(loc_id)
+        return data
+
+    def _snapshot(self):
+        # Đọc phiên bản trước khi nạp: nếu có thay đổi trong lúc nạp, request sau sẽ nạp lại
+        version = cache.get(VERSION_KEY, 0)
+        data = self._data
+        if data is not None and self._version == version:
+            self.hits += 1
+            return data
+        with self._lock:
+            if self._data is None or self._version != version:
+                self.misses += 1
+                self._data = self._load()
+                self._version = version
+            else:
+                self.hits += 1
+            return self._data
+
+    def all(self, name):
+        """Danh sách các dòng của bảng `name` (xem TABLES)."""
+        return list(self._snapshot()[name][0])
+
+    def get(self, name, pk):
+        """Dòng có khoá `pk` của bảng `name`, None nếu không có."""
+        if pk is None:
+            return None
+        return self._snapshot()[name][1].get(int(pk))
+
+    def employee_locations(self, emp):
+        """Địa điểm được phép của `emp`, theo thứ tự được gán; không truy vấn DB."""
+        data = self._snapshot()
+        by_id = data["locations"][1]
+        return [by_id[i] for i in data[EMPLOYEE_LOCATIONS].get(emp.pk, ()) if i in by_id]
+
+    def location_index(self, locations):
+        """
+        LocationIndex cho danh sách địa điểm `locations` (lấy từ refdata), dựng một lần
+        cho mỗi phiên bản dữ liệu tham chiếu thay vì ở mỗi lượt chấm công.
+        """
+        indexes = self._snapshot()[LOCATION_INDEXES]
+        key = tuple(loc.pk for loc in locations)
+        index = indexes.get(key)
+        if index is None:
+            if len(indexes) >= MAX_LOCATION_INDEXES:
+                indexes.clear()
+            index = indexes[key] = LocationIndex(locations)
+        return index
+
+    def context(self):
+        """Các danh sách cho form nhân viên/chấm công trong web UI."""
+        return {name: self.all(name) for name in TABLES if name != "archived_months"}
+
+    def version(self):
+        """Phiên bản hiện tại trong cache dùng chung, dùng để dựng ETag/khoá cache."""
+        return cache.get(VERSION_KEY, 0)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "version": self._version}
+
+
+refdata = RefDataCache()
+
+
+def invalidate(**kwargs):
+    # Sau commit: worker khác nạp lại ngay khi thấy phiên bản mới, lúc đó dữ liệu phải đã được ghi
+    transaction.on_commit(lambda: bump(VERSION_KEY))
+
+
+def _allowed_locations_changed(action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate()
+
+
+def connect_signals():
+    for model, _, _ in TABLES.values():
+        post_save.connect(invalidate, sender=model, dispatch_uid=f"refdata:save:{model.__name__}")
+        post_delete.connect(invalidate, sender=model, dispatch_uid=f"refdata:delete:{model.__name__}")
+    m2m_changed.connect(_allowed_locations_changed, sender=Employee.allowed_locations.through,
+                        dispatch_uid="refdata:employee_locations")
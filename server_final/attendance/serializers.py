@@ -2,6 +2,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Department, Position, Role, WorkLocation, Shift, Employee, Attendance
+from .refdata import refdata
 
 class RoleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -58,21 +59,29 @@ class EmployeeMeSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name', required=False)
     last_name = serializers.CharField(source='user.last_name', required=False)
     email = serializers.EmailField(source='user.email', required=False)
-    allowed_locations = WorkLocationSerializer(many=True, read_only=True)
-    shift = ShiftSerializer(read_only=True)
+    # Ca làm việc và địa điểm lấy từ cache dữ liệu tham chiếu (refdata.py)
+    allowed_locations = serializers.SerializerMethodField()
+    shift = serializers.SerializerMethodField()
 
     class Meta:
         model = Employee
         fields = ["id","username","first_name","last_name","email","phone","shift","allowed_locations","is_active"]
 
+    def get_allowed_locations(self, obj):
+        return WorkLocationSerializer(refdata.employee_locations(obj), many=True).data
+
+    def get_shift(self, obj):
+        shift = refdata.get("shifts", obj.shift_id)
+        return ShiftSerializer(shift).data if shift else None
+
 class AttendanceSerializer(serializers.ModelSerializer):
     employee_username = serializers.CharField(source='employee.user.username', read_only=True)
     work_location = WorkLocationSerializer(read_only=True)
     work_location_id = serializers.PrimaryKeyRelatedField(source='work_location', queryset=WorkLocation.objects.all(), write_only=True)
     class Meta:
         model = Attendance
-        fields = ["id","employee","employee_username","timestamp","type","latitude","longitude","distance_m","within_geofence","work_location","work_location_id","note"]
-        read_only_fields = ["id","employee","timestamp","distance_m","within_geofence"]
+        fields = ["id","employee","employee_username","timestamp","type","latitude","longitude","distance_m","within_geofence","work_location","work_location_id","note","verification"]
+        read_only_fields = ["id","employee","timestamp","distance_m","within_geofence","verification"]
 
 class HistoryItemSerializer(serializers.Serializer):
     date = serializers.DateField()
@@ -80,3 +89,39 @@ class HistoryItemSerializer(serializers.Serializer):
     total_hours = serializers.FloatField()
     late = serializers.BooleanField()
     early_leave = serializers.BooleanField()
+
+
+# Các cột cần cho một lượt chấm công trong lịch sử, đọc bằng .values() trong một truy vấn join
+HISTORY_ITEM_FIELDS = (
+    "id", "timestamp", "type", "latitude", "longitude", "distance_m", "within_geofence", "note", "verification",
+    "work_location_id", "work_location__name", "work_location__latitude", "work_location__longitude",
+    "work_location__radius_m",
+)
+_timestamp_field = serializers.DateTimeField()
+
+
+def history_item(row, emp):
+    """
+    Cùng dữ liệu với AttendanceSerializer cho một dòng `.values(*HISTORY_ITEM_FIELDS)`
+    của nhân viên `emp`, không tạo model instance và không truy vấn thêm.
+    """
+    return {
+        "id": row["id"],
+        "employee": emp.pk,
+        "employee_username": emp.user.username,
+        "timestamp": _timestamp_field.to_representation(row["timestamp"]),
+        "type": row["type"],
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "distance_m": row["distance_m"],
+        "within_geofence": row["within_geofence"],
+        "work_location": {
+            "id": row["work_location_id"],
+            "name": row["work_location__name"],
+            "latitude": row["work_location__latitude"],
+            "longitude": row["work_location__longitude"],
+            "radius_m": row["work_location__radius_m"],
+        },
+        "note": row["note"],
+        "verification": row["verification"],
+    }
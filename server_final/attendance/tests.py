@@ -0,0 +1,1222 @@
+from datetime import date, datetime, time, timedelta
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time as time_module
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from django.utils import timezone
+
+from .models import ArchivedMonth, Attendance, DailyTimesheet, Employee, Shift, WorkLocation
+from . import archive, audit, clock_metrics, dashboard_cache, enrollment, face_engine, importer, monitor, verification
+from .clocking import ClockError, clock, clock_batch, resolve_location
+from .face_engine import FaceEngine, FaceEngineBusy, FaceEngineTimeout, pack_embedding
+from .face_index import FaceIndex, VERSION_KEY as FACE_INDEX_VERSION
+from .geofence import LocationIndex
+from .refdata import refdata
+from .timesheet import dashboard_kpis, iter_month_rows, rebuild_range, refresh_day
+from .utils import local_day_range
+
+
+def make_employee(username, **kwargs):
+    user = User.objects.create_user(username=username, password="pw12345")
+    return Employee.objects.create(user=user, **kwargs)
+
+
+def local_dt(d, hh, mm=0):
+    return timezone.make_aware(datetime.combine(d, time(hh, mm)))
+
+
+def reset_caches():
+    """Xoá cache dùng chung và buộc refdata nạp lại (bump sau commit không chạy trong TestCase)."""
+    cache.clear()
+    refdata._version = None
+
+
+def run_on_commit():
+    """Chạy các callback transaction.on_commit đang chờ (TestCase không bao giờ commit)."""
+    while connection.run_on_commit:
+        _, callback = connection.run_on_commit.pop(0)
+        callback()
+
+
+def make_punch(emp, t, ts, **kwargs):
+    if "work_location" not in kwargs:
+        kwargs["work_location"], _ = WorkLocation.objects.get_or_create(name="HQ", latitude=10.0, longitude=106.0)
+    return Attendance.objects.create(employee=emp, type=t, timestamp=ts, latitude=10.0, longitude=106.0, **kwargs)
+
+
+class MonthlyTimesheetQueryTests(TestCase):
+    """Bảng công tháng đọc DailyTimesheet bằng một truy vấn, không phụ thuộc số nhân viên."""
+
+    start, end = date(2024, 3, 1), date(2024, 3, 31)
+
+    def _seed(self, n):
+        for i in range(n):
+            emp = make_employee(f"month{n}_{i}")
+            for day in (1, 2, 15):
+                DailyTimesheet.objects.create(employee=emp, date=self.start.replace(day=day), total_hours=8.0)
+
+    def test_month_rows_query_count_is_constant(self):
+        employees = Employee.objects.select_related("user").order_by("id")
+        self._seed(3)
+        with self.assertNumQueries(2):  # nhân viên + DailyTimesheet
+            rows = list(iter_month_rows(employees, self.start, self.end))
+        self.assertEqual(len(rows), 3)
+
+        self._seed(20)
+        with self.assertNumQueries(2):
+            rows = list(iter_month_rows(employees.all(), self.start, self.end))
+        self.assertEqual(len(rows), 23)
+
+    def test_month_rows_values(self):
+        emp = make_employee("month_values")
+        other = make_employee("month_other")
+        DailyTimesheet.objects.create(employee=emp, date=date(2024, 3, 2), total_hours=7.5)
+        DailyTimesheet.objects.create(employee=emp, date=date(2024, 3, 31), total_hours=8.25)
+        DailyTimesheet.objects.create(employee=emp, date=date(2024, 4, 1), total_hours=9.0)  # ngoài tháng
+
+        rows = {e.pk: (daily, total) for e, daily, total in
+                iter_month_rows(Employee.objects.order_by("id"), self.start, self.end)}
+        daily, total = rows[emp.pk]
+        self.assertEqual(len(daily), 31)
+        self.assertEqual(daily[1], 7.5)
+        self.assertEqual(daily[30], 8.25)
+        self.assertEqual(total, 15.75)
+        self.assertEqual(rows[other.pk], ([0.0] * 31, 0.0))
+
+
+class MonthlyExportTests(TestCase):
+    """Xuất bảng công tháng: CSV được stream, XLSX mở được và khớp với iter_month_rows."""
+
+    def setUp(self):
+        self.emp = make_employee("export_a")
+        self.emp.user.first_name, self.emp.user.last_name = "An", "Nguyễn"
+        self.emp.user.save()
+        self.other = make_employee("export_b")
+        DailyTimesheet.objects.create(employee=self.emp, date=date(2024, 3, 2), total_hours=7.5)
+        DailyTimesheet.objects.create(employee=self.emp, date=date(2024, 3, 31), total_hours=8.25)
+        admin = User.objects.create_superuser("export_admin", password="pw12345")
+        self.client.force_login(admin)
+
+    def export(self, **params):
+        return self.client.get(reverse("web_monthly_export"), {"month": "2024-03", **params})
+
+    def test_csv_streams(self):
+        import csv
+        resp = self.export()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertIn('filename="bang_cong_2024_03.csv"', resp["Content-Disposition"])
+        rows = list(csv.reader(b"".join(resp.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3] + rows[0][-2:], ["Username", "Họ tên", "01/03", "31/03", "Tổng giờ"])
+        self.assertEqual(len(rows[0]), 2 + 31 + 1)
+        self.assertEqual([r[0] for r in rows[1:]], ["export_a", "export_b"])
+        self.assertEqual(rows[1][1], "An Nguyễn")
+        self.assertEqual((rows[1][3], rows[1][32], rows[1][-1]), ("7.5", "8.25", "15.75"))
+        self.assertEqual(rows[2][-1], "0.0")
+
+    def test_xlsx_matches_rollup(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        resp = self.export(format="xlsx")
+        self.assertEqual(resp.status_code, 200)
+        ws = load_workbook(BytesIO(b"".join(resp.streaming_content)), read_only=True)["2024-03"]
+        # Ô chuỗi rỗng (họ tên trống) được đọc lại là None
+        rows = [[v if v is not None else "" for v in r] for r in ws.iter_rows(values_only=True)]
+        self.assertEqual(rows[0][0], "Username")
+        expected = [[e.user.username, e.user.get_full_name()] + daily + [total] for e, daily, total in
+                    iter_month_rows(Employee.objects.select_related("user").order_by("id"),
+                                    date(2024, 3, 1), date(2024, 3, 31))]
+        self.assertEqual(rows[1:], expected)
+
+
+class DailyTimesheetSyncTests(TestCase):
+    """DailyTimesheet được backfill và giữ đúng khi xoá chấm công hoặc đổi ca."""
+
+    day = date(2024, 3, 4)
+
+    def setUp(self):
+        self.shift = Shift.objects.create(name="Hành chính", start_time=time(8), end_time=time(17))
+        self.emp = make_employee("sync", shift=self.shift)
+        reset_caches()
+
+    def test_backfill_creates_missing_days_only(self):
+        make_punch(self.emp, "IN", local_dt(self.day, 8, 30))
+        make_punch(self.emp, "OUT", local_dt(self.day, 17))
+        make_punch(self.emp, "IN", local_dt(self.day + timedelta(days=1), 8))
+        make_punch(self.emp, "OUT", local_dt(self.day + timedelta(days=1), 12), verification="rejected")
+        DailyTimesheet.objects.create(employee=self.emp, date=self.day + timedelta(days=1), total_hours=1.0)
+
+        import_module("attendance.migrations.0011_backfill_dailytimesheet").backfill(apps, None)
+
+        sheet = DailyTimesheet.objects.get(employee=self.emp, date=self.day)
+        self.assertEqual(sheet.total_hours, 8.5)
+        self.assertTrue(sheet.late)
+        # Ngày đã có dòng tổng hợp không bị ghi đè
+        self.assertEqual(DailyTimesheet.objects.get(employee=self.emp, date=self.day + timedelta(days=1)).total_hours, 1.0)
+
+    def test_delete_refreshes_day(self):
+        make_punch(self.emp, "IN", local_dt(self.day, 8))
+        out = make_punch(self.emp, "OUT", local_dt(self.day, 17))
+        refresh_day(self.emp, self.day)
+        self.assertEqual(DailyTimesheet.objects.get(employee=self.emp, date=self.day).total_hours, 9.0)
+
+        out.delete()
+        run_on_commit()
+        sheet = DailyTimesheet.objects.get(employee=self.emp, date=self.day)
+        self.assertEqual((sheet.total_hours, sheet.pair_count), (0.0, 0))
+        self.assertIsNotNone(sheet.open_in)
+
+        Attendance.objects.filter(employee=self.emp).delete()
+        run_on_commit()
+        self.assertFalse(DailyTimesheet.objects.filter(employee=self.emp).exists())
+
+    def test_delete_employee_cascades(self):
+        make_punch(self.emp, "IN", local_dt(self.day, 8))
+        refresh_day(self.emp, self.day)
+        self.emp.user.delete()
+        run_on_commit()
+        self.assertFalse(DailyTimesheet.objects.exists())
+
+    def test_shift_change_recomputes_flags(self):
+        day = timezone.localdate().replace(day=1)  # tháng còn mở
+        for d in (day, self.day):
+            make_punch(self.emp, "IN", local_dt(d, 9))
+            make_punch(self.emp, "OUT", local_dt(d, 17))
+            refresh_day(self.emp, d)
+        self.assertTrue(DailyTimesheet.objects.get(employee=self.emp, date=day).late)
+
+        late_shift = Shift.objects.create(name="Ca muộn", start_time=time(9), end_time=time(18))
+        emp = Employee.objects.get(pk=self.emp.pk)
+        emp.shift_id = str(late_shift.pk)  # như form web_employee_edit
+        with self.assertNumQueries(5):  # ca cũ, UPDATE, ca mới, dòng tổng hợp, bulk_update
+            emp.save()
+        sheet = DailyTimesheet.objects.get(employee=self.emp, date=day)
+        self.assertEqual((sheet.late, sheet.early_leave), (False, True))
+        # Tháng đã đóng giữ cờ theo ca cũ, cho tới khi chạy rebuild_timesheets --flags-only
+        self.assertTrue(DailyTimesheet.objects.get(employee=self.emp, date=self.day).late)
+        call_command("rebuild_timesheets", "--flags-only", start=str(self.day), end=str(self.day), stdout=StringIO())
+        self.assertFalse(DailyTimesheet.objects.get(employee=self.emp, date=self.day).late)
+
+        with self.assertNumQueries(1):  # lưu không đổi ca: chỉ UPDATE
+            emp.save(update_fields=["phone"])
+
+        late_shift.end_time = time(17)
+        late_shift.save()
+        self.assertFalse(DailyTimesheet.objects.get(employee=self.emp, date=day).early_leave)
+
+        make_punch(self.emp, "IN", local_dt(day + timedelta(days=1), 10))
+        refresh_day(emp, day + timedelta(days=1))
+        late_shift.delete()
+        self.assertFalse(DailyTimesheet.objects.filter(date__gte=day, late=True).exists())
+
+
+class DashboardKpiQueryTests(TestCase):
+    """KPI dashboard đọc DailyTimesheet bằng đúng 4 truy vấn tổng hợp."""
+
+    start, end = date(2024, 3, 1), date(2024, 3, 31)
+
+    def setUp(self):
+        reset_caches()
+        self.shift = Shift.objects.create(name="Hành chính", start_time=time(8), end_time=time(17))
+
+    def _seed(self, n, prefix):
+        for i in range(n):
+            emp = make_employee(f"{prefix}{i}", shift=self.shift)
+            for day, late in ((4, i % 2 == 0), (5, True)):
+                d = self.start.replace(day=day)
+                DailyTimesheet.objects.create(employee=emp, date=d, total_hours=8.0, late=late,
+                                              first_in=local_dt(d, 9 if late else 8))
+
+    def test_query_count_is_constant(self):
+        self._seed(2, "kpi_a")
+        with self.assertNumQueries(4):
+            dashboard_kpis(self.start, self.end)
+        self._seed(20, "kpi_b")
+        with self.assertNumQueries(4):
+            kpis = dashboard_kpis(self.start, self.end)
+        self.assertEqual(kpis["total_emp"], 22)
+        self.assertEqual(len(kpis["daily_hours"]), 2)
+
+    def test_values(self):
+        self._seed(3, "kpi_v")
+        make_employee("kpi_absent")
+        kpis = dashboard_kpis(self.start, self.end)
+        self.assertEqual((kpis["total_emp"], kpis["present"], kpis["absent"]), (4, 3, 1))
+        # Chỉ xét ngày đầu tiên có IN của mỗi người: nhân viên 0 và 2 trễ ngày 4
+        self.assertEqual(kpis["late_count"], 2)
+        self.assertEqual(kpis["daily_hours"], [(date(2024, 3, 4), 24.0), (date(2024, 3, 5), 24.0)])
+
+    def test_cached_until_invalidated(self):
+        self._seed(2, "kpi_c")
+        with self.assertNumQueries(4):
+            dashboard_cache.get_kpis("month", self.start, self.end)
+        with self.assertNumQueries(0):
+            dashboard_cache.get_kpis("month", self.start, self.end)
+        dashboard_cache.invalidate_dates(date(2024, 3, 10))
+        with self.assertNumQueries(4):
+            dashboard_cache.get_kpis("month", self.start, self.end)
+
+
+class AttendanceIndexTests(TestCase):
+    """EXPLAIN các truy vấn chấm công nóng: planner phải dùng đúng index của Attendance."""
+
+    start = date(2024, 3, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        # Đủ dữ liệu để thống kê của planner phản ánh một tháng thật: 20 người x 2 lượt x 30 ngày
+        loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        punches = []
+        for i in range(20):
+            emp = make_employee(f"idx{i}")
+            for day in range(30):
+                d = cls.start + timedelta(days=day)
+                punches += [Attendance(employee=emp, type=t, timestamp=local_dt(d, hh), latitude=10.0,
+                                       longitude=106.0, work_location=loc) for t, hh in (("IN", 8), ("OUT", 17))]
+        Attendance.objects.bulk_create(punches)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE attendance_attendance")
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # Bảng nhỏ thì planner chọn seq scan; tắt đi để xem index có dùng được không
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        lo, hi = local_day_range(self.start, self.start.replace(day=31))
+        self.emp_id = Employee.objects.order_by("id").values_list("id", flat=True)[0]
+        self.punches = Attendance.objects.filter(timestamp__gte=lo, timestamp__lt=hi)
+
+    def _index_names(self, *names):
+        # PostgreSQL: bảng phân vùng theo tháng, plan ghi tên index của từng phân vùng
+        found = set(names)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                               "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = ANY(%s)", [list(names)])
+                found.update(r[0] for r in cursor.fetchall())
+        return found
+
+    def assertUsesIndex(self, qs, *names):
+        plan = qs.explain()
+        self.assertTrue(any(name in plan for name in self._index_names(*names)), plan)
+
+    def test_last_punch_of_type(self):
+        # Lượt IN/OUT cuối của một nhân viên trong ngày
+        self.assertUsesIndex(self.punches.filter(employee_id=self.emp_id, type="IN").order_by("-timestamp")[:1],
+                             "att_emp_type_ts_idx")
+
+    def test_employee_history(self):
+        self.assertUsesIndex(self.punches.filter(employee_id=self.emp_id).order_by("timestamp"),
+                             "att_emp_ts_idx", "att_emp_type_ts_idx")
+
+    def test_timesheet_range(self):
+        self.assertUsesIndex(self.punches.filter(employee__isnull=False).order_by("employee_id", "timestamp")
+                             .values_list("employee_id", "timestamp", "type"),
+                             "att_ts_idx", "att_emp_ts_idx", "att_emp_type_ts_idx")
+
+
+class ClockQueryTests(TestCase):
+    """clocking.clock: số round-trip cố định và bảng tổng hợp tăng dần khớp với dựng lại."""
+
+    day = date(2024, 3, 4)
+
+    def setUp(self):
+        self.shift = Shift.objects.create(name="Hành chính", start_time=time(8), end_time=time(17))
+        self.emp = make_employee("clock", shift=self.shift)
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        reset_caches()
+
+    def _clock(self, hh, mm=0, t=None):
+        with mock.patch("django.utils.timezone.now", return_value=local_dt(self.day, hh, mm)):
+            att, _, _ = clock(self.emp, 10.0, 106.0, self.loc, t=t)
+        return att
+
+    def _sheet(self):
+        sheet = DailyTimesheet.objects.get(employee=self.emp, date=self.day)
+        return (round(sheet.total_hours, 6), sheet.pair_count, sheet.first_in, sheet.last_out,
+                sheet.open_in, sheet.open_ins, sheet.late, sheet.early_leave)
+
+    def writes(self, sheet_exists=True):
+        # 3 round-trip + SAVEPOINT/RELEASE của transaction.atomic lồng trong TestCase; SQLite
+        # khoá bằng UPDATE rồi mới đọc được dòng đã có (_lock_day)
+        sqlite_read = sheet_exists and not connection.features.has_select_for_update
+        return 3 + sqlite_read + 2
+
+    def test_round_trips(self):
+        refdata.get("shifts", self.shift.pk)  # dữ liệu tham chiếu đã nằm trong cache của worker
+        with self.assertNumQueries(self.writes(sheet_exists=False)):
+            self._clock(8)  # lượt đầu tiên trong ngày: chưa có dòng DailyTimesheet
+        with self.assertNumQueries(self.writes()):
+            self._clock(17)
+
+    @mock.patch("attendance.views.verify_face", return_value=(True, None))
+    @mock.patch("attendance.views.face_engine.available", return_value=True)
+    def test_api_clock_request(self, available, verify_face):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        self.emp.face_embedding = pack_embedding([1.0, 0.0])
+        self.emp.save()
+        self.emp.allowed_locations.add(self.loc)
+        run_on_commit()
+        refdata.all("locations")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.emp.user).access_token}")
+        data = {"latitude": "10.0", "longitude": "106.0", "face_image": SimpleUploadedFile("f.jpg", b"img")}
+        # Cả request: user của JWT + nhân viên + các lệnh ghi ở trên
+        with self.assertNumQueries(2 + self.writes(sheet_exists=False)):
+            resp = client.post(reverse("api_clock"), data, format="multipart")
+        self.assertEqual(resp.status_code, 200, resp.data)
+        self.assertEqual(resp.data["type"], "IN")
+
+    def test_late_punch_already_recorded(self):
+        # Lượt offline lệch giờ nằm sau thời điểm hiện tại: đọc lại các lượt của ngày
+        make_punch(self.emp, "IN", local_dt(self.day, 8))
+        make_punch(self.emp, "OUT", local_dt(self.day, 12, 5))
+        refresh_day(self.emp, self.day)
+        self.assertEqual(self._clock(12).type, "IN")
+        incremental = self._sheet()
+        rebuild_range(self.day, self.day, [self.emp.pk])
+        self.assertEqual(self._sheet(), incremental)
+
+    def test_auto_type(self):
+        self.assertEqual([self._clock(h).type for h in (8, 12, 13, 17)], ["IN", "OUT", "IN", "OUT"])
+
+    def test_incremental_matches_rebuild(self):
+        # Client gửi sẵn type (app offline/kiosk): chuỗi IN, IN, OUT không xen kẽ
+        for hh, mm, t in ((8, 0, "IN"), (9, 0, "IN"), (12, 0, "OUT"), (13, 0, None), (13, 30, "OUT"),
+                          (14, 0, "OUT"), (15, 0, None), (16, 45, None)):
+            self._clock(hh, mm, t)
+            incremental = self._sheet()
+            rebuild_range(self.day, self.day, [self.emp.pk])
+            self.assertEqual(self._sheet(), incremental, f"sau lượt {hh:02d}:{mm:02d}")
+
+
+@mock.patch("attendance.verification.close_old_connections")
+class DeferredVerificationTests(TestCase):
+    """Chấm công trì hoãn: lỗi của face engine không bao giờ biến thành "rejected"."""
+
+    def setUp(self):
+        self.emp = make_employee("deferred")
+        self.att = make_punch(self.emp, "IN", timezone.now(), verification="pending")
+        verification._pending = 0
+        self.addCleanup(setattr, verification, "_pending", 0)
+
+    def _run(self, verdict, requeued=0):
+        with mock.patch("attendance.verification.verify_face", side_effect=verdict) as verify, \
+                mock.patch("attendance.verification.threading.Timer") as timer:
+            verification._run(self.att.pk, b"img", requeued)
+        self.att.refresh_from_db()
+        return verify, timer
+
+    @override_settings(FACE_VERIFY_REQUEUE_DELAY=30)
+    def test_busy_requeues_through_timer(self, close):
+        # Không ngủ trong luồng nền: mỗi lần bận là một lần xếp hàng lại với độ chờ tăng dần
+        for requeued, delay in ((0, 1), (3, 8), (6, 30)):
+            verify, timer = self._run(FaceEngineBusy("bận"), requeued)
+            self.assertEqual(verify.call_count, 1)
+            self.assertEqual(timer.call_args[0][0], delay)
+            timer.return_value.start.assert_called_once_with()
+        self.assertEqual(self.att.verification, "pending")
+
+    def test_timeout_stays_pending(self, close):
+        verify, timer = self._run(FaceEngineTimeout("hết giờ"))
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(self.att.verification, "pending")
+        timer.return_value.start.assert_called_once_with()
+
+    def test_gives_up_requeueing_but_never_rejects(self, close):
+        with self.assertLogs("attendance.verification", "ERROR"):
+            _, timer = self._run(FaceEngineTimeout("hết giờ"), requeued=10)
+        self.assertEqual(self.att.verification, "pending")
+        timer.assert_not_called()
+
+    def test_verdicts(self, close):
+        self._run([(True, "")])
+        self.assertEqual(self.att.verification, "verified")
+        Attendance.objects.filter(pk=self.att.pk).update(verification="pending")
+        refresh_day(self.emp, timezone.localtime(self.att.timestamp).date())
+        self._run(ValueError("Không đọc được file ảnh"))
+        self.assertEqual(self.att.verification, "rejected")
+        self.assertFalse(DailyTimesheet.objects.filter(employee=self.emp).exists())
+
+    @override_settings(FACE_VERIFY_MAX_PENDING=1)
+    def test_queue_is_capped(self, close):
+        other = make_punch(self.emp, "OUT", timezone.now(), verification="pending")
+        with mock.patch("attendance.verification._get_executor") as executor, \
+                self.assertLogs("attendance.verification", "WARNING"):
+            verification.submit(self.att.pk, b"img")
+            verification.submit(other.pk, b"img")
+            run_on_commit()
+        self.assertEqual(executor.return_value.submit.call_count, 1)
+        self.assertTrue(verification.saturated())
+        other.refresh_from_db()
+        self.assertEqual((other.verification, other.verification_message),
+                         ("pending", "Hệ thống nhận diện quá tải, chờ HR kiểm tra."))
+        # Job kết thúc (có kết luận) trả lại chỗ; job đang chờ xếp hàng lại thì vẫn giữ
+        self._run(FaceEngineBusy("bận"))
+        self.assertTrue(verification.saturated())
+        self._run([(True, "")])
+        self.assertFalse(verification.saturated())
+
+
+def fake_represent(img, model_name, detector_backend, quality=False):
+    if img.startswith(b"slow"):
+        time_module.sleep(0.3)
+    return [{"embedding": [1.0, 0.0], "image": img}]
+
+
+@mock.patch("attendance.face_engine._worker_represent", fake_represent)
+class RepresentManyTests(TestCase):
+    """represent_many giữ một slot cho mỗi ảnh và có một hạn chót cho cả lô."""
+
+    def setUp(self):
+        self.engine = FaceEngine(workers=2, max_pending=3, timeout=5.0)
+        self.pool = ThreadPoolExecutor(2)
+        self.engine._get_executor = lambda: self.pool
+        self.addCleanup(self.pool.shutdown)
+
+    def free_slots(self):
+        return self.engine._slots._value
+
+    def test_caps_batch_at_free_slots(self):
+        images = [b"a%d" % i for i in range(5)]
+        results = self.engine.represent_many(images)
+        self.assertEqual([r[0]["image"] for r in results[:3]], images[:3])
+        self.assertTrue(all(isinstance(r, FaceEngineBusy) for r in results[3:]))
+        self.pool.shutdown(wait=True)
+        self.assertEqual(self.free_slots(), 3)
+
+    def test_busy_when_no_slot_is_free(self):
+        for _ in range(3):
+            self.engine._slots.acquire()
+        with self.assertRaises(FaceEngineBusy):
+            self.engine.represent_many([b"a"])
+
+    def test_single_deadline_for_the_batch(self):
+        started = time_module.monotonic()
+        with self.assertRaises(FaceEngineTimeout):
+            self.engine.represent_many([b"slow1", b"slow2", b"slow3"], timeout=0.35)
+        self.assertLess(time_module.monotonic() - started, 0.55)
+
+
+class ClockBatchInputTests(TestCase):
+    """Dữ liệu sai của một lượt trong lô chỉ làm hỏng lượt đó."""
+
+    def setUp(self):
+        self.emp = make_employee("batch")
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.emp.allowed_locations.add(self.loc)
+        reset_caches()
+
+    def test_bad_work_location_id(self):
+        for bad in ("abc", [1], {"id": 1}):
+            with self.assertRaises(ClockError):
+                resolve_location(self.emp, bad, locations=[self.loc])
+
+    @mock.patch("attendance.verification.verify_faces")
+    def test_per_item_results(self, verify_faces):
+        verify_faces.side_effect = lambda emp, images: [(True, ""), (None, "quá tải")][:len(images)]
+        now = timezone.now()
+        item = {"timestamp": now, "latitude": 10.0, "longitude": 106.0, "image": b"img"}
+        results = clock_batch(self.emp, [
+            dict(item, client_id="bad", work_location_id="abc"),
+            dict(item, client_id="ok", work_location_id=str(self.loc.pk)),
+            dict(item, client_id="later", timestamp=now - timedelta(minutes=1)),
+        ])
+        self.assertEqual([r["status"] for r in results], ["invalid", "created", "retry"])
+        self.assertEqual(list(Attendance.objects.values_list("client_id", flat=True)), ["ok"])
+
+    @mock.patch("attendance.verification.verify_faces")
+    def test_type_follows_pairing(self, verify_faces):
+        # IN 8h, IN 9h, OUT 10h: IN 9h còn chưa ghép nên lượt 11h là OUT dù lượt liền trước là OUT
+        verify_faces.side_effect = lambda emp, images: [(True, "")] * len(images)
+        day = timezone.localdate() - timedelta(days=1)
+        for t, hh in (("IN", 8), ("IN", 9), ("OUT", 10)):
+            make_punch(self.emp, t, local_dt(day, hh), work_location=self.loc)
+        item = {"latitude": 10.0, "longitude": 106.0, "image": b"img"}
+        results = clock_batch(self.emp, [
+            dict(item, client_id="b", timestamp=local_dt(day, 12)),
+            dict(item, client_id="a", timestamp=local_dt(day, 11)),
+        ])
+        self.assertEqual([r["type"] for r in results], ["IN", "OUT"])
+        sheet = DailyTimesheet.objects.get(employee=self.emp, date=day)
+        self.assertEqual((sheet.pair_count, sheet.total_hours), (2, 4.0))
+        self.assertEqual(sheet.open_ins, [local_dt(day, 12).astimezone(timezone.utc).isoformat()])
+
+
+class ClockMetricsTests(TestCase):
+    """Số lần thử lại được ghi ở mọi đường xác thực và không mất lần thất bại xen giữa."""
+
+    def setUp(self):
+        self.emp = make_employee("metrics")
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.emp.allowed_locations.add(self.loc)
+        reset_caches()
+
+    def test_failure_between_get_and_clear_is_kept(self):
+        clock_metrics.record_failure(self.emp.pk)
+        get = cache.get
+
+        def get_then_fail(key, default=None):
+            value = get(key, default)
+            clock_metrics.record_failure(self.emp.pk)  # request khác bị từ chối ngay lúc này
+            return value
+
+        with mock.patch.object(cache, "get", get_then_fail):
+            self.assertEqual(clock_metrics.record_success(self.emp.pk), 1)
+        self.assertEqual(clock_metrics.record_success(self.emp.pk), 1)
+        data = clock_metrics.snapshot()
+        self.assertEqual((data["failures"], data["successes"], data["retries"]), (2, 2, 2))
+
+    @mock.patch("attendance.verification.verify_faces")
+    def test_batch_records_in_time_order(self, verify_faces):
+        verify_faces.side_effect = lambda emp, images: [(True, ""), (False, "không khớp"), (None, "quá tải")]
+        now = timezone.now()
+        item = {"latitude": 10.0, "longitude": 106.0, "image": b"img"}
+        clock_batch(self.emp, [
+            dict(item, client_id="ok", timestamp=now),
+            dict(item, client_id="bad", timestamp=now - timedelta(minutes=2)),
+            dict(item, client_id="busy", timestamp=now - timedelta(minutes=1)),
+        ])
+        data = clock_metrics.snapshot()
+        self.assertEqual((data["failures"], data["successes"], data["retries"], data["hist:1"]), (1, 1, 1, 1))
+
+
+class LocationIndexTests(TestCase):
+    """Lưới ô của LocationIndex cho cùng kết quả với quét toàn bộ."""
+
+    def _locations(self, *coords, radius_m=100):
+        return [WorkLocation(name=str(i), latitude=lat, longitude=lon, radius_m=radius_m)
+                for i, (lat, lon) in enumerate(coords)]
+
+    def test_nearest_outside_neighbour_cells(self):
+        # Ô rộng ~100 m: B ở ô lân cận (~267 m), A gần hơn (~222 m) nhưng ở ngoài các ô lân cận
+        locations = self._locations((0.0017, 0.0017), (0.0020, 0.0))
+        index = LocationIndex(locations, grid_threshold=0)
+        loc, distance, within = index.resolve(0.0, 0.0)
+        self.assertEqual(loc.name, "1")
+        self.assertFalse(within)
+        self.assertAlmostEqual(distance, LocationIndex(locations).resolve(0.0, 0.0)[1])
+
+    def test_grid_matches_full_scan(self):
+        import random
+        rng = random.Random(7)
+        locations = self._locations(*[(10 + rng.uniform(0, 0.05), 106 + rng.uniform(0, 0.05)) for _ in range(300)])
+        grid, full = LocationIndex(locations, grid_threshold=0), LocationIndex(locations)
+        for _ in range(200):
+            lat, lon = 10 + rng.uniform(-0.01, 0.06), 106 + rng.uniform(-0.01, 0.06)
+            self.assertEqual(grid.resolve(lat, lon), full.resolve(lat, lon))
+
+
+class LocationIndexCacheTests(TestCase):
+    """resolve_location dùng LocationIndex dựng sẵn theo phiên bản dữ liệu tham chiếu."""
+
+    def setUp(self):
+        self.emp = make_employee("geo")
+        self.near = WorkLocation.objects.create(name="A", latitude=10.0, longitude=106.0, radius_m=100)
+        self.far = WorkLocation.objects.create(name="B", latitude=10.1, longitude=106.1, radius_m=100)
+        self.emp.allowed_locations.add(self.near, self.far)
+        reset_caches()
+
+    def test_index_is_reused_until_refdata_changes(self):
+        locations = refdata.employee_locations(self.emp)
+        index = refdata.location_index(locations)
+        self.assertIs(refdata.location_index(refdata.employee_locations(self.emp)), index)
+        self.assertEqual(resolve_location(self.emp, lat=10.1, lon=106.1), self.far)
+
+        self.far.latitude, self.far.longitude = 20.0, 105.0
+        run_on_commit()  # các bump còn chờ từ setUp
+        version = refdata.version()
+        self.far.save()
+        # Phiên bản chỉ tăng sau commit, để worker khác không nạp lại dữ liệu chưa commit
+        self.assertEqual(refdata.version(), version)
+        run_on_commit()
+        self.assertEqual(refdata.version(), version + 1)
+        self.assertIsNot(refdata.location_index(refdata.employee_locations(self.emp)), index)
+        self.assertEqual(resolve_location(self.emp, lat=10.1, lon=106.1).pk, self.near.pk)
+
+
+class HistoryQueryTests(TestCase):
+    """api_history: 4 truy vấn cho cả kỳ, 2 truy vấn khi trả 304 theo ETag."""
+
+    day = date(2024, 3, 4)
+
+    def setUp(self):
+        self.shift = Shift.objects.create(name="Hành chính", start_time=time(8), end_time=time(17))
+        self.emp = make_employee("history", shift=self.shift)
+        reset_caches()
+        refdata.get("shifts", self.shift.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.emp.user)
+
+    def _punch_days(self, days):
+        for i in days:
+            d = self.day + timedelta(days=i)
+            make_punch(self.emp, "IN", local_dt(d, 8))
+            make_punch(self.emp, "OUT", local_dt(d, 17))
+            if i % 2:  # ngày chẵn không có DailyTimesheet: view tự tính, không thêm truy vấn
+                refresh_day(self.emp, d)
+
+    def _get(self, **headers):
+        return self.client.get(reverse("api_history"), {"period": "month", "date": "2024-03-04"}, **headers)
+
+    def test_query_count_is_constant(self):
+        self._punch_days(range(2))
+        with self.assertNumQueries(4):
+            self.assertEqual(self._get().status_code, 200)
+        self._punch_days(range(2, 20))
+        with self.assertNumQueries(4):
+            resp = self._get()
+        self.assertEqual(len(resp.data["days"]), 20)
+
+    def test_not_modified(self):
+        self._punch_days(range(3))
+        etag = self._get()["ETag"]
+        with self.assertNumQueries(2):  # nhân viên + dấu vân tay của kỳ
+            resp = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        make_punch(self.emp, "IN", local_dt(self.day, 18))
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_archived_month(self):
+        self._punch_days(range(2))
+        expected = self._get().data
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with override_settings(ATTENDANCE_ARCHIVE_DIR=tmp):
+            if connection.vendor == "postgresql":
+                connection.cursor().execute("SET CONSTRAINTS ALL IMMEDIATE")
+            archive.archive_month(2024, 3)
+            run_on_commit()
+            reset_caches()
+            refdata.get("shifts", self.shift.pk)
+            self.assertFalse(Attendance.objects.filter(employee=self.emp).exists())
+            with self.assertNumQueries(4):
+                resp = self._get()
+        self.assertEqual(resp.data, expected)
+
+    def test_etag_changes_on_shift_move_and_admin_edit(self):
+        from django.contrib.admin.sites import site
+        from django.test import RequestFactory
+        self._punch_days(range(2))
+        etag = self._get()["ETag"]
+        # Đổi ca: cờ đi trễ/về sớm của kỳ đổi dù không bản chấm công nào đổi
+        self.emp.shift = Shift.objects.create(name="Ca sáng", start_time=time(6), end_time=time(14))
+        self.emp.save()
+        resp = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp["ETag"]
+        # Sửa giờ qua admin: số bản ghi giữ nguyên
+        att = Attendance.objects.filter(employee=self.emp).order_by("id").first()
+        att.timestamp = local_dt(self.day, 9)
+        request = RequestFactory().post("/")
+        request.user = User.objects.create_superuser("history_admin", password="pw12345")
+        site._registry[Attendance].save_model(request, att, None, True)
+        self.assertIsNotNone(att.changed_at)
+        self.assertEqual(self._get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ImporterTests(TestCase):
+    """Nhập nhân viên: mỗi user một hash, và cả file nằm trong một transaction."""
+
+    def _valid(self, *usernames):
+        return [dict(username=u, first_name="", last_name="", email="", phone="", password="",
+                     location_ids=[], role_id=None) for u in usernames]
+
+    def test_default_password_is_salted_per_user(self):
+        importer.create_employees(self._valid("imp_a", "imp_b"), workers=1)
+        a, b = (User.objects.get(username=u) for u in ("imp_a", "imp_b"))
+        self.assertNotEqual(a.password, b.password)
+        self.assertTrue(a.check_password(importer.DEFAULT_PASSWORD))
+        self.assertTrue(b.check_password(importer.DEFAULT_PASSWORD))
+
+    def test_failure_creates_nothing(self):
+        User.objects.create_user(username="imp_taken")  # tạo ở nơi khác sau khi file đã được kiểm tra
+        with self.assertRaises(IntegrityError):
+            importer.create_employees(self._valid("imp_1", "imp_2", "imp_taken"), chunk_size=1, workers=1)
+        self.assertFalse(User.objects.filter(username__in=["imp_1", "imp_2"]).exists())
+        self.assertFalse(Employee.objects.exists())
+
+
+class BulkEnrollmentEngineTests(TestCase):
+    """Đăng ký hàng loạt dùng face engine riêng, không chiếm hàng đợi của chấm công."""
+
+    def test_uses_its_own_engine(self):
+        make_employee("nv001")
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "faces.zip")
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("nv001.jpg", b"img")
+        self.addCleanup(shutil.rmtree, tmp)
+
+        with mock.patch("attendance.enrollment.FaceEngine") as engine_cls, \
+                mock.patch.object(face_engine, "get_engine") as shared:
+            engine = engine_cls.return_value
+            engine.max_pending = 8
+            engine.represent_many.return_value = [[]]
+            state = enrollment.enroll_archive(path)
+        engine_cls.assert_called_once_with(workers=1, max_pending=8, timeout=120)
+        engine.shutdown.assert_called_once_with()
+        shared.assert_not_called()
+        self.assertIn("nv001", state.data["failures"])
+
+
+class ArchiveMonthTests(TestCase):
+    """archive_month chỉ xoá các dòng đã ghi vào file, trong cùng transaction với ArchivedMonth."""
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        settings_override = override_settings(ATTENDANCE_ARCHIVE_DIR=tmp)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.emp = make_employee("archived")
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.day = date(2024, 1, 10)
+        self.punch(8)
+
+    def punch(self, hh):
+        return Attendance.objects.create(employee=self.emp, type="IN", timestamp=local_dt(self.day, hh),
+                                         latitude=10.0, longitude=106.0, work_location=self.loc)
+
+    def archived_ids(self):
+        return sorted(archive.read_month_file(os.path.join(archive.archive_dir(), archive.filename_for(2024, 1)))["id"])
+
+    def test_row_inserted_while_writing_is_kept(self):
+        write_month = archive.write_month
+
+        def write_then_insert(*args, **kwargs):
+            result = write_month(*args, **kwargs)
+            self.late = self.punch(9)
+            return result
+
+        with mock.patch.object(archive, "write_month", write_then_insert):
+            self.assertEqual(archive.archive_month(2024, 1), 1)
+        self.assertEqual(list(Attendance.objects.values_list("pk", flat=True)), [self.late.pk])
+        self.assertEqual(archive.archive_month(2024, 1), 1)
+        self.assertEqual(len(self.archived_ids()), 2)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_failed_transaction_does_not_duplicate(self):
+        with mock.patch.object(ArchivedMonth.objects, "update_or_create", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                archive.archive_month(2024, 1)
+        self.assertEqual(Attendance.objects.count(), 1)
+        self.assertEqual(archive.archive_month(2024, 1), 1)
+        self.assertEqual(len(self.archived_ids()), 1)
+        self.assertEqual(ArchivedMonth.objects.get().rows, 1)
+        self.assertFalse(Attendance.objects.exists())
+
+
+class AttendanceVersionsTests(TestCase):
+    """Lịch sử sửa của lượt chấm công không có log "created" (app, kiosk, lô offline)."""
+
+    def setUp(self):
+        self.emp = make_employee("owner")
+        self.other = make_employee("other")
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.emp.allowed_locations.add(self.loc)
+        reset_caches()
+        self.att, _, _ = clock(self.emp, 10.0, 106.0, self.loc, t="IN", user=self.emp.user)
+        # Nhân sự chỉ sửa ghi chú
+        before = audit.snapshot(self.att)
+        self.att.note = "quên mang thẻ"
+        self.att.save()
+        audit.log_change(self.att, "edited", before, reason="bổ sung")
+
+    def get(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(reverse("api_attendance_versions", args=[self.att.pk]), params)
+
+    def test_first_version_has_every_field(self):
+        history = audit.versions(self.att.pk)
+        self.assertEqual([v["action"] for v in history], ["created", "edited"])
+        self.assertIsNone(history[0]["log_id"])
+        self.assertEqual(history[0]["data"]["note"], "")
+        self.assertEqual(history[-1]["data"], audit.snapshot(self.att))
+
+    def test_owner_sees_own_punch(self):
+        resp = self.get(self.emp.user)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["versions"][-1]["data"]["employee_id"], self.emp.pk)
+        self.assertEqual(self.get(self.emp.user, version=1).data["data"]["type"], "IN")
+        self.assertEqual(self.get(self.other.user).status_code, 403)
+
+    def test_archived_punch(self):
+        current = audit.snapshot(self.att)
+        ts = timezone.localtime(self.att.timestamp)
+        with mock.patch.object(archive, "archive_dir", return_value=tempfile.mkdtemp()) as archive_dir:
+            self.addCleanup(shutil.rmtree, archive_dir.return_value)
+            if connection.vendor == "postgresql":
+                # Kiểm tra khoá ngoại hoãn của các dòng vừa tạo trong TestCase trước khi bỏ phân vùng
+                connection.cursor().execute("SET CONSTRAINTS ALL IMMEDIATE")
+            archive.archive_month(ts.year, ts.month)
+            run_on_commit()
+            reset_caches()
+            self.assertFalse(Attendance.objects.filter(pk=self.att.pk).exists())
+            history = audit.versions(self.att.pk)
+            self.assertEqual(audit.employee_id(self.att.pk), self.emp.pk)
+            self.assertEqual(self.get(self.other.user).status_code, 403)
+            # id ngoài khoảng id của mọi tháng đã lưu trữ: không mở file nào
+            with mock.patch.object(archive, "load_month") as load_month:
+                self.assertIsNone(archive.find_record(self.att.pk + 1000))
+            load_month.assert_not_called()
+        self.assertEqual(history[-1]["data"], current)
+        self.assertEqual(history[0]["data"]["employee_id"], self.emp.pk)
+
+    def test_permission_checked_before_history(self):
+        with mock.patch.object(audit, "versions") as versions:
+            self.assertEqual(self.get(self.other.user).status_code, 403)
+        versions.assert_not_called()
+
+
+class MonitorFeedTests(TestCase):
+    """Màn hình giám sát: phân trang keyset, long-poll theo con trỏ có id trống, kiểm tra tham số."""
+
+    def setUp(self):
+        self.emp = make_employee("monitor")
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.other_loc = WorkLocation.objects.create(name="Kho", latitude=10.0, longitude=106.0)
+        self.client.force_login(User.objects.create_superuser("monitor_admin", password="pw12345"))
+        reset_caches()
+
+    def punch(self, ts, **kwargs):
+        kwargs.setdefault("work_location", self.loc)
+        return make_punch(self.emp, "IN", ts, **kwargs)
+
+    def feed(self, **params):
+        return self.client.get(reverse("web_monitor_feed"), params)
+
+    def test_keyset_paging_across_equal_timestamps(self):
+        ts = timezone.now().replace(microsecond=0)
+        ids = [self.punch(ts).pk for _ in range(5)] + [self.punch(ts - timedelta(minutes=1)).pk]
+        seen, cursor = [], None
+        while True:
+            items, cursor = monitor.page(monitor.filtered({}), cursor, limit=2)
+            seen += [item["id"] for item in items]
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(ids[:5], reverse=True) + ids[5:])
+
+    def test_invalid_parameters(self):
+        self.punch(timezone.now())
+        for params in ({"before": "không-phải-con-trỏ"}, {"after": "abc"}, {"after": "5.7"}, {"after": "-1"},
+                       {"work_location_id": "abc"}, {"department_id": "1 OR 1=1", "after": "0"},
+                       {"after": "0", "wait": "x"}):
+            self.assertEqual(self.feed(**params).status_code, 400, params)
+        self.assertEqual(self.client.get(reverse("web_monitor"), {"department_id": "abc"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("web_monitor"), {"work_location_id": str(self.loc.pk)}).status_code, 200)
+
+    @override_settings(MONITOR_LONGPOLL_TIMEOUT=0.2, MONITOR_POLL_INTERVAL=0.05)
+    def test_wait_times_out(self):
+        self.punch(timezone.now())
+        cursor = monitor.start_cursor()
+        started = time_module.monotonic()
+        resp = self.feed(after=cursor, wait=30)
+        self.assertLess(time_module.monotonic() - started, 1.0)
+        self.assertEqual(resp.json(), {"results": [], "latest": cursor, "more": False})
+
+    def test_late_commit_below_cursor(self):
+        first = self.punch(timezone.now())
+        cursor = monitor.start_cursor()
+        # id first+2 commit trước, id first+1 (transaction dài như clock_batch) commit sau
+        self.punch(timezone.now(), id=first.pk + 2)
+        data = self.feed(after=cursor).json()
+        self.assertEqual([r["id"] for r in data["results"]], [first.pk + 2])
+        self.assertEqual(monitor.decode_after(data["latest"]), (first.pk + 2, {first.pk + 1}))
+        self.punch(timezone.now(), id=first.pk + 1)
+        data = self.feed(after=data["latest"]).json()
+        self.assertEqual([r["id"] for r in data["results"]], [first.pk + 1])
+        self.assertEqual(monitor.decode_after(data["latest"]), (first.pk + 2, set()))
+        self.assertEqual(self.feed(after=data["latest"]).json()["results"], [])
+
+    def test_filter_skips_rows_without_leaving_gaps(self):
+        self.punch(timezone.now())
+        cursor = monitor.start_cursor()
+        hidden = self.punch(timezone.now(), work_location=self.other_loc)
+        shown = self.punch(timezone.now())
+        data = self.feed(after=cursor, work_location_id=self.loc.pk).json()
+        self.assertEqual([r["id"] for r in data["results"]], [shown.pk])
+        self.assertEqual(monitor.decode_after(data["latest"]), (max(hidden.pk, shown.pk), set()))
+
+
+class FaceIndexTests(TestCase):
+    """Chỉ mục 1:N: tìm kiếm, cập nhật từng dòng và đồng bộ giữa các tiến trình qua phiên bản."""
+
+    def setUp(self):
+        import numpy as np
+        self.rng = np.random.default_rng(0)
+        self.vectors = {}
+        for i in range(3):
+            emp = make_employee(f"face{i}", face_embedding=self.vector())
+            self.vectors[emp.pk] = emp.face_embedding
+        reset_caches()
+
+    def vector(self, dim=8):
+        return pack_embedding(self.rng.standard_normal(dim))
+
+    def query(self, blob):
+        import numpy as np
+        return np.frombuffer(blob, dtype=np.float32) + 0.01
+
+    def test_search(self):
+        index = FaceIndex()
+        for pk, blob in self.vectors.items():
+            found, distance = index.search(self.query(blob))
+            self.assertEqual(found, pk)
+            self.assertLess(distance, 0.01)
+        Employee.objects.update(is_active=False)
+        self.assertEqual(FaceIndex().search([1.0] * 8), (None, None))
+
+    def test_shortlist_search_matches_exact(self):
+        import numpy as np
+        vectors = self.rng.standard_normal((600, 512)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = FaceIndex()
+        index._version = 0
+        index.build(np.arange(1, 601), vectors)
+        with mock.patch("attendance.face_index.EXACT_MAX_SIZE", 0):
+            for i in (0, 299, 599):
+                self.assertEqual(index.search(vectors[i] + 0.01)[0], i + 1)
+
+    def test_upsert_and_remove(self):
+        index = FaceIndex()
+        index.search(self.query(self.vector()))  # nạp
+        new = make_employee("face_new")
+        blob = self.vector()
+        index.upsert(new.pk, blob)
+        self.assertEqual(index.search(self.query(blob))[0], new.pk)
+        version = cache.get(FACE_INDEX_VERSION)
+        index.upsert(new.pk, blob)  # không đổi: không tăng phiên bản
+        self.assertEqual(cache.get(FACE_INDEX_VERSION), version)
+
+        first = next(iter(self.vectors))
+        index.remove(first)
+        self.assertEqual(len(index), 3)
+        self.assertNotEqual(index.search(self.query(self.vectors[first]))[0], first)
+        version = cache.get(FACE_INDEX_VERSION)
+        index.remove(first)
+        self.assertEqual(cache.get(FACE_INDEX_VERSION), version)
+
+    def test_unloaded_process_only_bumps(self):
+        writer, reader = FaceIndex(), FaceIndex()
+        first = next(iter(self.vectors))
+        self.assertEqual(reader.search(self.query(self.vectors[first]))[0], first)
+        Employee.objects.filter(pk=first).update(is_active=False)
+        writer.remove(first)
+        self.assertIsNone(writer._matrix)
+        self.assertNotEqual(reader.search(self.query(self.vectors[first]))[0], first)
+        self.assertEqual(len(reader), 2)
+
+    def test_concurrent_bump_is_not_missed(self):
+        a, b = FaceIndex(), FaceIndex()
+        a.search([1.0] * 8)
+        b.search([1.0] * 8)
+        blob_b = self.vector()
+        emp_b = make_employee("face_b", face_embedding=blob_b)
+        ensure_fresh = a._ensure_fresh
+
+        def then_other_process_writes():
+            ensure_fresh()
+            b.upsert(emp_b.pk, blob_b)  # tiến trình khác ghi giữa lúc a kiểm tra và tăng phiên bản
+
+        blob_a = self.vector()
+        emp_a = make_employee("face_a", face_embedding=blob_a)
+        with mock.patch.object(a, "_ensure_fresh", then_other_process_writes):
+            a.upsert(emp_a.pk, blob_a)
+        self.assertEqual(a.search(self.query(blob_b))[0], emp_b.pk)
+        self.assertEqual(a.search(self.query(blob_a))[0], emp_a.pk)
+
+
+class ProductionSettingsTests(SimpleTestCase):
+    """server.settings_production nạp được, qua check --deploy và từ chối cache không nguyên tử."""
+
+    def _check(self, *args, **extra):
+        env = {k: v for k, v in os.environ.items() if k != "DJANGO_CACHE"}
+        env.update(DJANGO_SECRET_KEY="k" * 20 + "-production-settings-smoke-test-0123456789",
+                   DB_ENGINE="sqlite", SQLITE_PATH=os.path.join(tempfile.gettempdir(), "settings_smoke.sqlite3"),
+                   **extra)
+        return subprocess.run(
+            [sys.executable, "manage.py", "check", "--settings=server.settings_production", *args],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=60,
+        )
+
+    def test_check_deploy(self):
+        result = self._check("--deploy")  # cache mặc định của production
+        self.assertEqual(result.returncode, 0, result.stdout)
+        # Chỉ còn các tuỳ chọn HSTS cho subdomain/preload, phải bật có chủ đích theo từng tên miền
+        warnings = {line.split()[1] for line in result.stdout.splitlines() if line.startswith("?: (")}
+        self.assertLessEqual(warnings, {"(security.W005)", "(security.W021)"}, result.stdout)
+
+    def test_rejects_non_atomic_cache(self):
+        for backend in ("file", "locmem"):
+            result = self._check(DJANGO_CACHE=backend)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("ImproperlyConfigured", result.stdout)
+
+
+@mock.patch("attendance.face_engine.available", return_value=True)
+class AsyncAPIHandlerTests(TransactionTestCase):
+    """
+    AsyncAPIHandler trả đúng như view WSGI cho api_clock, api_history, api_employee_me.
+    TransactionTestCase: view async chạy ORM trong thread pool, với kết nối DB riêng.
+    """
+
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        from .async_api import AsyncAPIHandler
+        self.handler = AsyncAPIHandler()
+        self.emp = make_employee("async", phone="0900")
+        self.emp.face_embedding = pack_embedding([1.0, 0.0])
+        self.emp.save()
+        self.loc = WorkLocation.objects.create(name="HQ", latitude=10.0, longitude=106.0)
+        self.emp.allowed_locations.add(self.loc)
+        self.token = f"Bearer {RefreshToken.for_user(self.emp.user).access_token}"
+        reset_caches()
+
+    def asgi(self, method, path, query="", body=b"", content_type=None, token=None, **headers):
+        """(status, headers, body) của AsyncAPIHandler cho một request HTTP."""
+        from asgiref.sync import async_to_sync
+        from asgiref.testing import ApplicationCommunicator
+        raw = [(b"host", b"testserver"), (b"content-length", str(len(body)).encode())]
+        if token:
+            raw.append((b"authorization", token.encode()))
+        if content_type:
+            raw.append((b"content-type", content_type.encode()))
+        raw += [(k.lower().replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "root_path": "", "query_string": query.encode(), "headers": raw,
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+
+        async def run():
+            app = ApplicationCommunicator(self.handler, scope)
+            await app.send_input({"type": "http.request", "body": body})
+            start = await app.receive_output(10)
+            content = b""
+            while True:
+                message = await app.receive_output(10)
+                content += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            return start["status"], {k.decode().lower(): v.decode() for k, v in start["headers"]}, content
+
+        return async_to_sync(run)()
+
+    def wsgi(self, method, path, query="", body=b"", content_type=None, token=None, **headers):
+        extra = {f"HTTP_{k.upper()}": v for k, v in headers.items()}
+        if token:
+            extra["HTTP_AUTHORIZATION"] = token
+        resp = self.client.generic(method, f"{path}?{query}" if query else path, body,
+                                   content_type=content_type or "application/octet-stream", **extra)
+        return resp.status_code, {k.lower(): v for k, v in resp.items()}, resp.content
+
+    def assertSameResponse(self, method, path, **kwargs):
+        ours, theirs = self.asgi(method, path, **kwargs), self.wsgi(method, path, **kwargs)
+        self.assertEqual(ours[0], theirs[0], (ours, theirs))
+        if theirs[2]:
+            self.assertEqual(json.loads(ours[2]), json.loads(theirs[2]))
+        else:
+            self.assertEqual(ours[2], theirs[2])
+        for header in ("etag", "www-authenticate"):
+            self.assertEqual(ours[1].get(header), theirs[1].get(header), header)
+        # DRF dựng Allow từ một set: thứ tự thay đổi giữa các tiến trình
+        self.assertEqual(set(ours[1]["allow"].split(", ")), set(theirs[1]["allow"].split(", ")))
+        return ours
+
+    def test_employee_me(self, available):
+        self.assertSameResponse("GET", reverse("api_employee_me"), token=self.token)
+        body = json.dumps({"phone": "0911"}).encode()
+        status, _, content = self.asgi("PATCH", reverse("api_employee_me"), body=body,
+                                       content_type="application/json", token=self.token)
+        self.assertEqual((status, json.loads(content)["phone"]), (200, "0911"))
+        self.assertSameResponse("PATCH", reverse("api_employee_me"), body=body,
+                                content_type="application/json", token=self.token)
+
+    def test_history_and_etag(self, available):
+        day = timezone.localdate()
+        make_punch(self.emp, "IN", local_dt(day, 8), work_location=self.loc)
+        make_punch(self.emp, "OUT", local_dt(day, 17), work_location=self.loc)
+        refresh_day(self.emp, day)
+        query = f"period=month&date={day:%Y-%m-%d}"
+        _, headers, _ = self.assertSameResponse("GET", reverse("api_history"), query=query, token=self.token)
+        self.assertSameResponse("GET", reverse("api_history"), query=query, token=self.token,
+                                if_none_match=headers["etag"])
+        self.assertEqual(self.asgi("GET", reverse("api_history"), query=query, token=self.token,
+                                   if_none_match=headers["etag"])[0], 304)
+
+    @mock.patch("attendance.views.verify_face", return_value=(True, ""))
+    @mock.patch("attendance.verification.verify_face_async", return_value=(True, ""))
+    def test_clock(self, verify_face_async, verify_face, available):
+        from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        body = encode_multipart(BOUNDARY, {"latitude": "10.0", "longitude": "106.0",
+                                           "face_image": SimpleUploadedFile("f.jpg", b"img")})
+        kwargs = dict(body=body, content_type=MULTIPART_CONTENT, token=self.token)
+        ours = self.asgi("POST", reverse("api_clock"), **kwargs)
+        verify_face_async.assert_called_once()
+
+        Attendance.objects.all().delete()
+        DailyTimesheet.objects.all().delete()
+        theirs = self.wsgi("POST", reverse("api_clock"), **kwargs)
+        self.assertEqual((ours[0], theirs[0]), (200, 200))
+        ours, theirs = json.loads(ours[2]), json.loads(theirs[2])
+        self.assertEqual((ours.pop("type"), theirs.pop("type")), ("IN", "IN"))
+        ours.pop("timestamp"), theirs.pop("timestamp")
+        self.assertEqual(ours, theirs)
+
+    def test_authentication(self, available):
+        for method, name in (("POST", "api_clock"), ("GET", "api_history"), ("GET", "api_employee_me"),
+                             ("GET", "api_clock")):
+            for token in (None, "Bearer khong.hop.le"):
+                status, _, _ = self.assertSameResponse(method, reverse(name), token=token)
+                self.assertEqual(status, 401)
+
+    def test_method_not_allowed_and_not_found(self, available):
+        status, _, _ = self.assertSameResponse("GET", reverse("api_clock"), token=self.token)
+        self.assertEqual(status, 405)
+        status, _, _ = self.assertSameResponse("DELETE", reverse("api_employee_me"), token=self.token)
+        self.assertEqual(status, 405)
+        # Nhân viên bị khoá: get_object_or_404 trong view dùng chung
+        Employee.objects.filter(pk=self.emp.pk).update(is_active=False)
+        status, _, _ = self.assertSameResponse("POST", reverse("api_clock"), token=self.token)
+        self.assertEqual(status, 404)
+
+    def test_other_paths_go_through_django_in_thread_pool(self, available):
+        from . import async_api
+        db = async_api._db
+        calls = []
+
+        async def recording_db(fn, *args, **kwargs):
+            calls.append(getattr(fn, "__name__", fn))
+            return await db(fn, *args, **kwargs)
+
+        with mock.patch.object(async_api, "_db", recording_db):
+            self.assertEqual(self.asgi("GET", "/api/khong-co/")[0], self.wsgi("GET", "/api/khong-co/")[0])
+            self.assertEqual(calls, ["get_response"])
+            self.assertEqual(self.asgi("GET", reverse("web_login"))[0], 200)
+            self.assertEqual(calls, ["get_response"] * 2)
+            self.asgi("GET", reverse("api_employee_me"), token=self.token)
+        self.assertNotIn("get_response", calls[2:])
@@ -0,0 +1,429 @@
+"""
+Tính công: ghép cặp IN/OUT, bảng tổng hợp DailyTimesheet và bảng công theo tháng.
+
+Bản chấm công thô chỉ được đọc khi cập nhật DailyTimesheet (một ngày của một nhân
+viên sau mỗi lần ghi, hoặc cả khoảng khi backfill bằng `rebuild_timesheets`).
+Các báo cáo đọc DailyTimesheet, nên chi phí tăng theo số ngày chứ không theo số
+lượt chấm công.
+
+Ngoài các đường ghi trong views/clocking, connect_signals() giữ bảng tổng hợp đúng
+khi bản chấm công bị xoá (admin, shell...) và khi ca làm việc của nhân viên hoặc
+giờ của một ca thay đổi (chỉ ảnh hưởng cờ đi trễ/về sớm). Việc tính lại cờ chạy
+trong request nên chỉ chạm các tháng còn mở (TIMESHEET_FLAG_REFRESH_MONTHS);
+các tháng cũ hơn giữ cờ theo ca lúc đó, muốn tính lại dùng
+`rebuild_timesheets --flags-only`.
+"""
+import bisect
+import csv
+import heapq
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import archive, dashboard_cache
+from .models import Attendance, DailyTimesheet, Employee, Shift
+from .refdata import refdata
+from .utils import local_day_range
+
+
+def pair_punches(ins, outs):
+    """
+    Ghép cặp hai danh sách thời điểm IN và OUT đã sắp tăng dần, trả về (số giờ, số cặp).
+    Mỗi IN ghép với OUT kế tiếp sau nó; OUT không có IN đứng trước bị bỏ qua.
+    """
+    hours = 0.0
+    pairs = 0
+    i = j = 0
+    while i < len(ins) and j < len(outs):
+        if ins[i] <= outs[j]:
+            hours += max(0.0, (outs[j] - ins[i]).total_seconds() / 3600.0)
+            pairs += 1
+            i += 1; j += 1
+        else:
+            j += 1
+    return hours, pairs
+
+
+def pair_hours(ins, outs):
+    return pair_punches(ins, outs)[0]
+
+
+def shift_flags(day, first_in, last_out, shift):
+    """(đi trễ, về sớm) so với ca làm việc, có tính thời gian cho phép."""
+    late = early_leave = False
+    if shift:
+        st = timezone.make_aware(datetime.combine(day, shift.start_time))
+        en = timezone.make_aware(datetime.combine(day, shift.end_time))
+        if first_in and first_in > st + timedelta(minutes=shift.late_grace_min):
+            late = True
+        if last_out and last_out < en - timedelta(minutes=shift.early_grace_min):
+            early_leave = True
+    return late, early_leave
+
+
+def _iso(ts):
+    return ts.astimezone(timezone.utc).isoformat()
+
+
+def summarize_day(day, ins, outs, shift):
+    """Các trường của DailyTimesheet cho một ngày, tính từ các lượt IN/OUT của ngày đó."""
+    hours, pairs = pair_punches(ins, outs)
+    first_in = ins[0] if ins else None
+    last_out = outs[-1] if outs else None
+    late, early_leave = shift_flags(day, first_in, last_out, shift)
+    return {
+        "total_hours": hours, "pair_count": pairs, "first_in": first_in, "last_out": last_out,
+        # Các IN chưa được ghép là ins[pairs:] (con trỏ i chỉ tăng khi ghép được cặp)
+        "open_in": ins[pairs] if pairs < len(ins) else None,
+        "open_ins": [_iso(ts) for ts in ins[pairs:]],
+        "late": late, "early_leave": early_leave,
+    }
+
+
+def next_type(ins, outs):
+    """Loại của lượt chấm công kế tiếp khi client không gửi: OUT nếu còn IN chưa ghép cặp."""
+    return "OUT" if pair_punches(ins, outs)[1] < len(ins) else "IN"
+
+
+def apply_punch(day, ins, outs, t, ts, shift):
+    """
+    Các trường DailyTimesheet của ngày `day` sau khi thêm lượt `t` lúc `ts` vào các lượt
+    IN/OUT đã có (`ins`, `outs` sắp tăng dần, được cập nhật tại chỗ). Tính bằng
+    summarize_day nên luôn khớp với refresh_day/rebuild_range.
+    """
+    bisect.insort(ins if t == "IN" else outs, ts)
+    return summarize_day(day, ins, outs, shift)
+
+
+def latest_punch(sheet):
+    """Thời điểm của lượt chấm công muộn nhất đã tính vào `sheet` (dict các trường DailyTimesheet)."""
+    times = [parse_datetime(sheet["open_ins"][-1])] if sheet["open_ins"] else []
+    if sheet["last_out"] is not None:
+        times.append(sheet["last_out"])
+    return max(times, default=None)
+
+
+def append_punch(day, sheet, t, ts, shift):
+    """
+    Như apply_punch, nhưng chỉ cần dòng DailyTimesheet hiện tại của ngày (`sheet`: dict
+    các trường, None nếu chưa có) thay vì mọi lượt chấm công: các IN chưa ghép nằm trong
+    open_ins. Chỉ đúng khi `ts` không sớm hơn latest_punch(sheet); khi đó OUT mới ghép
+    với IN chưa ghép đầu tiên, đúng như pair_punches, nên kết quả giống summarize_day.
+    Trả về (loại của lượt, các trường); `t` None thì xác định như next_type.
+    """
+    sheet = sheet or {"total_hours": 0.0, "pair_count": 0, "first_in": None, "last_out": None, "open_ins": []}
+    hours, pairs, first_in, last_out = sheet["total_hours"], sheet["pair_count"], sheet["first_in"], sheet["last_out"]
+    open_ins = list(sheet["open_ins"])
+    if t not in ("IN", "OUT"):
+        t = "OUT" if open_ins else "IN"
+    if t == "IN":
+        open_ins.append(_iso(ts))
+        first_in = first_in or ts
+    else:
+        last_out = ts
+        if open_ins:
+            hours += max(0.0, (ts - parse_datetime(open_ins.pop(0))).total_seconds() / 3600.0)
+            pairs += 1
+    late, early_leave = shift_flags(day, first_in, last_out, shift)
+    return t, {
+        "total_hours": hours, "pair_count": pairs, "first_in": first_in, "last_out": last_out,
+        "open_in": parse_datetime(open_ins[0]) if open_ins else None, "open_ins": open_ins,
+        "late": late, "early_leave": early_leave,
+    }
+
+
+def day_punches(employee_id, day):
+    """([IN...], [OUT...]) không bị từ chối của nhân viên trong ngày `day`, sắp tăng dần."""
+    lo, hi = local_day_range(day, day)
+    ins, outs = [], []
+    rows = (Attendance.objects.filter(employee_id=employee_id, timestamp__gte=lo, timestamp__lt=hi)
+            .exclude(verification="rejected")
+            .order_by("timestamp").values_list("timestamp", "type"))
+    if archive.archived_overlap(lo, hi):
+        # Ngày thuộc tháng đã lưu trữ: ghép với các lượt trong file lưu trữ
+        rows = sorted(list(rows) + [(ts, t) for _, ts, t in archive.iter_punches(lo, hi, [employee_id])])
+    for ts, t in rows:
+        (ins if t == "IN" else outs).append(ts)
+    return ins, outs
+
+
+def refresh_day(employee, day):
+    """
+    Tính lại DailyTimesheet của `employee` cho ngày `day` từ các bản chấm công thô.
+    Gọi sau mỗi lần tạo/sửa Attendance; chỉ đọc các lượt chấm công của đúng một ngày.
+    """
+    ins, outs = day_punches(employee.pk, day)
+    if not ins and not outs:
+        DailyTimesheet.objects.filter(employee_id=employee.pk, date=day).delete()
+        obj = None
+    else:
+        obj, _ = DailyTimesheet.objects.update_or_create(
+            employee_id=employee.pk, date=day, defaults=summarize_day(day, ins, outs, refdata.get("shifts", employee.shift_id)),
+        )
+    dashboard_cache.invalidate_dates(day)
+    return obj
+
+
+def refresh_for_attendance(att, previous=None):
+    """
+    Cập nhật DailyTimesheet sau khi ghi `att`. `previous` là (employee_id, timestamp)
+    trước khi sửa, để ngày cũ cũng được tính lại khi bản ghi bị chuyển ngày/nhân viên.
+    """
+    if att.employee_id:
+        refresh_day(att.employee, timezone.localtime(att.timestamp).date())
+    if previous and previous[0]:
+        old_day = timezone.localtime(previous[1]).date()
+        if (previous[0], old_day) != (att.employee_id, timezone.localtime(att.timestamp).date()):
+            refresh_day(Employee.objects.get(pk=previous[0]), old_day)
+
+
+def rebuild_range(start, end, employee_ids=None, batch_size=2000):
+    """Xoá và dựng lại DailyTimesheet cho khoảng ngày [start, end]. Trả về số dòng đã tạo."""
+    employees = Employee.objects.all()
+    punches = Attendance.objects.all()
+    existing = DailyTimesheet.objects.filter(date__gte=start, date__lte=end)
+    if employee_ids is not None:
+        employees = employees.filter(pk__in=employee_ids)
+        punches = punches.filter(employee_id__in=employee_ids)
+        existing = existing.filter(employee_id__in=employee_ids)
+    shifts = {pk: refdata.get("shifts", shift_id) for pk, shift_id in employees.values_list("pk", "shift_id")}
+
+    created = 0
+    with transaction.atomic():
+        existing.delete()
+        batch = []
+        for emp_id, day, ins, outs in iter_punch_days(start, end, punches, employee_ids):
+            batch.append(DailyTimesheet(employee_id=emp_id, date=day, **summarize_day(day, ins, outs, shifts.get(emp_id))))
+            if len(batch) >= batch_size:
+                DailyTimesheet.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        DailyTimesheet.objects.bulk_create(batch)
+        created += len(batch)
+    dashboard_cache.invalidate_all()
+    return created
+
+
+def dashboard_kpis(start, end):
+    """
+    Số liệu cho dashboard trong khoảng [start, end], đọc từ DailyTimesheet bằng
+    đúng 4 truy vấn tổng hợp, không phụ thuộc số nhân viên hay số ngày.
+    """
+    sheets = DailyTimesheet.objects.filter(date__gte=start, date__lte=end)
+    total_emp = Employee.objects.filter(is_active=True).count()
+    present = sheets.filter(first_in__isnull=False).values("employee_id").distinct().count()
+
+    # Đi trễ: xét ngày có IN đầu tiên trong kỳ của mỗi nhân viên đang hoạt động có ca
+    first_day = (sheets.filter(employee_id=OuterRef("employee_id"), first_in__isnull=False)
+                 .order_by("date").values("date")[:1])
+    late_count = (sheets.filter(first_in__isnull=False, employee__is_active=True, employee__shift__isnull=False)
+                  .annotate(first_day=Subquery(first_day))
+                  .filter(date=F("first_day"), late=True)
+                  .count())
+
+    daily_hours = [
+        (row["date"], row["hours"])
+        for row in sheets.values("date").annotate(hours=Sum("total_hours")).order_by("date")
+    ]
+    return {
+        "total_emp": total_emp,
+        "present": present,
+        "absent": max(0, total_emp - present),
+        "late_count": late_count,
+        "daily_hours": daily_hours,
+    }
+
+
+def month_days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def iter_punch_days(start, end, queryset=None, employee_ids=None):
+    """
+    Sinh (employee_id, ngày, [IN...], [OUT...]) cho mọi cặp nhân viên/ngày có chấm công,
+    theo thứ tự employee_id tăng dần. Chỉ chạy một truy vấn, đọc theo từng khối; các
+    tháng đã lưu trữ (archive.py) được ghép vào theo cùng thứ tự. `employee_ids` lọc
+    phần đọc từ file lưu trữ như `queryset` lọc phần trong bảng.
+    """
+    lo, hi = local_day_range(start, end)
+    qs = queryset if queryset is not None else Attendance.objects.all()
+    rows = (qs.filter(employee__isnull=False, timestamp__gte=lo, timestamp__lt=hi)
+            .exclude(verification="rejected")
+            .order_by("employee_id", "timestamp")
+            .values_list("employee_id", "timestamp", "type")
+            .iterator())
+    if archive.archived_overlap(lo, hi):
+        rows = heapq.merge(archive.iter_punches(lo, hi, employee_ids), rows, key=lambda r: (r[0], r[1]))
+
+    key = None
+    ins, outs = [], []
+    for emp_id, ts, t in rows:
+        d = timezone.localtime(ts).date()
+        if (emp_id, d) != key:
+            if key is not None:
+                yield key[0], key[1], ins, outs
+            key = (emp_id, d)
+            ins, outs = [], []
+        (ins if t == "IN" else outs).append(ts)
+    if key is not None:
+        yield key[0], key[1], ins, outs
+
+
+def iter_month_rows(employees, start, end):
+    """
+    Sinh (employee, [giờ theo ngày], tổng giờ) cho từng nhân viên trong `employees`.
+
+    `employees` phải được sắp theo id tăng dần; tổng cộng chỉ tốn thêm đúng một
+    truy vấn cho DailyTimesheet, bất kể số nhân viên hay số ngày.
+    """
+    days = month_days(start, end)
+    day_index = {d: i for i, d in enumerate(days)}
+    sheets = (DailyTimesheet.objects.filter(date__gte=start, date__lte=end)
+              .order_by("employee_id", "date")
+              .values_list("employee_id", "date", "total_hours")
+              .iterator())
+    current = next(sheets, None)
+
+    for emp in employees:
+        while current is not None and current[0] < emp.id:
+            current = next(sheets, None)
+        daily = [0.0] * len(days)
+        while current is not None and current[0] == emp.id:
+            _, d, hours = current
+            daily[day_index[d]] = hours
+            current = next(sheets, None)
+        yield emp, [round(h, 2) for h in daily], round(sum(daily), 2)
+
+
+def month_header(days):
+    return ["Username", "Họ tên"] + [x.strftime("%d/%m") for x in days] + ["Tổng giờ"]
+
+
+class _Echo:
+    """Buffer giả cho csv.writer: trả về luôn dòng vừa ghi thay vì lưu lại."""
+    def write(self, value):
+        return value
+
+
+def iter_month_csv(employees, start, end):
+    """Sinh từng dòng CSV của bảng công, dùng cho StreamingHttpResponse."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(month_header(month_days(start, end)))
+    for emp, daily, total in iter_month_rows(employees, start, end):
+        yield writer.writerow([emp.user.username, emp.user.get_full_name()] + daily + [total])
+
+
+def write_month_xlsx(fileobj, employees, start, end):
+    """
+    Ghi bảng công ra XLSX ở chế độ write-only của openpyxl: các dòng được đẩy
+    thẳng xuống file tạm nên bộ nhớ không tăng theo số nhân viên.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=f"{start:%Y-%m}")
+    ws.append(month_header(month_days(start, end)))
+    for emp, daily, total in iter_month_rows(employees, start, end):
+        ws.append([emp.user.username, emp.user.get_full_name()] + daily + [total])
+    wb.save(fileobj)
+
+
+# ----------------- ĐỒNG BỘ QUA SIGNAL -----------------
+
+def refresh_flags(sheets, shift_for):
+    """
+    Tính lại late/early_leave của các DailyTimesheet trong queryset `sheets` theo ca
+    `shift_for(employee_id)`; giờ công không phụ thuộc ca nên không đọc lại chấm công thô.
+    Trả về số dòng đã đổi.
+    """
+    changed = []
+    for sheet in sheets.only("id", "employee_id", "date", "first_in", "last_out", "late", "early_leave").iterator():
+        flags = shift_flags(sheet.date, sheet.first_in, sheet.last_out, shift_for(sheet.employee_id))
+        if flags != (sheet.late, sheet.early_leave):
+            sheet.late, sheet.early_leave = flags
+            changed.append(sheet)
+    if changed:
+        DailyTimesheet.objects.bulk_update(changed, ["late", "early_leave"], batch_size=1000)
+        dashboard_cache.invalidate_all()
+    return len(changed)
+
+
+def open_period_start(today=None):
+    """Ngày đầu của các tháng còn mở: tháng này và TIMESHEET_FLAG_REFRESH_MONTHS tháng trước."""
+    today = today or timezone.localdate()
+    i = today.year * 12 + today.month - 1 - getattr(settings, "TIMESHEET_FLAG_REFRESH_MONTHS", 1)
+    return date(i // 12, i % 12 + 1, 1)
+
+
+def _open_sheets(**filters):
+    return DailyTimesheet.objects.filter(date__gte=open_period_start(), **filters)
+
+
+def _pk(value):
+    return None if value in (None, "") else int(value)
+
+
+_UNKNOWN = object()
+
+
+def _employee_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Ca đang lưu trong DB, để biết lần lưu này có đổi ca không. Chỉ đọc khi lưu nhân
+    # viên đã có (một truy vấn), không gắn vào mọi instance được nạp
+    instance._previous_shift_id = _UNKNOWN
+    if raw or instance._state.adding or "shift_id" not in instance.__dict__:
+        return  # tạo mới, nạp fixture, hoặc trường ca bị defer: ca không đổi
+    if update_fields is not None and not {"shift", "shift_id"} & set(update_fields):
+        return
+    instance._previous_shift_id = (Employee.objects.filter(pk=instance.pk)
+                                   .values_list("shift_id", flat=True).first())
+
+
+def _employee_saved(sender, instance, created, raw=False, **kwargs):
+    previous = instance.__dict__.pop("_previous_shift_id", _UNKNOWN)
+    shift_id = _pk(instance.shift_id) if "shift_id" in instance.__dict__ else None
+    if previous is not _UNKNOWN and shift_id != previous:
+        shift = Shift.objects.filter(pk=shift_id).first() if shift_id else None
+        refresh_flags(_open_sheets(employee_id=instance.pk), lambda _: shift)
+
+
+def _shift_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        refresh_flags(_open_sheets(employee__shift_id=instance.pk), lambda _: instance)
+
+
+def _shift_deleting(sender, instance, **kwargs):
+    # Employee.shift là SET_NULL (UPDATE không có signal): ghi lại ai đang dùng ca này
+    instance._employee_ids = list(Employee.objects.filter(shift_id=instance.pk).values_list("pk", flat=True))
+
+
+def _shift_deleted(sender, instance, **kwargs):
+    ids = getattr(instance, "_employee_ids", None)
+    if ids:
+        refresh_flags(_open_sheets(employee_id__in=ids), lambda _: None)
+
+
+def _refresh_if_exists(employee_id, day):
+    employee = Employee.objects.filter(pk=employee_id).only("pk", "shift_id").first()
+    if employee is not None:  # xoá theo nhân viên (CASCADE): DailyTimesheet đã bị xoá theo
+        refresh_day(employee, day)
+
+
+def _attendance_deleted(sender, instance, **kwargs):
+    # Chạy sau commit: khi đang xoá cả nhân viên, lúc này mới biết chắc nhân viên còn hay không
+    if instance.employee_id:
+        day = timezone.localtime(instance.timestamp).date()
+        transaction.on_commit(lambda: _refresh_if_exists(instance.employee_id, day))
+
+
+def connect_signals():
+    pre_save.connect(_employee_saving, sender=Employee, dispatch_uid="timesheet:employee:pre_save")
+    post_save.connect(_employee_saved, sender=Employee, dispatch_uid="timesheet:employee:save")
+    post_save.connect(_shift_saved, sender=Shift, dispatch_uid="timesheet:shift:save")
+    pre_delete.connect(_shift_deleting, sender=Shift, dispatch_uid="timesheet:shift:pre_delete")
+    post_delete.connect(_shift_deleted, sender=Shift, dispatch_uid="timesheet:shift:delete")
+    # Xoá qua ORM (admin, shell); archive.py xoá bằng _raw_delete nên không đi qua đây
+    post_delete.connect(_attendance_deleted, sender=Attendance, dispatch_uid="timesheet:attendance:delete")
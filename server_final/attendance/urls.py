@@ -7,16 +7,23 @@ urlpatterns = [
     path('web/logout/', views.web_logout, name='web_logout'),
     # API for mobile
     path('api/clock/', views.api_clock, name='api_clock'),
+    path('api/clock/async/', views.api_clock_async, name='api_clock_async'),
+    path('api/clock/batch/', views.api_clock_batch, name='api_clock_batch'),
+    path('api/clock/status/<int:pk>/', views.api_clock_status, name='api_clock_status'),
+    path('api/kiosk/clock/', views.api_kiosk_clock, name='api_kiosk_clock'),
     path('api/attendance/history/', views.api_history, name='api_history'),
+    path('api/attendance/<int:pk>/versions/', views.api_attendance_versions, name='api_attendance_versions'),
     path('api/employee/me/', views.api_employee_me, name='api_employee_me'),
     path('api/employee/change-password/', views.api_change_password, name='api_change_password'),
 
     # Web dashboard & management
     path('web/dashboard/', views.web_dashboard, name='web_dashboard'),
     path('web/monitor/', views.web_monitor, name='web_monitor'),
+    path('web/monitor/feed/', views.web_monitor_feed, name='web_monitor_feed'),
 
     path('web/employees/', views.web_employees, name='web_employees'),
     path('web/employees/new/', views.web_employee_new, name='web_employee_new'),
+    path('web/employees/import/', views.web_hr_import, name='web_hr_import'),
     path('web/employees/<int:pk>/edit/', views.web_employee_edit, name='web_employee_edit'),
     path('web/employees/<int:pk>/toggle/', views.web_employee_toggle, name='web_employee_toggle'),
     path('web/employees/<int:pk>/reset-password/', views.web_employee_reset_password, name='web_employee_reset_password'),
@@ -24,3 +24,13 @@ def month_bounds(d: date):
     else:
         end = start.replace(month=start.month+1, day=1) - timedelta(days=1)
     return start, end
+
+def local_day_range(start: date, end: date):
+    """
+    Khoảng [start 00:00, end+1 00:00) theo giờ địa phương, dạng datetime có múi giờ.
+    Lọc theo khoảng này thay cho timestamp__date để DB dùng được index trên cột.
+    """
+    from django.utils import timezone
+    lo = timezone.make_aware(datetime.combine(start, time.min))
+    hi = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    return lo, hi
@@ -0,0 +1,198 @@
+"""
+Xác thực khuôn mặt cho chấm công 1:1, chạy đồng bộ hoặc trì hoãn.
+
+Ở chế độ trì hoãn (api_clock_async), bản chấm công được ghi ngay với trạng thái
+"pending" và ảnh được giữ trong bộ nhớ cho tới khi một luồng nền gửi nó sang face
+engine; kết quả được ghi lại thành "verified" hoặc "rejected". Bản ghi bị từ chối
+không được tính công (DailyTimesheet của ngày đó được tính lại).
+
+Chỉ ảnh bị từ chối mới thành "rejected". Lỗi của hệ thống nhận diện (quá tải, hết
+thời gian, worker chết) giữ bản ghi ở "pending" và xếp hàng xác thực lại bằng timer,
+không giữ luồng nền: face engine bận thì chờ 1, 2, 4... giây (tối đa
+FACE_VERIFY_REQUEUE_DELAY), lỗi khác thì chờ FACE_VERIFY_REQUEUE_DELAY giây; tối đa
+FACE_VERIFY_REQUEUES lần, sau đó bản ghi vẫn pending để HR kiểm tra.
+
+Mỗi job giữ ảnh trong bộ nhớ tới khi có kết luận, nên số job đang chờ (kể cả đang đợi
+xếp hàng lại) bị giới hạn bởi FACE_VERIFY_MAX_PENDING: vượt quá thì api_clock_async
+trả 503, và job không nhận được nữa thì bản ghi chờ HR kiểm tra.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import clock_metrics, clocking, face_engine
+from .face_engine import FaceEngineBusy, FaceEngineError, min_cosine_distance, unpack_templates
+
+logger = logging.getLogger(__name__)
+
+FACE_DISTANCE_THRESHOLD = 0.40  # Ngưỡng cosine distance cho VGG-Face
+
+
+def employee_templates(emp):
+    """Ma trận các mẫu khuôn mặt đã đăng ký của `emp` (mỗi dòng một vector đơn vị)."""
+    return unpack_templates(emp.face_templates, emp.face_embedding)
+
+
+def verify_face(emp, image_bytes, timeout=None):
+    """
+    So khớp ảnh `image_bytes` với các mẫu khuôn mặt của `emp`. Trả về (ok, message).
+    Lỗi của face engine (bận, hết thời gian...) được ném ra cho nơi gọi xử lý.
+    """
+    return _match(employee_templates(emp), face_engine.represent(image_bytes, timeout=timeout))
+
+
+async def verify_face_async(emp, image_bytes, timeout=None):
+    """Như verify_face, chờ face engine trên event loop (attendance/async_api.py)."""
+    return _match(employee_templates(emp), await face_engine.represent_async(image_bytes, timeout=timeout))
+
+
+def verify_faces(emp, images, timeout=None):
+    """
+    Như verify_face cho nhiều ảnh của cùng một nhân viên, trong một lượt suy luận theo lô.
+    Ảnh chưa được xử lý vì face engine lỗi (hết slot...) nhận (None, message).
+    """
+    templates = employee_templates(emp)
+    out = []
+    for live_results in face_engine.represent_many(images, timeout=timeout):
+        if isinstance(live_results, FaceEngineError):
+            out.append((None, str(live_results)))
+        elif isinstance(live_results, Exception):
+            out.append((False, f"Lỗi xử lý ảnh: {str(live_results)}"))
+        else:
+            out.append(_match(templates, live_results))
+    return out
+
+
+def _match(templates, live_results):
+    if not live_results:
+        return False, "Không nhận diện được khuôn mặt trong ảnh bạn gửi."
+    if len(live_results) > 1:
+        return False, "Phát hiện nhiều khuôn mặt trong ảnh chấm công."
+
+    # Một phép nhân ma trận-vector với mọi mẫu đã chuẩn hoá sẵn, lấy mẫu gần nhất
+    distance = min_cosine_distance(templates, live_results[0]['embedding'])
+    if distance > FACE_DISTANCE_THRESHOLD:
+        return False, f"Xác thực khuôn mặt thất bại (Khoảng cách: {distance:.2f}). Đây không phải bạn."
+    return True, ""
+
+
+# ----------------- XÁC THỰC TRÌ HOÃN -----------------
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0  # số job đang giữ ảnh: chờ chạy, đang chạy hoặc chờ xếp hàng lại
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Các luồng này chỉ chờ face engine (process pool), không tự chạy model
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "FACE_VERIFY_THREADS", 4),
+                thread_name_prefix="face-verify",
+            )
+        return _executor
+
+
+def saturated():
+    """True nếu hàng đợi xác thực trì hoãn đã đầy (api_clock_async trả 503)."""
+    return _pending >= getattr(settings, "FACE_VERIFY_MAX_PENDING", 100)
+
+
+def _acquire():
+    global _pending
+    with _executor_lock:
+        if _pending >= getattr(settings, "FACE_VERIFY_MAX_PENDING", 100):
+            return False
+        _pending += 1
+        return True
+
+
+def _release():
+    global _pending
+    with _executor_lock:
+        _pending = max(_pending - 1, 0)
+
+
+def _requeue(attendance_id, image_bytes, requeued, busy=False):
+    """Xác thực lại sau một khoảng chờ; trả về False nếu đã hết số lần (job kết thúc)."""
+    from .models import Attendance
+
+    pending = Attendance.objects.filter(pk=attendance_id, verification="pending")
+    if requeued >= getattr(settings, "FACE_VERIFY_REQUEUES", 10):
+        logger.error("Bỏ xác thực lại Attendance #%s sau %s lần: face engine vẫn lỗi", attendance_id, requeued)
+        pending.update(verification_message="Chưa xác thực được do lỗi hệ thống nhận diện, chờ HR kiểm tra.")
+        return False
+    pending.update(verification_message="Hệ thống nhận diện đang bận, sẽ xác thực lại.")
+    delay = getattr(settings, "FACE_VERIFY_REQUEUE_DELAY", 30)
+    if busy:
+        delay = min(2 ** requeued, delay)  # chờ hàng đợi của face engine vơi bớt
+    timer = threading.Timer(delay, lambda: _get_executor().submit(_run, attendance_id, image_bytes, requeued + 1))
+    timer.daemon = True
+    timer.start()
+    return True
+
+
+def _run(attendance_id, image_bytes, requeued=0):
+    from .models import Attendance
+    from .timesheet import refresh_day
+
+    close_old_connections()
+    done = True
+    try:
+        att = Attendance.objects.select_related("employee").get(pk=attendance_id)
+        ok = busy = None  # ok None: face engine lỗi, chưa có kết luận về ảnh
+        try:
+            ok, message = verify_face(att.employee, image_bytes)
+        except FaceEngineBusy:
+            busy = True
+        except FaceEngineError:
+            pass
+        except Exception as e:
+            ok, message = False, f"Lỗi xử lý ảnh: {str(e)}"
+
+        if ok is None:
+            done = not _requeue(attendance_id, image_bytes, requeued, busy=busy)
+            return
+        if ok:
+            clock_metrics.record_success(att.employee_id)
+        else:
+            clock_metrics.record_failure(att.employee_id)
+        day = timezone.localtime(att.timestamp).date()
+        with transaction.atomic():
+            if not ok:
+                # Khoá ngày như clock() để lần chấm công đồng thời không ghi đè tổng hợp
+                clocking._lock_day(att.employee_id, day)
+            Attendance.objects.filter(pk=attendance_id).update(
+                verification="verified" if ok else "rejected", verification_message=message,
+            )
+            if not ok:
+                refresh_day(att.employee, day)
+    except Exception:
+        logger.exception("Xác thực khuôn mặt trì hoãn thất bại cho Attendance #%s", attendance_id)
+    finally:
+        if done:
+            _release()
+        close_old_connections()
+
+
+def _start(attendance_id, image_bytes):
+    from .models import Attendance
+
+    if not _acquire():
+        logger.warning("Hàng đợi xác thực trì hoãn đầy, bỏ qua Attendance #%s", attendance_id)
+        Attendance.objects.filter(pk=attendance_id, verification="pending").update(
+            verification_message="Hệ thống nhận diện quá tải, chờ HR kiểm tra.",
+        )
+        return
+    _get_executor().submit(_run, attendance_id, image_bytes)
+
+
+def submit(attendance_id, image_bytes):
+    """Xếp hàng xác thực cho bản chấm công pending, sau khi transaction hiện tại commit."""
+    transaction.on_commit(lambda: _start(attendance_id, image_bytes))
@@ -2,113 +2,126 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
-from django.db.models import Count, Q, Min, Max
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse, FileResponse
+from django.db.models import Count, Q, Max
 from django.utils import timezone
-from django.views.decorators.csrf import csrf_exempt
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
 from rest_framework import status
-from datetime import date, datetime, time, timedelta
-import io
-import csv
-import json 
-import os 
-import uuid 
-
-# Thêm import cho deepface và numpy
-try:
-    print("Attempting to import DeepFace and NumPy...")
-    from deepface import DeepFace
-    import numpy as np
-    from numpy.linalg import norm as l2_norm # Import L2 norm
-    print("DeepFace and NumPy imported successfully.")
-except Exception as e:
-    print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-    print("CRITICAL ERROR: Failed to import 'deepface' or 'numpy'.")
-    print(f"The actual error is: {e}")
-    print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-    DeepFace = None
-    np = None
-    l2_norm = None
-
-# Thêm import để xử lý file tạm
-from django.core.files.storage import default_storage
-
-from .models import Department, Position, Role, WorkLocation, Shift, Employee, Attendance, AttendanceChangeLog
+from datetime import date, datetime
+import tempfile
+import json
+import hashlib
+
+from .models import WorkLocation, Shift, Employee, Attendance, DailyTimesheet
 from .serializers import (
-    EmployeeMeSerializer, EmployeeSerializer, AttendanceSerializer, WorkLocationSerializer, ShiftSerializer
+    EmployeeMeSerializer, WorkLocationSerializer,
+    HISTORY_ITEM_FIELDS, history_item,
+)
+from .utils import week_bounds, month_bounds, local_day_range
+from . import face_engine
+from .face_engine import FaceEngineError, FaceEngineBusy, FaceEngineTimeout
+from .face_engine import pack_templates
+from . import verification
+from .verification import FACE_DISTANCE_THRESHOLD, verify_face
+from .face_index import face_index
+from . import dashboard_cache
+from . import monitor
+from . import importer
+from . import clock_metrics
+from . import archive
+from . import audit
+from .refdata import refdata
+from . import clocking
+from .clocking import ClockError, employee_queryset, resolve_location
+from .timesheet import (
+    iter_month_rows, iter_month_csv, month_days, write_month_xlsx, refresh_for_attendance, summarize_day
 )
-from .utils import haversine_m, week_bounds, month_bounds
 
-# Cấu hình model deepface
-FACE_MODEL_NAME = "VGG-Face"
-FACE_DISTANCE_THRESHOLD = 0.40 # Ngưỡng cho FaceNet (Cosine Distance)
 
 # ----------------- HÀM HELPER -----------------
 
-def _findCosineDistance(source_representation, test_representation):
-    """
-    Tính toán Cosine Distance bằng NumPy.
+def _enroll_face_helper(employee_instance, image_files, append=False):
     """
-    if np is None or l2_norm is None:
-        raise ImportError("NumPy library not loaded correctly.")
-        
-    a = np.asarray(source_representation)
-    b = np.asarray(test_representation)
-    dot_product = np.dot(a, b)
-    norm_a = l2_norm(a)
-    norm_b = l2_norm(b)
-    similarity = dot_product / (norm_a * norm_b)
-    distance = 1.0 - similarity
-    return distance
-
-def _enroll_face_helper(employee_instance, image_file):
-    """
-    Hàm trợ giúp xử lý file ảnh, tạo embedding và lưu vào employee.
+    Hàm trợ giúp xử lý một hoặc nhiều file ảnh, chấm chất lượng từng ảnh và lưu
+    các mẫu đạt yêu cầu (tối đa FACE_MAX_TEMPLATES) vào employee.
+    `append=True` giữ lại các mẫu đã có. Trả về (success, error_message).
     """
-    if DeepFace is None:
+    if not face_engine.available():
         return (False, "Lỗi: Thư viện 'deepface' chưa được cài đặt trên server.")
+    if not isinstance(image_files, (list, tuple)):
+        image_files = [image_files]
 
-    tmp_name = f"tmp/{uuid.uuid4()}_{image_file.name}"
-    tmp_path = default_storage.save(tmp_name, image_file)
-    tmp_full_path = default_storage.path(tmp_path)
-    
-    error_message = None
-    success = False
+    # Đọc thẳng buffer multipart, không ghi file tạm
+    images = [f.read() for f in image_files]
+    min_quality = getattr(settings, "FACE_QUALITY_MIN", 0.5)
+    max_templates = getattr(settings, "FACE_MAX_TEMPLATES", 5)
 
     try:
-        # ---- THAY ĐỔI: Dùng detector_backend='mtcnn' và enforce_detection=False ----
-        results = DeepFace.represent(
-            img_path=tmp_full_path, 
-            model_name=FACE_MODEL_NAME, 
-            enforce_detection=False, # Sửa: Tắt báo lỗi, để chúng ta tự kiểm tra
-            detector_backend='mtcnn'  # Sửa: Chỉ định rõ detector là 'mtcnn'
-        )
-        
-        # 'results' bây giờ là một list.
-        # Chúng ta cần kiểm tra xem nó có rỗng (không tìm thấy) hay nhiều hơn 1
-        if not results:
-            error_message = "Không nhận diện được khuôn mặt. Vui lòng thử ảnh khác rõ nét và chính diện hơn."
+        # Chạy MTCNN + VGG-Face trên các worker, kèm điểm chất lượng của từng khuôn mặt
+        all_results = face_engine.represent_many(images, quality=True)
+    except FaceEngineError as e:
+        return (False, str(e))
+
+    samples, problems = [], []
+    for f, results in zip(image_files, all_results):
+        name = getattr(f, "name", "ảnh")
+        if isinstance(results, Exception):
+            # Ví dụ: file ảnh bị hỏng
+            problems.append(f"{name}: lỗi xử lý ảnh ({results})")
+        elif not results:
+            problems.append(f"{name}: không nhận diện được khuôn mặt")
         elif len(results) > 1:
-            error_message = "Phát hiện có quá nhiều khuôn mặt. Vui lòng thử ảnh chỉ có một người."
+            problems.append(f"{name}: có nhiều hơn một khuôn mặt")
         else:
-            # Thành công, results có 1 phần tử
-            embedding = results[0]['embedding']
-            employee_instance.face_embedding = json.dumps(embedding)
-            employee_instance.save() 
-            success = True
-        
-    except Exception as e:
-        # Bắt các lỗi khác (ví dụ: file ảnh bị hỏng)
-        error_message = f"Lỗi xử lý ảnh: {str(e)}"
-    finally:
-        if default_storage.exists(tmp_path):
-            default_storage.delete(tmp_path)
-    
-    return (success, error_message)
+            q = results[0].get("quality") or {}
+            if q.get("score", 1.0) < min_quality:
+                detail = f"độ nét {q['sharpness']}, cỡ mặt {q['size']}px"
+                if q["roll"] is not None:
+                    detail += f", nghiêng {q['roll']}°"
+                problems.append(f"{name}: chất lượng thấp (điểm {q['score']:.2f}; {detail})")
+            else:
+                samples.append((q.get("score", 1.0), results[0]["embedding"]))
+
+    if not samples:
+        return (False, "Không có ảnh nào đạt yêu cầu. Vui lòng chụp rõ nét, chính diện, đủ sáng. "
+                + "; ".join(problems))
+
+    # Giữ các ảnh tốt nhất; mẫu cũ (nếu giữ lại) được ưu tiên sau ảnh mới
+    embeddings = [e for _, e in sorted(samples, key=lambda s: -s[0])]
+    if append and employee_instance.face_embedding:
+        embeddings += list(verification.employee_templates(employee_instance))
+    templates, centroid = pack_templates(embeddings[:max_templates])
+    employee_instance.face_templates = templates
+    employee_instance.face_embedding = centroid
+    employee_instance.save(update_fields=["face_templates", "face_embedding"])
+    if employee_instance.is_active:
+        face_index.upsert(employee_instance.pk, employee_instance.face_embedding)
+
+    if problems:
+        return (True, f"Đã lưu {len(samples)} ảnh; bỏ qua: " + "; ".join(problems))
+    return (True, None)
+
+def _sync_face_index(emp, was_indexed):
+    """
+    Đồng bộ trạng thái hoạt động của nhân viên vào chỉ mục nhận diện 1:N. `was_indexed`
+    là trạng thái trước khi sửa; không đổi thì không chạm vào chỉ mục (mỗi lần đổi
+    buộc các tiến trình kiosk nạp lại).
+    """
+    indexed = bool(emp.is_active and emp.face_embedding)
+    if indexed == was_indexed:
+        return
+    if indexed:
+        face_index.upsert(emp.pk, emp.face_embedding)
+    else:
+        face_index.remove(emp.pk)
 
 def user_has_role(user, *roles):
     # (Hàm này giữ nguyên)
@@ -118,7 +131,8 @@ def user_has_role(user, *roles):
         emp = user.employee
     except Exception:
         return False
-    if emp.role and emp.role.name in roles:
+    role = refdata.get("roles", emp.role_id)
+    if role and role.name in roles:
         return True
     return False
 
@@ -135,94 +149,235 @@ def require_roles(*roles):
         return _wrapped
     return _decorator
 
+def _record_punch(request, emp, extra=None, verification_state="verified"):
+    """
+    Kiểm tra địa điểm, xác định IN/OUT rồi ghi bản chấm công cho `emp`.
+    Dùng chung cho api_clock (1:1) và api_kiosk_clock (1:N). `emp` phải được nạp
+    bằng clocking.employee_queryset() để không phát sinh thêm truy vấn.
+    """
+    lat = float(request.POST.get("latitude"))
+    lon = float(request.POST.get("longitude"))
+    t = request.POST.get("type", None) 
+    work_location_id = request.POST.get("work_location_id", None)
+
+    try:
+        loc = resolve_location(emp, work_location_id, lat, lon)
+        att, distance, within = clocking.clock(emp, lat, lon, loc, t=t, user=request.user, verification=verification_state)
+    except ClockError as e:
+        return Response({"ok": False, "message": e.message}, status=e.status)
+    t = att.type
+
+    data = {
+        "ok": True, "within_geofence": within, "distance_m": round(distance,2), "type": t,
+        "timestamp": att.timestamp, "work_location": WorkLocationSerializer(loc).data
+    }
+    if extra:
+        data.update(extra(att) if callable(extra) else extra)
+    return Response(data, status=202 if att.verification == "pending" else 200)
+
 # ---------------- API (Cập nhật api_clock) -----------------
+# api_clock chia thành bước trước và sau nhận diện để bản ASGI (async_api.py) dùng chung
+
+def _clock_employee(request):
+    """Nhân viên và ảnh khuôn mặt của request chấm công: (emp, ảnh, None) hoặc (None, None, lỗi)."""
+    if not face_engine.available():
+        return None, None, Response({"ok": False, "message": "Tính năng nhận diện khuôn mặt chưa được cài đặt trên server (DeepFace/NumPy)."}, status=500)
+
+    # Nạp sẵn ca làm việc và địa điểm được phép (2 truy vấn) cho bước ghi
+    emp = get_object_or_404(employee_queryset(), user=request.user, is_active=True)
+
+    if not emp.face_embedding:
+        return None, None, Response({"ok": False, "message": "Tài khoản của bạn chưa đăng ký khuôn mặt. Vui lòng liên hệ quản trị."}, status=400)
+
+    if 'face_image' not in request.FILES:
+        return None, None, Response({"ok": False, "message": "Yêu cầu hình ảnh khuôn mặt để chấm công."}, status=400)
+
+    return emp, request.FILES['face_image'].read(), None
+
+
+def _face_error_response(e):
+    if isinstance(e, FaceEngineBusy):
+        return Response({"ok": False, "message": str(e)}, status=503, headers={"Retry-After": "2"})
+    if isinstance(e, FaceEngineTimeout):
+        return Response({"ok": False, "message": str(e)}, status=504)
+    # Các lỗi khác (file hỏng,...)
+    return Response({"ok": False, "message": f"Lỗi xử lý ảnh: {str(e)}"}, status=500)
+
+
+def _clock_verified(request, emp, ok, message):
+    """Ghi nhận kết quả so khớp khuôn mặt rồi kiểm tra vị trí và ghi bản chấm công."""
+    if not ok:
+        clock_metrics.record_failure(emp.pk)
+        return Response({"ok": False, "message": message}, status=400)
+    clock_metrics.record_success(emp.pk)
+    return _record_punch(request, emp)
+
+
 @api_view(["POST"])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 def api_clock(request):
-    if DeepFace is None or np is None:
+    # --- 1. XÁC THỰC KHUÔN MẶT ---
+    emp, live_image_bytes, error = _clock_employee(request)
+    if error is not None:
+        return error
+
+    try:
+        # Mẫu đã lưu là vector đơn vị float32; so khớp bằng một tích vô hướng
+        ok, message = verify_face(emp, live_image_bytes)
+    except Exception as e:
+        return _face_error_response(e)
+
+    # --- 2. XÁC THỰC VỊ TRÍ ---
+    return _clock_verified(request, emp, ok, message)
+
+
+@api_view(["POST"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_clock_async(request):
+    """
+    Chấm công trì hoãn cho mạng yếu: ghi ngay bản chấm công "pending" kèm kết quả
+    geofence rồi trả về ticket; xác thực khuôn mặt chạy nền (verification.py).
+    Client hỏi kết quả qua api_clock_status.
+    """
+    if not face_engine.available():
         return Response({"ok": False, "message": "Tính năng nhận diện khuôn mặt chưa được cài đặt trên server (DeepFace/NumPy)."}, status=500)
 
-    emp = get_object_or_404(Employee, user=request.user, is_active=True)
-    
-    # --- 1. XÁC THỰC KHUÔN MẶT ---
+    emp = get_object_or_404(employee_queryset(), user=request.user, is_active=True)
     if not emp.face_embedding:
         return Response({"ok": False, "message": "Tài khoản của bạn chưa đăng ký khuôn mặt. Vui lòng liên hệ quản trị."}, status=400)
-    
     if 'face_image' not in request.FILES:
         return Response({"ok": False, "message": "Yêu cầu hình ảnh khuôn mặt để chấm công."}, status=400)
 
-    live_image_file = request.FILES['face_image']
-    
-    tmp_live_path = default_storage.save(f"tmp/{live_image_file.name}", live_image_file)
-    tmp_live_full_path = default_storage.path(tmp_live_path)
+    if verification.saturated():
+        return Response({"ok": False, "message": "Hệ thống nhận diện đang quá tải, vui lòng thử lại sau."}, status=503, headers={"Retry-After": "5"})
 
-    try:
-        # Load mẫu đã lưu từ DB
-        stored_embedding = json.loads(emp.face_embedding)
-        
-        # ---- THAY ĐỔI: Dùng detector_backend='mtcnn' và enforce_detection=False ----
-        live_results = DeepFace.represent(
-            img_path=tmp_live_full_path, 
-            model_name=FACE_MODEL_NAME, 
-            enforce_detection=False, # Sửa: Tắt báo lỗi
-            detector_backend='mtcnn'  # Sửa: Chỉ định 'mtcnn'
-        )
-        
-        if not live_results:
-            return Response({"ok": False, "message": "Không nhận diện được khuôn mặt trong ảnh bạn gửi."}, status=400)
-        if len(live_results) > 1:
-            return Response({"ok": False, "message": "Phát hiện nhiều khuôn mặt trong ảnh chấm công."}, status=400)
-        
-        # Thành công, lấy embedding
-        live_embedding = live_results[0]['embedding']
-        
-        # Sử dụng hàm helper _findCosineDistance (bằng NumPy)
-        distance = _findCosineDistance(stored_embedding, live_embedding)
+    live_image_bytes = request.FILES['face_image'].read()
 
-        if distance > FACE_DISTANCE_THRESHOLD:
-             return Response({"ok": False, "message": f"Xác thực khuôn mặt thất bại (Khoảng cách: {distance:.2f}). Đây không phải bạn."}, status=400)
-        
-    except Exception as e:
-        # Bắt các lỗi khác (file hỏng,...)
-        return Response({"ok": False, "message": f"Lỗi xử lý ảnh: {str(e)}"}, status=500)
-    finally:
-        if default_storage.exists(tmp_live_path):
-            default_storage.delete(tmp_live_path)
+    def _ticket(att):
+        verification.submit(att.pk, live_image_bytes)
+        return {"ticket": att.pk, "verification": att.verification}
 
-    # --- 2. XÁC THỰC VỊ TRÍ (Logic cũ, giữ nguyên) ---
-    lat = float(request.POST.get("latitude"))
-    lon = float(request.POST.get("longitude"))
-    t = request.POST.get("type", None) 
-    work_location_id = request.POST.get("work_location_id", None)
-    
-    if work_location_id is None:
-        loc = emp.allowed_locations.first()
-        if not loc:
-            return Response({"ok": False, "message": "Bạn chưa được cấu hình địa điểm chấm công."}, status=400)
-    else:
-        loc = get_object_or_404(WorkLocation, pk=int(work_location_id))
+    return _record_punch(request, emp, extra=_ticket, verification_state="pending")
 
-    if not emp.allowed_locations.filter(pk=loc.pk).exists():
-        return Response({"ok": False, "message": "Địa điểm này không thuộc phạm vi được phép."}, status=400)
 
-    distance = haversine_m(lat, lon, loc.latitude, loc.longitude)
-    within = distance <= loc.radius_m
+@api_view(["POST"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_clock_batch(request):
+    """
+    Đồng bộ một lô chấm công đã ghi khi offline. Trường `punches` là JSON list, mỗi
+    phần tử gồm client_id, timestamp (ISO 8601), latitude, longitude, tuỳ chọn
+    work_location_id/type và `image` là tên part chứa ảnh (mặc định face_image_<i>).
+    """
+    if not face_engine.available():
+        return Response({"ok": False, "message": "Tính năng nhận diện khuôn mặt chưa được cài đặt trên server (DeepFace/NumPy)."}, status=500)
 
-    if t not in ["IN","OUT"]:
-        today = timezone.localdate()
-        last_in = Attendance.objects.filter(employee=emp, type="IN", timestamp__date=today).order_by("-timestamp").first()
-        last_out = Attendance.objects.filter(employee=emp, type="OUT", timestamp__date=today).order_by("-timestamp").first()
-        t = "OUT" if last_in and (not last_out or last_in.timestamp > last_out.timestamp) else "IN"
+    emp = get_object_or_404(employee_queryset(), user=request.user, is_active=True)
+    if not emp.face_embedding:
+        return Response({"ok": False, "message": "Tài khoản của bạn chưa đăng ký khuôn mặt. Vui lòng liên hệ quản trị."}, status=400)
+
+    try:
+        raw = json.loads(request.POST.get("punches") or "[]")
+        if not isinstance(raw, list):
+            raise ValueError
+    except ValueError:
+        return Response({"ok": False, "message": "Dữ liệu 'punches' không hợp lệ."}, status=400)
+    max_items = getattr(settings, "CLOCK_BATCH_MAX", 200)
+    if not raw or len(raw) > max_items:
+        return Response({"ok": False, "message": f"Mỗi lô cần từ 1 đến {max_items} lượt chấm công."}, status=400)
+
+    items = []
+    for i, p in enumerate(raw):
+        try:
+            ts = parse_datetime(str(p["timestamp"]))
+            if ts is None:
+                raise ValueError
+            if timezone.is_naive(ts):
+                ts = timezone.make_aware(ts)
+            image_part = p.get("image") or f"face_image_{i}"
+            if image_part not in request.FILES:
+                raise ValueError
+            items.append({
+                "client_id": str(p["client_id"])[:64],
+                "timestamp": ts,
+                "latitude": float(p["latitude"]),
+                "longitude": float(p["longitude"]),
+                "work_location_id": p.get("work_location_id"),
+                "type": p.get("type"),
+                "image": request.FILES[image_part].read(),
+            })
+        except (KeyError, TypeError, ValueError):
+            return Response({"ok": False, "message": f"Lượt chấm công thứ {i + 1} thiếu dữ liệu hoặc ảnh."}, status=400)
+
+    try:
+        results = clocking.clock_batch(emp, items, user=request.user)
+    except ClockError as e:
+        return Response({"ok": False, "message": e.message}, status=e.status)
+    except FaceEngineBusy as e:
+        return Response({"ok": False, "message": str(e)}, status=503, headers={"Retry-After": "5"})
+    except FaceEngineTimeout as e:
+        return Response({"ok": False, "message": str(e)}, status=504)
+    return Response({"ok": True, "results": results})
 
-    att = Attendance.objects.create(
-        employee=emp, type=t, latitude=lat, longitude=lon,
-        distance_m=round(distance,2), within_geofence=within, work_location=loc, created_by=request.user
-    )
 
+@api_view(["GET"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_clock_status(request, pk):
+    att = get_object_or_404(Attendance, pk=pk, employee__user=request.user)
     return Response({
-        "ok": True, "within_geofence": within, "distance_m": round(distance,2), "type": t,
-        "timestamp": att.timestamp, "work_location": WorkLocationSerializer(loc).data
+        "ok": att.verification != "rejected",
+        "ticket": att.pk,
+        "verification": att.verification,
+        "message": att.verification_message,
+        "type": att.type,
+        "timestamp": att.timestamp,
+        "within_geofence": att.within_geofence,
+    })
+
+
+@api_view(["POST"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_kiosk_clock(request):
+    """
+    Chấm công trên máy kiosk dùng chung: nhận diện nhân viên 1:N trong số
+    toàn bộ nhân viên đang hoạt động đã đăng ký khuôn mặt.
+    """
+    if not user_has_role(request.user, 'Kiosk', 'Quản trị viên'):
+        return Response({"ok": False, "message": "Tài khoản này không được phép dùng chế độ kiosk."}, status=403)
+    if not face_engine.available():
+        return Response({"ok": False, "message": "Tính năng nhận diện khuôn mặt chưa được cài đặt trên server (DeepFace/NumPy)."}, status=500)
+    if 'face_image' not in request.FILES:
+        return Response({"ok": False, "message": "Yêu cầu hình ảnh khuôn mặt để chấm công."}, status=400)
+
+    live_image_bytes = request.FILES['face_image'].read()
+
+    try:
+        live_results = face_engine.represent(live_image_bytes)
+        if not live_results:
+            return Response({"ok": False, "message": "Không nhận diện được khuôn mặt trong ảnh bạn gửi."}, status=400)
+        if len(live_results) > 1:
+            return Response({"ok": False, "message": "Phát hiện nhiều khuôn mặt trong ảnh chấm công."}, status=400)
+
+        # Một phép nhân ma trận-vector trên toàn bộ embedding đã đăng ký
+        emp_id, distance = face_index.search(live_results[0]['embedding'])
+    except Exception as e:
+        return _face_error_response(e)
+
+    if emp_id is None or distance > FACE_DISTANCE_THRESHOLD:
+        clock_metrics.record_failure(None)
+        return Response({"ok": False, "message": "Không xác định được nhân viên. Vui lòng thử lại hoặc liên hệ quản trị."}, status=400)
+
+    emp = get_object_or_404(employee_queryset(), pk=emp_id, is_active=True)
+    clock_metrics.record_success(emp.pk)
+    return _record_punch(request, emp, extra={
+        "employee_id": emp.id,
+        "username": emp.user.username,
+        "full_name": emp.user.get_full_name(),
+        "face_distance": round(distance, 4),
     })
 
 
@@ -230,21 +385,10 @@ def api_clock(request):
 # ... (web_dashboard, web_monitor, web_employees, web_employee_edit, ...)
 # ... (đều giữ nguyên như phiên bản trước mà tôi đã cung cấp)
 
-@api_view(["GET","PATCH"])
-@authentication_classes([JWTAuthentication])
-@permission_classes([IsAuthenticated])
-def api_employee_me(request):
+def _employee_me(request):
     emp, _ = Employee.objects.get_or_create(user=request.user, defaults={"is_active": True})
     if request.method == "GET":
-        # ---- THÊM DÒNG PRINT 1 ----
-        print(f"DEBUG: Employee {emp.user.username} allowed locations BEFORE serialization: {list(emp.allowed_locations.all())}")
-        
-        serializer = EmployeeMeSerializer(emp)
-        
-        # ---- THÊM DÒNG PRINT 2 ----
-        print(f"DEBUG: Serializer data for allowed_locations: {serializer.data.get('allowed_locations')}") 
-        
-        return Response(serializer.data)
+        return Response(EmployeeMeSerializer(emp).data)
         
     # PATCH logic (giữ nguyên)
     user = request.user
@@ -256,6 +400,12 @@ def api_employee_me(request):
     emp.save()
     return Response(EmployeeMeSerializer(emp).data)
 
+@api_view(["GET","PATCH"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_employee_me(request):
+    return _employee_me(request)
+
 @api_view(["PATCH"])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -275,12 +425,23 @@ def api_change_password(request):
     request.user.save()
     return Response({"ok": True})
 
-@api_view(["GET"])
-@authentication_classes([JWTAuthentication])
-@permission_classes([IsAuthenticated])
-def api_history(request):
-    # (Giữ nguyên)
-    emp = get_object_or_404(Employee, user=request.user)
+def _archived_history_row(record):
+    """Dòng như `.values(*HISTORY_ITEM_FIELDS)` cho một bản ghi lưu trữ; địa điểm lấy từ refdata."""
+    loc = refdata.get("locations", record["work_location_id"])
+    row = {f: record[f] for f in HISTORY_ITEM_FIELDS if f in record}
+    for f in ("name", "latitude", "longitude", "radius_m"):
+        row[f"work_location__{f}"] = getattr(loc, f, None)
+    return row
+
+def _history(request):
+    """
+    Lịch sử chấm công theo ngày/tuần/tháng: cố định 4 truy vấn cho cả kỳ (nhân viên,
+    dấu vân tay cho ETag, các lượt chấm công join địa điểm, DailyTimesheet); lượt của
+    các tháng đã lưu trữ được đọc từ file (archive.py). Client gửi lại ETag qua
+    If-None-Match sẽ nhận 304 nếu dữ liệu của kỳ chưa đổi.
+    """
+    emp = get_object_or_404(Employee.objects.select_related("user"), user=request.user)
+    shift = refdata.get("shifts", emp.shift_id)
     period = request.GET.get("period", "day")
     date_str = request.GET.get("date")
     if date_str:
@@ -299,50 +460,58 @@ def api_history(request):
         start = base_date
         end = base_date
 
-    qs = Attendance.objects.filter(employee=emp, timestamp__date__gte=start, timestamp__date__lte=end).order_by("timestamp")
+    lo, hi = local_day_range(start, end)
+    period_qs = Attendance.objects.filter(employee=emp, timestamp__gte=lo, timestamp__lt=hi)
+
+    # Dấu vân tay của kỳ: thêm/xoá/sửa bản chấm công (mọi đường sửa đều đặt changed_at),
+    # kết quả xác thực trì hoãn, đổi ca của nhân viên (shift_id) hoặc giờ ca/địa điểm
+    # (phiên bản refdata) đều làm ETag đổi
+    fp = period_qs.aggregate(
+        n=Count("id"), last_id=Max("id"), changed=Max("changed_at"),
+        pending=Count("id", filter=Q(verification="pending")),
+        rejected=Count("id", filter=Q(verification="rejected")),
+    )
+    etag = quote_etag(hashlib.sha1(
+        f"{emp.pk}:{emp.shift_id}:{period}:{start}:{end}:{sorted(fp.items())}:{refdata.version()}".encode()
+    ).hexdigest())
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    rows = (period_qs.exclude(verification="rejected").order_by("timestamp", "id")
+            .values(*HISTORY_ITEM_FIELDS))
+    if archive.archived_overlap(lo, hi):
+        # Kỳ chạm tháng đã lưu trữ: ghép các lượt trong file lưu trữ (không truy vấn thêm)
+        rows = list(rows)
+        seen = {row["id"] for row in rows}
+        rows = sorted(rows + [_archived_history_row(r) for r in archive.iter_employee_records(emp.pk, lo, hi)
+                              if r["verification"] != "rejected" and r["id"] not in seen],
+                      key=lambda row: (row["timestamp"], row["id"]))
     days = {}
-    for a in qs:
-        d = a.timestamp.date()
-        days.setdefault(d, []).append(a)
+    for row in rows:
+        d = timezone.localtime(row["timestamp"]).date()
+        days.setdefault(d, []).append(row)
 
+    # Tổng giờ / đi trễ / về sớm đọc từ bảng tổng hợp; chỉ tính lại nếu ngày đó chưa có
+    sheets = {t.date: t for t in DailyTimesheet.objects.filter(employee=emp, date__gte=start, date__lte=end)}
     results = []
     total_hours_all = 0.0
     
     for d, items in sorted(days.items()):
-        total_hours = 0.0
-        ins = [x for x in items if x.type=="IN"]
-        outs = [x for x in items if x.type=="OUT"]
-        i = 0; j = 0
-        while i < len(ins) and j < len(outs):
-            if ins[i].timestamp <= outs[j].timestamp:
-                duration = (outs[j].timestamp - ins[i].timestamp).total_seconds()/3600.0
-                total_hours += max(0.0, duration)
-                i += 1; j += 1
-            else:
-                j += 1
-        total_hours_all += total_hours
-
-        late = False
-        early_leave = False
-        shift = emp.shift
-        if shift:
-            st = timezone.make_aware(datetime.combine(d, shift.start_time))
-            en = timezone.make_aware(datetime.combine(d, shift.end_time))
-            grace_in = timedelta(minutes=shift.late_grace_min)
-            grace_out = timedelta(minutes=shift.early_grace_min)
-            first_in = ins[0].timestamp if ins else None
-            last_out = outs[-1].timestamp if outs else None
-            if first_in and first_in > st + grace_in:
-                late = True
-            if last_out and last_out < en - grace_out:
-                early_leave = True
+        sheet = sheets.get(d)
+        if sheet is not None:
+            summary = {"total_hours": sheet.total_hours, "late": sheet.late, "early_leave": sheet.early_leave}
+        else:
+            summary = summarize_day(
+                d, [x["timestamp"] for x in items if x["type"]=="IN"], [x["timestamp"] for x in items if x["type"]=="OUT"], shift
+            )
+        total_hours_all += summary["total_hours"]
 
         results.append({
             "date": d, 
-            "items": AttendanceSerializer(items, many=True).data,
-            "total_hours": round(total_hours, 2),
-            "late": late,
-            "early_leave": early_leave,
+            "items": [history_item(x, emp) for x in items],
+            "total_hours": round(summary["total_hours"], 2),
+            "late": summary["late"],
+            "early_leave": summary["early_leave"],
         })
 
     return Response({
@@ -350,12 +519,53 @@ def api_history(request):
         "start": start, "end": end,
         "days": results,
         "sum_hours": round(total_hours_all,2)
-    })
+    }, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+@api_view(["GET"])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def api_history(request):
+    return _history(request)
+
+@api_view(["GET"])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def api_attendance_versions(request, pk):
+    """
+    Lịch sử sửa của một bản chấm công, dựng lại bằng cách phát lại các delta trong
+    AttendanceChangeLog (xem audit.py); phiên bản 1 luôn có mọi trường, kể cả với lượt
+    chấm công từ app không có log "created". `?version=n` hoặc `?at=<ISO 8601>` trả về một
+    phiên bản; không có tham số thì trả về mọi phiên bản. Nhân viên chỉ xem được
+    bản chấm công của chính mình.
+    """
+    # Kiểm tra quyền trước khi dựng lịch sử (có thể phải đọc file lưu trữ)
+    if not user_has_role(request.user, 'Quản trị viên', 'Nhân sự', 'Trưởng phòng'):
+        own = Employee.objects.filter(user=request.user).values_list("id", flat=True).first()
+        if own is None or audit.employee_id(pk) != own:
+            return Response({"ok": False, "message": "Bạn không có quyền xem bản chấm công này."}, status=403)
+    history = audit.versions(pk)
+    if not history:
+        return Response({"ok": False, "message": "Không tìm thấy bản chấm công này."}, status=404)
+
+    if "version" in request.GET or "at" in request.GET:
+        try:
+            version = int(request.GET["version"]) if "version" in request.GET else None
+            at = parse_datetime(request.GET["at"]) if "at" in request.GET else None
+        except ValueError:
+            at = version = None
+        if version is None and at is None:
+            return Response({"ok": False, "message": "Tham số version/at không hợp lệ."}, status=400)
+        if at is not None and timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        found = audit.version_at(pk, version=version, at=at, history=history)
+        if found is None:
+            return Response({"ok": False, "message": "Không có phiên bản này."}, status=404)
+        return Response({"attendance_id": pk, **found})
+    return Response({"attendance_id": pk, "versions": history})
 
 # ---------------- Web UI (Giữ nguyên) -----------------
 @login_required
 def web_dashboard(request):
-    # (Giữ nguyên)
     date_str = request.GET.get("date")
     view = request.GET.get("view", "day")
     if date_str:
@@ -371,56 +581,45 @@ def web_dashboard(request):
     else:
         start, end = base, base
 
-    total_emp = Employee.objects.filter(is_active=True).count()
-    present_ids = set(Attendance.objects.filter(type="IN", timestamp__date__gte=start, timestamp__date__lte=end).values_list("employee_id", flat=True))
-    present = len(present_ids)
-    absent = max(0, total_emp - present)
-    late_count = 0
-    for emp in Employee.objects.filter(is_active=True, shift__isnull=False):
-        ins = Attendance.objects.filter(employee=emp, type="IN", timestamp__date__gte=start, timestamp__date__lte=end).order_by("timestamp")
-        if ins.exists():
-            d = ins.first().timestamp.date()
-            st = timezone.make_aware(datetime.combine(d, emp.shift.start_time))
-            if ins.first().timestamp > st + timedelta(minutes=emp.shift.late_grace_min):
-                late_count += 1
-
-    daily_hours = []
-    days = Attendance.objects.filter(timestamp__date__gte=start, timestamp__date__lte=end).dates("timestamp", "day")
-    for d in days:
-        items = Attendance.objects.filter(timestamp__date=d).order_by("timestamp")
-        hours = 0.0
-        emps = Employee.objects.all()
-        for emp in emps:
-            emp_items = items.filter(employee=emp)
-            ins = list(emp_items.filter(type="IN"))
-            outs = list(emp_items.filter(type="OUT"))
-            i = 0; j = 0
-            emp_hours = 0.0
-            while i < len(ins) and j < len(outs):
-                if ins[i].timestamp <= outs[j].timestamp:
-                    emp_hours += max(0.0, (outs[j].timestamp - ins[i].timestamp).total_seconds()/3600.0)
-                    i += 1; j += 1
-                else:
-                    j += 1
-            hours += emp_hours
-        daily_hours.append((d, hours))
-
-    context = {
-        "total_emp": total_emp,
-        "present": present,
-        "absent": absent,
-        "late_count": late_count,
-        "date": base,
-        "view": view,
-        "daily_hours": daily_hours,
-    }
+    # Mọi KPI đọc từ DailyTimesheet với số truy vấn cố định, kể cả view=year,
+    # và được cache theo (view, start, end) cho tới khi dữ liệu trong khoảng thay đổi
+    context = dict(dashboard_cache.get_kpis(view, start, end))
+    context.update({"date": base, "view": view})
     return render(request, "attendance/dashboard.html", context)
 
+MONITOR_FILTERS = ("department_id", "work_location_id", "within_geofence", "type")
+
 @login_required
 def web_monitor(request):
-    # (Giữ nguyên)
-    recs = Attendance.objects.select_related("employee","work_location").order_by("-timestamp")[:100]
-    return render(request, "attendance/monitor.html", {"records": recs})
+    # Trang đầu render sẵn; trang cũ hơn và lượt mới được tải qua web_monitor_feed
+    params = {k: request.GET.get(k, "") for k in MONITOR_FILTERS}
+    # Con trỏ lượt mới lấy trước trang đầu: lượt commit xen giữa hiện hai lần, client bỏ trùng theo id
+    latest = monitor.start_cursor()
+    try:
+        records, next_cursor = monitor.page(monitor.filtered(params), limit=100)
+    except ValueError:
+        return HttpResponseBadRequest("Bộ lọc không hợp lệ.")
+    return render(request, "attendance/monitor.html", {
+        "records": records, "next_cursor": next_cursor or "", "latest": latest,
+        "departments": refdata.all("departments"), "locations": refdata.all("locations"), **params,
+    })
+
+@login_required
+def web_monitor_feed(request):
+    """
+    JSON cho màn hình giám sát, cùng bộ lọc với web_monitor.
+    ?before=<con trỏ>: trang cũ hơn; ?after=<con trỏ>&wait=<giây>: long-poll lượt mới.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 50)), monitor.MAX_LIMIT))
+        if request.GET.get("after") is not None:
+            wait = max(0.0, float(request.GET.get("wait", 0)))
+            items, cursor, more = monitor.newer(request.GET, request.GET["after"], limit=limit, wait=wait)
+            return JsonResponse({"results": items, "latest": cursor, "more": more})
+        items, next_cursor = monitor.page(monitor.filtered(request.GET), request.GET.get("before") or None, limit=limit)
+    except (ValueError, monitor.InvalidCursor):
+        return JsonResponse({"ok": False, "message": "Tham số không hợp lệ."}, status=400)
+    return JsonResponse({"results": items, "next": next_cursor})
 
 @login_required
 @require_roles('Quản trị viên','Nhân sự')
@@ -439,12 +638,7 @@ def web_employees(request):
 
         if User.objects.filter(username=username).exists():
             employees = Employee.objects.select_related("user","role","shift","department","position").all().order_by("user__username")
-            roles = Role.objects.all()
-            shifts = Shift.objects.all()
-            locations = WorkLocation.objects.all()
-            departments = Department.objects.all()
-            positions = Position.objects.all()
-            return render(request, "attendance/employees.html", {"error":"Username đã tồn tại.", "employees": employees, "roles": roles, "shifts": shifts, "locations": locations, "departments": departments, "positions": positions} )
+            return render(request, "attendance/employees.html", {"error":"Username đã tồn tại.", "employees": employees, **refdata.context()})
 
         user = User.objects.create_user(username=username, password="12345678", first_name=first_name, last_name=last_name, email=email)
         emp = Employee.objects.create(user=user, phone=phone, is_active=True,
@@ -452,22 +646,18 @@ def web_employees(request):
                                       department_id=dept_id if dept_id else None, position_id=pos_id if pos_id else None)
         loc_ids = request.POST.getlist("allowed_location_ids")
         if loc_ids:
-            emp.allowed_locations.set(WorkLocation.objects.filter(id__in=loc_ids))
+            emp.allowed_locations.set(loc_ids)
         emp.save()
+        dashboard_cache.invalidate_all()
 
-        if 'face_image' in request.FILES and request.FILES['face_image']:
-            image_file = request.FILES['face_image']
-            success, error = _enroll_face_helper(emp, image_file)
+        image_files = request.FILES.getlist('face_image')
+        if image_files:
+            success, error = _enroll_face_helper(emp, image_files)
             
             if not success:
                 employees = Employee.objects.select_related("user","role","shift","department","position").all().order_by("user__username")
-                roles = Role.objects.all()
-                shifts = Shift.objects.all()
-                locations = WorkLocation.objects.all()
-                departments = Department.objects.all()
-                positions = Position.objects.all()
                 context = {
-                    "employees": employees, "roles": roles, "shifts": shifts, "locations": locations, "departments": departments, "positions": positions,
+                    "employees": employees, **refdata.context(),
                     "error": f"Tạo người dùng {username} thành công, NHƯNG đăng ký khuôn mặt thất bại: {error}"
                 }
                 return render(request, "attendance/employees.html", context)
@@ -475,14 +665,31 @@ def web_employees(request):
         return redirect("web_employees")
 
     employees = Employee.objects.select_related("user","role","shift","department","position").all().order_by("user__username")
-    roles = Role.objects.all()
-    shifts = Shift.objects.all()
-    locations = WorkLocation.objects.all()
-    departments = Department.objects.all()
-    positions = Position.objects.all()
-    return render(request, "attendance/employees.html", {
-        "employees": employees, "roles": roles, "shifts": shifts, "locations": locations, "departments": departments, "positions": positions
-    })
+    return render(request, "attendance/employees.html", {"employees": employees, **refdata.context()})
+
+@login_required
+@require_roles('Quản trị viên','Nhân sự')
+def web_hr_import(request):
+    """Nhập nhân viên hàng loạt từ file Excel/CSV (xem importer.py)."""
+    context = {"columns": importer.COLUMNS, "default_password": importer.DEFAULT_PASSWORD}
+    if request.method == "POST":
+        f = request.FILES.get("file")
+        if not f:
+            context["error"] = "Bạn chưa chọn file."
+        else:
+            try:
+                created, errors = importer.import_file(f, f.name)
+            except importer.ImportFileError as e:
+                context["error"] = str(e)
+            except IntegrityError:
+                context["error"] = "Một số username vừa được tạo ở nơi khác trong lúc nhập nên chưa nhập nhân viên nào, vui lòng nhập lại file."
+            else:
+                if errors:
+                    context["error"] = f"File có {len(errors)} dòng lỗi, chưa nhập nhân viên nào."
+                    context["errors"] = errors[:200]
+                else:
+                    context["message"] = f"Đã tạo {created} nhân viên."
+    return render(request, "attendance/hr_import.html", context)
 
 @login_required
 def web_employee_new(request):
@@ -495,6 +702,7 @@ def web_employee_edit(request, pk):
     # (Giữ nguyên)
     emp = get_object_or_404(Employee, pk=pk)
     if request.method == "POST":
+        was_indexed = bool(emp.is_active and emp.face_embedding)
         emp.phone = request.POST.get("phone", emp.phone)
         emp.is_active = bool(request.POST.get("is_active", "1") == "1")
         emp.role_id = request.POST.get("role_id") or None
@@ -502,41 +710,40 @@ def web_employee_edit(request, pk):
         emp.department_id = request.POST.get("department_id") or None
         emp.position_id = request.POST.get("position_id") or None
         loc_ids = request.POST.getlist("allowed_location_ids")
-        emp.allowed_locations.set(WorkLocation.objects.filter(id__in=loc_ids))
+        emp.allowed_locations.set(loc_ids)
         emp.save()
+        _sync_face_index(emp, was_indexed)
+        dashboard_cache.invalidate_all()
         user = emp.user
         user.first_name = request.POST.get("first_name", user.first_name)
         user.last_name = request.POST.get("last_name", user.last_name)
         user.email = request.POST.get("email", user.email)
         user.save()
         return redirect("web_employees")
-    roles = Role.objects.all()
-    shifts = Shift.objects.all()
-    locations = WorkLocation.objects.all()
-    departments = Department.objects.all()
-    positions = Position.objects.all()
-    return render(request, "attendance/employee_edit.html", {"emp": emp, "roles": roles, "shifts": shifts, "locations": locations, "departments": departments, "positions": positions})
+    return render(request, "attendance/employee_edit.html", {"emp": emp, **refdata.context()})
 
 @login_required
 @require_roles('Quản trị viên','Nhân sự')
 def web_employee_enroll_face(request, pk):
     # (Giữ nguyên từ lần sửa trước)
-    if DeepFace is None:
+    if not face_engine.available():
         return HttpResponse("Lỗi: Thư viện 'deepface' chưa được cài đặt trên server.", status=500)
         
     emp = get_object_or_404(Employee, pk=pk)
     context = {"emp": emp, "error": None}
     
     if request.method == "POST":
-        if 'face_image' not in request.FILES or not request.FILES['face_image']:
+        image_files = request.FILES.getlist('face_image')
+        if not image_files:
             context["error"] = "Bạn chưa chọn file ảnh."
             return render(request, "attendance/web_employee_enroll_face.html", context)
         
-        image_file = request.FILES['face_image']
-        success, error = _enroll_face_helper(emp, image_file)
+        success, error = _enroll_face_helper(emp, image_files, append=bool(request.POST.get("append")))
             
-        if success:
+        if success and not error:
             return redirect("web_employee_edit", pk=emp.id)
+        elif success:
+            context["message"] = error
         else:
             context["error"] = error
 
@@ -548,8 +755,11 @@ def web_employee_enroll_face(request, pk):
 def web_employee_toggle(request, pk):
     # (Giữ nguyên)
     emp = get_object_or_404(Employee, pk=pk)
+    was_indexed = bool(emp.is_active and emp.face_embedding)
     emp.is_active = not emp.is_active
     emp.save()
+    _sync_face_index(emp, was_indexed)
+    dashboard_cache.invalidate_all()
     return redirect("web_employees")
 
 @login_required
@@ -583,7 +793,7 @@ def web_shifts(request):
         else:
             Shift.objects.create(**data)
         return redirect("web_shifts")
-    shifts = Shift.objects.all().order_by("name")
+    shifts = refdata.all("shifts")
     return render(request, "attendance/shifts.html", {"shifts": shifts})
 
 @login_required
@@ -606,7 +816,7 @@ def web_locations(request):
         else:
             WorkLocation.objects.create(**data)
         return redirect("web_locations")
-    locations = WorkLocation.objects.all().order_by("name")
+    locations = refdata.all("locations")
     return render(request, "attendance/locations.html", {"locations": locations})
 
 @login_required
@@ -615,7 +825,8 @@ def web_attendance_edit(request, pk):
     # (Giữ nguyên)
     a = get_object_or_404(Attendance, pk=pk)
     if request.method == "POST":
-        before = AttendanceSerializer(a).data
+        before = audit.snapshot(a)
+        previous = (a.employee_id, a.timestamp)
         a.type = request.POST.get("type", a.type)
         a.timestamp = timezone.make_aware(datetime.strptime(request.POST.get("timestamp"), "%Y-%m-%d %H:%M"))
         a.latitude = float(request.POST.get("latitude"))
@@ -624,10 +835,12 @@ def web_attendance_edit(request, pk):
         a.note = request.POST.get("note","")
         a.changed_by = request.user
         a.changed_at = timezone.now()
-        a.save()
-        AttendanceChangeLog.objects.create(attendance=a, action="edited", reason=request.POST.get("reason",""), before_data=before, after_data=AttendanceSerializer(a).data, changed_by=request.user)
+        with transaction.atomic():
+            a.save()
+            audit.log_change(a, "edited", before, user=request.user, reason=request.POST.get("reason",""))
+            refresh_for_attendance(a, previous)
         return redirect("web_monitor")
-    locations = WorkLocation.objects.all()
+    locations = refdata.all("locations")
     return render(request, "attendance/attendance_edit.html", {"a": a, "locations": locations})
 
 @login_required
@@ -637,94 +850,79 @@ def web_attendance_new(request):
     if request.method == "POST":
         emp_id = int(request.POST.get("employee_id"))
         emp = get_object_or_404(Employee, pk=emp_id)
-        a = Attendance.objects.create(
-            employee=emp,
-            type=request.POST.get("type","IN"),
-            timestamp=timezone.make_aware(datetime.strptime(request.POST.get("timestamp"), "%Y-%m-%d %H:%M")),
-            latitude=float(request.POST.get("latitude")),
-            longitude=float(request.POST.get("longitude")),
-            work_location_id=int(request.POST.get("work_location_id")),
-            note=request.POST.get("note",""),
-            created_by=request.user
-        )
-        AttendanceChangeLog.objects.create(attendance=a, action="created", reason=request.POST.get("reason",""), after_data=AttendanceSerializer(a).data, changed_by=request.user)
+        with transaction.atomic():
+            a = Attendance.objects.create(
+                employee=emp,
+                type=request.POST.get("type","IN"),
+                timestamp=timezone.make_aware(datetime.strptime(request.POST.get("timestamp"), "%Y-%m-%d %H:%M")),
+                latitude=float(request.POST.get("latitude")),
+                longitude=float(request.POST.get("longitude")),
+                work_location_id=int(request.POST.get("work_location_id")),
+                note=request.POST.get("note",""),
+                created_by=request.user
+            )
+            audit.log_change(a, "created", user=request.user, reason=request.POST.get("reason",""))
+            refresh_for_attendance(a)
         return redirect("web_monitor")
     employees = Employee.objects.select_related("user").all()
-    locations = WorkLocation.objects.all()
+    locations = refdata.all("locations")
     return render(request, "attendance/attendance_new.html", {"employees": employees, "locations": locations})
 
-@login_required
-@require_roles('Quản trị viên','Nhân sự','Trưởng phòng')
-def web_monthly(request):
-    # (Giữ nguyên)
+def _monthly_params(request):
+    """Tháng và danh sách nhân viên (đã lọc theo phòng ban/chức vụ) cho bảng công."""
     month = request.GET.get("month")
     if month:
         y, m = [int(x) for x in month.split("-")]
         d = date(y, m, 1)
     else:
         d = timezone.localdate().replace(day=1)
-    start, end = d.replace(day=1), month_bounds(d)[1]
-    employees = Employee.objects.filter(is_active=True).select_related("user","shift")
-    days = [(start + timedelta(days=i)) for i in range((end - start).days + 1)]
-    table = []
-    for emp in employees:
-        row = {"employee": emp, "daily": [], "total": 0.0}
-        for day in days:
-            items = Attendance.objects.filter(employee=emp, timestamp__date=day).order_by("timestamp")
-            ins = list(items.filter(type="IN"))
-            outs = list(items.filter(type="OUT"))
-            i=j=0; hours=0.0
-            while i < len(ins) and j < len(outs):
-                if ins[i].timestamp <= outs[j].timestamp:
-                    hours += (outs[j].timestamp - ins[i].timestamp).total_seconds()/3600.0
-                    i+=1; j+=1
-                else:
-                    j+=1
-            row["daily"].append(round(hours,2))
-            row["total"] += hours
-        row["total"] = round(row["total"],2)
-        table.append(row)
-    return render(request, "attendance/monthly.html", {"days": days, "table": table, "month": d.strftime("%Y-%m")})
+    employees = Employee.objects.filter(is_active=True)
+    dept_id = request.GET.get("department_id")
+    pos_id = request.GET.get("position_id")
+    if dept_id:
+        employees = employees.filter(department_id=dept_id)
+    if pos_id:
+        employees = employees.filter(position_id=pos_id)
+    return d, employees.select_related("user").order_by("id")
+
+@login_required
+@require_roles('Quản trị viên','Nhân sự','Trưởng phòng')
+def web_monthly(request):
+    d, employees = _monthly_params(request)
+    start, end = month_bounds(d)
+    days = month_days(start, end)
+    table = [
+        {"employee": emp, "daily": daily, "total": total}
+        for emp, daily, total in iter_month_rows(employees, start, end)
+    ]
+    return render(request, "attendance/monthly.html", {
+        "days": days, "table": table, "month": d.strftime("%Y-%m"),
+        "departments": refdata.all("departments"), "positions": refdata.all("positions"),
+        "department_id": request.GET.get("department_id", ""), "position_id": request.GET.get("position_id", ""),
+    })
 
 @login_required
 @require_roles('Quản trị viên','Nhân sự','Trưởng phòng')
 def web_monthly_export(request):
-    # (Giữ nguyên)
-    month = request.GET.get("month")
-    if month:
-        y, m = [int(x) for x in month.split("-")]
-        d = date(y, m, 1)
-    else:
-        d = timezone.localdate().replace(day=1)
-    start, end = d.replace(day=1), month_bounds(d)[1]
-    employees = Employee.objects.filter(is_active=True).select_related("user","shift")
-
-    days = [(start + timedelta(days=i)) for i in range((end - start).days + 1)]
-    output = io.StringIO()
-    writer = csv.writer(output)
-    header = ["Username", "Họ tên"] + [x.strftime("%d/%m") for x in days] + ["Tổng giờ"]
-    writer.writerow(header)
-
-    for emp in employees:
-        row = [emp.user.username, emp.user.get_full_name()]
-        total = 0.0
-        for day in days:
-            items = Attendance.objects.filter(employee=emp, timestamp__date=day).order_by("timestamp")
-            ins = list(items.filter(type="IN"))
-            outs = list(items.filter(type="OUT"))
-            i=j=0; hours=0.0
-            while i < len(ins) and j < len(outs):
-                if ins[i].timestamp <= outs[j].timestamp:
-                    hours += (outs[j].timestamp - ins[i].timestamp).total_seconds()/3600.0
-                    i+=1; j+=1
-                else:
-                    j+=1
-            row.append(round(hours,2))
-            total += hours
-        row.append(round(total,2))
-        writer.writerow(row)
+    d, employees = _monthly_params(request)
+    start, end = month_bounds(d)
+    # Đọc nhân viên theo từng khối thay vì nạp hết vào bộ nhớ
+    employees = employees.iterator()
+
+    if request.GET.get("format") == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            return HttpResponse("Lỗi: Thư viện 'openpyxl' chưa được cài đặt trên server.", status=500)
+        tmp = tempfile.TemporaryFile()
+        write_month_xlsx(tmp, employees, start, end)
+        tmp.seek(0)
+        return FileResponse(
+            tmp, as_attachment=True, filename=f"bang_cong_{d:%Y_%m}.xlsx",
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
 
-    resp = HttpResponse(output.getvalue(), content_type="text/csv")
+    resp = StreamingHttpResponse(iter_month_csv(employees, start, end), content_type="text/csv")
     resp['Content-Disposition'] = f'attachment; filename="bang_cong_{d:%Y_%m}.csv"'
     return resp
 
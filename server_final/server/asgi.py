@@ -1,5 +1,15 @@
-
 import os
-from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
-application = get_asgi_application()
+
+import django  # noqa: E402
+django.setup(set_prefix=False)
+
+# API di động phục vụ bằng coroutine (attendance/async_api.py), phần còn lại như Django
+from attendance.async_api import AsyncAPIHandler  # noqa: E402
+application = AsyncAPIHandler()
+
+# Tiến trình phục vụ nhận diện có thể nạp sẵn model; migrate, admin... không import deepface
+from django.conf import settings  # noqa: E402
+if getattr(settings, "FACE_ENGINE_PRELOAD", False):
+    from attendance import face_engine
+    face_engine.preload()
@@ -0,0 +1,16 @@
+"""
+SQLite cho cài đặt nhỏ chạy nhiều worker: bật WAL để người đọc không chặn người ghi
+và ngược lại, synchronous=NORMAL (an toàn với WAL, ít fsync hơn). Thời gian chờ khoá
+(busy timeout) đặt bằng OPTIONS["timeout"] (giây), như backend sqlite3 gốc.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    PRAGMAS = ("journal_mode=WAL", "synchronous=NORMAL")
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma in self.PRAGMAS:
+            conn.execute(f"PRAGMA {pragma}")
+        return conn
@@ -4,6 +4,7 @@ from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Cấu hình cho môi trường phát triển; production dùng server/settings_production.py
 SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", "dev-secret-key")
 DEBUG = True
 ALLOWED_HOSTS = ["*"]
@@ -19,7 +20,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework_simplejwt",
     "corsheaders",
-    "attendance",
+    "attendance.apps.AttendanceConfig",
 ]
 
 MIDDLEWARE = [
@@ -85,3 +86,61 @@ REST_FRAMEWORK = {
 CORS_ALLOW_ALL_ORIGINS = True
 
 LOGIN_URL = '/web/login/'
+
+# Worker pool nhận diện khuôn mặt (attendance/face_engine.py)
+FACE_ENGINE_WORKERS = int(os.environ.get("FACE_ENGINE_WORKERS", 2))
+FACE_ENGINE_MAX_PENDING = int(os.environ.get("FACE_ENGINE_MAX_PENDING", 8))  # số job tối đa đang chờ
+FACE_ENGINE_TIMEOUT = float(os.environ.get("FACE_ENGINE_TIMEOUT", 15))       # giây
+# Nạp model ngay khi server khởi động (server/wsgi.py); tắt thì nạp ở request nhận diện đầu tiên
+FACE_ENGINE_PRELOAD = os.environ.get("FACE_ENGINE_PRELOAD", "") == "1"
+FACE_VERIFY_THREADS = int(os.environ.get("FACE_VERIFY_THREADS", 4))           # luồng nền cho chấm công trì hoãn
+FACE_VERIFY_REQUEUES = int(os.environ.get("FACE_VERIFY_REQUEUES", 10))        # số lần xếp hàng lại khi face engine lỗi
+FACE_VERIFY_REQUEUE_DELAY = float(os.environ.get("FACE_VERIFY_REQUEUE_DELAY", 30))  # giây giữa các lần đó
+FACE_VERIFY_MAX_PENDING = int(os.environ.get("FACE_VERIFY_MAX_PENDING", 100))  # số ảnh tối đa chờ xác thực nền
+FACE_ENROLL_DIR = os.environ.get("FACE_ENROLL_DIR", str(BASE_DIR / "enrollment"))  # zip ảnh tải lên qua admin
+FACE_ENROLL_WORKERS = int(os.environ.get("FACE_ENROLL_WORKERS", 1))   # worker riêng cho đăng ký hàng loạt qua admin
+FACE_QUALITY_MIN = float(os.environ.get("FACE_QUALITY_MIN", 0.5))     # điểm chất lượng tối thiểu của ảnh đăng ký
+FACE_MAX_TEMPLATES = int(os.environ.get("FACE_MAX_TEMPLATES", 5))      # số mẫu khuôn mặt tối đa mỗi nhân viên
+CLOCK_RETRY_WINDOW = int(os.environ.get("CLOCK_RETRY_WINDOW", 600))    # giây; lần thử lại sau đó tính là lượt mới
+
+# Lưu trữ chấm công cũ (attendance/archive.py, lệnh archive_attendance)
+ATTENDANCE_RETENTION_MONTHS = int(os.environ.get("ATTENDANCE_RETENTION_MONTHS", 24))  # số tháng giữ trong bảng
+ATTENDANCE_ARCHIVE_DIR = os.environ.get("ATTENDANCE_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+# Đổi ca chỉ tính lại cờ đi trễ/về sớm của tháng này và số tháng trước này (attendance/timesheet.py)
+TIMESHEET_FLAG_REFRESH_MONTHS = int(os.environ.get("TIMESHEET_FLAG_REFRESH_MONTHS", 1))
+
+# Cache: mặc định bộ nhớ cục bộ của tiến trình; đặt DJANGO_CACHE=redis (cần django-redis)
+# hoặc memcached (cần python-memcached) để các worker dùng chung. DJANGO_CACHE=file chỉ
+# dùng khi phát triển: incr của FileBasedCache không nguyên tử giữa các tiến trình, nên
+# các bộ đếm phiên bản (refdata, dashboard, face_index) có thể mất lần tăng.
+_CACHE = os.environ.get("DJANGO_CACHE", "locmem")
+if _CACHE == "file":
+    CACHES = {"default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", str(BASE_DIR / "cache")),
+    }}
+elif _CACHE == "redis":
+    CACHES = {"default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "redis://127.0.0.1:6379/1"),
+    }}
+elif _CACHE == "memcached":
+    CACHES = {"default": {
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "127.0.0.1:11211"),
+    }}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Thời gian sống (giây) của KPI dashboard cho các khoảng còn dính tới tháng hiện tại
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get("DASHBOARD_CACHE_TIMEOUT", 300))
+
+# Số lượt chấm công tối đa trong một lô đồng bộ offline (api/clock/batch/)
+CLOCK_BATCH_MAX = int(os.environ.get("CLOCK_BATCH_MAX", 200))
+
+# Màn hình giám sát: thời gian giữ một request long-poll và chu kỳ kiểm tra lượt mới (giây)
+MONITOR_LONGPOLL_TIMEOUT = int(os.environ.get("MONITOR_LONGPOLL_TIMEOUT", 25))
+MONITOR_POLL_INTERVAL = float(os.environ.get("MONITOR_POLL_INTERVAL", 0.5))
+
+# Số tiến trình băm mật khẩu khi nhập nhân viên hàng loạt (mặc định: số CPU)
+IMPORT_HASH_WORKERS = int(os.environ.get("IMPORT_HASH_WORKERS", 0)) or None
@@ -0,0 +1,115 @@
+"""
+Cấu hình production: DJANGO_SETTINGS_MODULE=server.settings_production.
+
+Khác server/settings.py (phát triển):
+- DEBUG tắt (DEBUG giữ lại mọi câu SQL của mỗi request trong bộ nhớ), SECRET_KEY
+  bắt buộc lấy từ môi trường.
+- DB_ENGINE=postgresql (mặc định): kết nối được giữ lại giữa các request
+  (CONN_MAX_AGE). Khi đi qua PgBouncer ở chế độ transaction (DB_POOLER=pgbouncer)
+  thì tắt server-side cursor và không gửi tham số khởi động như statement_timeout.
+- DB_ENGINE=sqlite: cho cài đặt nhỏ, WAL + busy timeout (server/backends/sqlite_wal).
+- Cache dùng chung giữa các worker, cần cho refdata, màn hình giám sát và số liệu thử
+  lại chấm công: mặc định Redis (DJANGO_CACHE=redis), hoặc DJANGO_CACHE=memcached.
+  Các bộ đếm phiên bản dựa trên incr nguyên tử nên cache file/locmem bị từ chối.
+- HTTPS (DJANGO_HTTPS=1, mặc định): chuyển hướng sang HTTPS, cookie chỉ gửi qua HTTPS
+  và HSTS, để `manage.py check --deploy` không còn cảnh báo. Cài đặt trong mạng nội
+  bộ chỉ có HTTP đặt DJANGO_HTTPS=0.
+- Template được biên dịch một lần cho mỗi tiến trình (cached loader).
+"""
+import copy
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+os.environ.setdefault("DJANGO_CACHE", "redis")
+
+from .settings import *  # noqa: E402,F401,F403
+from .settings import BASE_DIR, CACHES, TEMPLATES  # noqa: E402
+
+if CACHES["default"]["BACKEND"] not in ("django_redis.cache.RedisCache",
+                                        "django.core.cache.backends.memcached.MemcachedCache"):
+    raise ImproperlyConfigured(
+        f"DJANGO_CACHE={os.environ['DJANGO_CACHE']} không dùng được cho production: cần cache dùng chung "
+        "có incr nguyên tử (redis hoặc memcached)."
+    )
+
+DEBUG = os.environ.get("DJANGO_DEBUG", "") == "1"
+
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
+if not SECRET_KEY:
+    raise ImproperlyConfigured("Cần đặt DJANGO_SECRET_KEY cho cấu hình production.")
+
+ALLOWED_HOSTS = [h.strip() for h in os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",") if h.strip()]
+
+# ----------------- CƠ SỞ DỮ LIỆU -----------------
+
+DB_ENGINE = os.environ.get("DB_ENGINE", "postgresql")
+# Giây giữ một kết nối để dùng lại cho các request sau; 0 = mở mới cho mỗi request
+CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 60))
+
+if DB_ENGINE == "postgresql":
+    _pooler = os.environ.get("DB_POOLER", "")
+    _options = {
+        "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 5)),
+        "application_name": os.environ.get("DB_APPLICATION_NAME", "attendance"),
+    }
+    if os.environ.get("DB_SSLMODE"):
+        _options["sslmode"] = os.environ["DB_SSLMODE"]
+    if os.environ.get("DB_STATEMENT_TIMEOUT_MS") and not _pooler:
+        # PgBouncer từ chối tham số khởi động lạ; khi có pooler đặt timeout trên role/database
+        _options["options"] = f"-c statement_timeout={int(os.environ['DB_STATEMENT_TIMEOUT_MS'])}"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "attendance"),
+            "USER": os.environ.get("POSTGRES_USER", "attendance"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "127.0.0.1"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            # Pooler chế độ transaction không giữ cursor có tên giữa các transaction (.iterator())
+            "DISABLE_SERVER_SIDE_CURSORS": bool(_pooler),
+            "OPTIONS": _options,
+        }
+    }
+elif DB_ENGINE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "server.backends.sqlite_wal",
+            "NAME": os.environ.get("SQLITE_PATH", str(BASE_DIR / "db.sqlite3")),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            "OPTIONS": {"timeout": float(os.environ.get("SQLITE_BUSY_TIMEOUT", 20))},  # giây chờ khi DB đang bị khoá ghi
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"DB_ENGINE không hợp lệ: {DB_ENGINE} (postgresql hoặc sqlite)")
+
+# ----------------- TEMPLATE, SESSION -----------------
+
+TEMPLATES = copy.deepcopy(TEMPLATES)
+TEMPLATES[0]["APP_DIRS"] = False
+TEMPLATES[0]["OPTIONS"]["loaders"] = [
+    ("django.template.loaders.cached.Loader", [
+        "django.template.loaders.filesystem.Loader",
+        "django.template.loaders.app_directories.Loader",
+    ]),
+]
+
+# Phiên web đọc từ cache, chỉ ghi xuống DB khi thay đổi
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+if os.environ.get("DJANGO_BEHIND_PROXY") == "1":
+    SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
+
+if os.environ.get("DJANGO_HTTPS", "1") == "1":
+    SECURE_SSL_REDIRECT = True
+    SESSION_COOKIE_SECURE = CSRF_COOKIE_SECURE = True
+    SECURE_HSTS_SECONDS = int(os.environ.get("DJANGO_HSTS_SECONDS", 3600))
+SECURE_REFERRER_POLICY = "same-origin"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "root": {"handlers": ["console"], "level": os.environ.get("DJANGO_LOG_LEVEL", "WARNING")},
+}
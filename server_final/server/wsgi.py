@@ -1,5 +1,10 @@
-
 import os
 from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 application = get_wsgi_application()
+
+# Tiến trình phục vụ nhận diện có thể nạp sẵn model; migrate, admin... không import deepface
+from django.conf import settings  # noqa: E402
+if getattr(settings, "FACE_ENGINE_PRELOAD", False):
+    from attendance import face_engine
+    face_engine.preload()